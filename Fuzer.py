@@ -8,17 +8,93 @@ image can be added and the name of the final file specified. See the doc-string
 for the fuzer function below for more details.
 """
 
-from io import BufferedReader
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import redirect_stdout
+from io import BufferedReader, BytesIO
+import mmap
 import os
 import re
+import secrets
+import signal
 import sys
+import threading
+import time
 
 import click
-import mutagen
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3, APIC
+from mutagen.id3 import (
+    APIC,
+    CHAP,
+    CTOC,
+    CTOCFlags,
+    Frames,
+    ID3,
+    ID3NoHeaderError,
+    TIT2,
+    TLEN,
+    TPOS,
+    TRCK,
+    TXXX,
+    WXXX,
+)
 from mutagen.mp3 import MP3
 
+from dirwatch import DirectoryWatcher
+from mpeg import (
+    FrameIndex,
+    FrameLog,
+    estimate_duration,
+    is_vbr_header_frame,
+    parse_frame_header,
+    stream_formats,
+    takes_xing_frame,
+    vbr_header_frames,
+    xing_frame,
+)
+from profiling import Profiler
+from progress import ProgressReporter, callback_listener, print_progress
+from tagindex import BATCH_SIZE, INDEX_ENVIRONMENT_VARIABLE, TagIndex
+import manifest
+import server
+
+# Size of the chunks used when streaming the audio portion of the input files
+# into the output file. Memory use during the merge is bounded by this value no
+# matter how big the individual tracks are.
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Largest single os.copy_file_range/os.sendfile call, so that progress can be
+# reported and a cancel noticed while a big track is copied by the kernel
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+# Number of threads used to read the tags of the input files. Reading tags is
+# dominated by I/O latency (especially on network storage) so this can be well
+# above the number of CPUs.
+DEFAULT_JOBS = 8
+
+# Number of tracks copied into the book at the same time. Copying them one
+# after the other is best on spinning disks, SSDs and parallel filesystems
+# can keep several copies going.
+DEFAULT_COPY_THREADS = 1
+
+# Number of worker processes building books at the same time in batch and
+# watch mode
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Seconds a file in a watched folder has to stay the same size before it is
+# read, so files that are still being copied in are left alone
+DEFAULT_SETTLE_SECONDS = 10
+
+# Bytes of padding reserved at the end of the output file's ID3 tag so that the
+# tags can be edited later without the whole (possibly huge) file being rewritten
+DEFAULT_TAG_PADDING = 16 * 1024
+
+# Text encodings used by ID3v2 text frames, indexed by the frame's first byte
+ID3_TEXT_ENCODINGS = ("latin-1", "utf-16", "utf-16-be", "utf-8")
+
 
 class TrackError(Exception):
     def __init__(self, problems):
@@ -37,49 +113,89 @@ class AlreadyExistsError(Exception):
         super().__init__(self.message)
 
 
-## Functions ##
-def split_tags_from_sound(mp3:BufferedReader) -> tuple[str, bytes, bytes]:
+class BuildCancelledError(Exception):
+    def __init__(self, file_name):
+        sys.tracebacklimit = 0  # Don't show traceback for this exception
+        self.file_name = file_name
+        self.message = f"Cancelled, {self.file_name} was removed"
+        super().__init__(self.message)
+
+
+class UnsupportedTagError(Exception):
+    """
+    Raised by read_text_frames when a tag uses a feature (ID3v2.2, whole tag
+    unsynchronisation, compressed or encrypted frames) that the lightweight
+    frame walker doesn't handle. Callers fall back to mutagen.
     """
-    # split_tags_from_sound(mp3)
-    #
-    # Takes an mp3 file (read into a String via an "rb" open) and figures out
-    # where the ID3 tags are and separates it from the mp3 portion of the mp3
-    # file.
-    #
-    # Arguments:
-    #  mp3 - the whole mp3 file
-    #
-    # Returns: (tag_type, id3, mp3) where tag type is "v1" or "v2", id3 is the
-    #          tag portion of the file, and mp3 is the sound portion of the
-    #          file.
-    """
-    tags = None
-    music = None
-    #mp3_contents = mp3.read()
-    #if mp3_contents.find(b"TAG") == 0:
-    if mp3.find(b"TAG") == 0:
-        tag_type = "v1"
-        #tags = mp3_contents[:128]
-        #music = mp3_contents[128:]
-        tags = mp3[:128]
-        music = mp3[128:]
-    #elif mp3_contents.find(b"ID3") == 0:
-    elif mp3.find(b"ID3") == 0:
-        tag_type = "v2"
-        # The tags are at the start of the file
-        # v1 tags, 128 bytes long. Assuming extended v1 tags are not used
-        #tagSize = header_size(mp3_contents[6:10])
-        #tags = mp3_contents[:tagSize]
-        #music = mp3_contents[tagSize:]
-        tagSize = header_size(mp3[6:10])
-        tags = mp3[:tagSize]
-        music = mp3[tagSize:]
-    else:
-        print("tags not at the start")
-    return tag_type, tags, music
-    ## split_tags_from_sound ##
 
 
+class TrackInfo:
+    """
+    Everything Fuzer needs to know about one input file, gathered with a single
+    open and a single tag parse so that sorting, naming, writing and tagging
+    never have to go back to the file for its metadata.
+
+    Attributes:
+        path: the path to the mp3 file
+        disc: (disc number, total discs) or None if the tag is missing
+        track: (track number, total tracks) or None if the tag is missing
+        album: the album tag or None
+        title: the title tag or None
+        audio_offset: the byte offset where the sound portion of the file starts
+        audio_length: the number of bytes of sound following audio_offset
+        tags: the ID3 text and URL frames of the file as a {key: [values]} dict,
+        keyed on the frame id, or "TXXX:description" and "WXXX:description"
+        for the user defined ones
+        first_frame: the 4-byte header of the first audio frame or None
+        duration: the playing time in seconds worked out from the frame headers,
+        or None if there's no audio
+    """
+
+    __slots__ = (
+        "path",
+        "disc",
+        "track",
+        "album",
+        "title",
+        "audio_offset",
+        "audio_length",
+        "tags",
+        "first_frame",
+        "duration",
+    )
+
+    def __init__(
+        self,
+        path,
+        disc,
+        track,
+        album,
+        title,
+        audio_offset,
+        audio_length,
+        tags,
+        first_frame=None,
+        duration=None,
+    ):
+        self.path = path
+        self.disc = disc
+        self.track = track
+        self.album = album
+        self.title = title
+        self.audio_offset = audio_offset
+        self.audio_length = audio_length
+        self.tags = tags
+        self.first_frame = first_frame
+        self.duration = duration
+
+    def __fspath__(self) -> str:
+        return os.fspath(self.path)
+
+    def __repr__(self) -> str:
+        return f"TrackInfo({self.path!r}, disc={self.disc}, track={self.track})"
+
+
+## Functions ##
 def header_size(size_bytes:bytes) -> int:
     """
     # header_size(size_bytes)
@@ -113,25 +229,516 @@ def header_size(size_bytes:bytes) -> int:
     ## header_size ##
 
 
-def sort_tracks(source_files:list[click.File], in_file_order:bool) -> list[click.File]:
+def audio_offset(in_file:BufferedReader) -> int:
+    """
+    Reads just enough of the start of an open mp3 file to find where the sound
+    portion begins, i.e. the size of the leading ID3v2 tags, found the same
+    way audio_range finds them. The rest of the file is never read. An ID3v1
+    tag only ever counts at the end of a file.
+
+    Arguments:
+        in_file: an mp3 file opened in "rb" mode and positioned at its start
+
+    Returns: an int, the byte offset of the first byte of audio
+    """
+    start = in_file.tell()
+    offset = 0
+    while True:
+        header = in_file.read(10)
+        if len(header) < 10 or header[:3] != b"ID3":
+            return offset
+        offset += 10 + header_size(header[6:10])
+        if header[5] & 0x10:
+            # A v2.4 tag with a footer carries another 10 bytes after the frames
+            offset += 10
+        in_file.seek(start + offset)
+    ## audio_offset ##
+
+
+def audio_range(data:bytes|memoryview|mmap.mmap) -> tuple[int, int]:
+    """
+    Finds the audio of a whole mp3 file held in memory, or better mapped into
+    it, by looking only at its start and its end, so a memory-mapped file only
+    has those pages read. Handled are any number of ID3v2 tags stacked at the
+    start (each with an optional v2.4 footer) and, at the end, an ID3v1 tag,
+    an APEv2 tag and a v2.4 tag found by its footer, in any order.
+
+    Arguments:
+        data: the contents of the file
+
+    Returns: (start, end), the audio is data[start:end]
+    """
+    start, end = 0, len(data)
+    while end - start >= 10 and data[start : start + 3] == b"ID3":
+        flags = data[start + 5]
+        start += 10 + header_size(data[start + 6 : start + 10])
+        if flags & 0x10:
+            start += 10
+    while end > start:
+        if end - start >= 128 and data[end - 128 : end - 125] == b"TAG":
+            end -= 128
+        elif end - start >= 32 and data[end - 32 : end - 24] == b"APETAGEX":
+            footer = data[end - 32 : end]
+            size = int.from_bytes(footer[12:16], "little")
+            if int.from_bytes(footer[20:24], "little") & 0x80000000:
+                size += 32  # the tag has a header as well as a footer
+            end = max(end - size, start)
+        elif end - start >= 20 and data[end - 10 : end - 7] == b"3DI":
+            end = max(end - 20 - header_size(data[end - 4 : end]), start)
+        else:
+            break
+    return min(start, end), end
+    ## audio_range ##
+
+
+def file_audio_range(in_file:BufferedReader) -> tuple[int, int]:
+    """
+    Arguments:
+        in_file: an mp3 file opened in "rb" mode
+
+    Returns: (start, end) of the audio in the file, see audio_range
+    """
+    if os.fstat(in_file.fileno()).st_size == 0:
+        return 0, 0
+    with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return audio_range(data)
+    ## file_audio_range ##
+
+
+def decode_text_frame(data:bytes) -> list[str]:
+    """
+    Decodes the body of an ID3v2 text frame (TALB, TPOS, TRCK, ...)
+
+    Arguments:
+        data: the frame contents following the 10-byte frame header
+
+    Returns: the list of strings stored in the frame
+    """
+    if not data or data[0] >= len(ID3_TEXT_ENCODINGS):
+        return []
+    text = data[1:].decode(ID3_TEXT_ENCODINGS[data[0]], errors="replace")
+    # Each UTF-16 string has its own byte order mark
+    strings = (x.lstrip("\ufeff") for x in text.rstrip("\x00").split("\x00"))
+    return [x for x in strings if x]
+    ## decode_text_frame ##
+
+
+def decode_frame(frame_id:str, data:bytes) -> tuple[str, list[str]]|None:
+    """
+    Decodes the body of an ID3v2 text or URL frame
+
+    Arguments:
+        frame_id: the id of the frame, e.g. TALB, TXXX, WOAR or WXXX
+        data: the frame contents following the 10-byte frame header
+
+    Returns: (key, strings), where key is frame_id, or "TXXX:description" and
+    "WXXX:description" for the user defined frames, or None if the frame is
+    empty or broken
+    """
+    if frame_id == "TXXX":
+        # The description and values share the frame's encoding
+        if not data or data[0] >= len(ID3_TEXT_ENCODINGS):
+            return None
+        text = data[1:].decode(ID3_TEXT_ENCODINGS[data[0]], errors="replace")
+        description, *values = [x.lstrip("\ufeff") for x in text.rstrip("\x00").split("\x00")]
+        return f"TXXX:{description}", [x for x in values if x]
+    if frame_id == "WXXX":
+        # The description is in the frame's encoding, the URL always latin-1
+        if not data or data[0] >= len(ID3_TEXT_ENCODINGS):
+            return None
+        terminator = b"\x00\x00" if data[0] in (1, 2) else b"\x00"
+        end = data.find(terminator, 1)
+        while terminator == b"\x00\x00" and end != -1 and (end - 1) % 2:
+            end = data.find(terminator, end + 1)
+        if end == -1:
+            return None
+        description = data[1:end].decode(ID3_TEXT_ENCODINGS[data[0]], errors="replace")
+        url = data[end + len(terminator) :].decode("latin-1").rstrip("\x00")
+        return f"WXXX:{description}", [url] if url else []
+    if frame_id[0] == "W":
+        url = data.decode("latin-1").rstrip("\x00")
+        return frame_id, [url] if url else []
+    return frame_id, decode_text_frame(data)
+    ## decode_frame ##
+
+
+def read_text_frames(in_file:BufferedReader) -> tuple[int, dict[str, list[str]]]:
+    """
+    Walks the frames of the ID3v2 tag at the start of an open mp3 file and
+    decodes only the text and URL frames (album, title, disc and track numbers,
+    the rest of the T*** frames, user defined TXXX frames like MusicBrainz ids
+    and W*** links, all copied by add_tags). Every other frame, notably
+    multi-megabyte APIC cover images, is skipped with a seek so it is never
+    read. Only the 10-byte tag header and the frame headers are read otherwise.
+
+    Arguments:
+        in_file: an mp3 file opened in "rb" mode and positioned at its start
+
+    Returns: (offset, frames) where offset is the byte offset of the first byte
+    of audio and frames is a {key: [strings]} dict of the frames, see
+    decode_frame
+
+    Raises: UnsupportedTagError if the tag can't be walked without mutagen
+    """
+    header = in_file.read(10)
+    if header[:3] != b"ID3" or len(header) < 10:
+        in_file.seek(0)
+        return audio_offset(in_file), {}
+
+    version, flags = header[3], header[5]
+    if version not in (3, 4) or flags & 0x80:
+        raise UnsupportedTagError(f"ID3v2.{version} flags {flags:#x}")
+    tag_end = 10 + header_size(header[6:10])
+
+    position = 10
+    if flags & 0x40:
+        # Skip the extended header, v2.3 doesn't count its own size field
+        size_bytes = in_file.read(4)
+        if version == 4:
+            position += header_size(size_bytes)
+        else:
+            position += 4 + int.from_bytes(size_bytes, "big")
+        in_file.seek(position)
+
+    frames = {}
+    while position + 10 <= tag_end:
+        frame_header = in_file.read(10)
+        frame_id = frame_header[:4]
+        if len(frame_header) < 10 or frame_id[:1] == b"\x00":
+            break  # Reached the padding
+        if version == 4:
+            size = header_size(frame_header[4:8])
+        else:
+            size = int.from_bytes(frame_header[4:8], "big")
+        position += 10 + size
+        if position > tag_end:
+            break
+
+        if frame_id[:1] not in (b"T", b"W"):
+            in_file.seek(position)
+            continue
+        format_flags = frame_header[9]
+        if format_flags & (0x0F if version == 4 else 0xC0):
+            raise UnsupportedTagError(f"{frame_id!r} flags {format_flags:#x}")
+        data = in_file.read(size)
+        if format_flags & (0x40 if version == 4 else 0x20):
+            # A group id byte comes before the frame's contents
+            data = data[1:]
+        decoded = decode_frame(frame_id.decode("latin-1"), data)
+        if decoded is None:
+            continue
+        key, strings = decoded
+        if key[0] == "W" and key in frames:
+            # There can be several WCOM or WOAR links
+            frames[key] = frames[key] + strings
+        else:
+            frames[key] = strings
+
+    # Any further tags stacked after this one are skipped too
+    in_file.seek(0)
+    return audio_offset(in_file), frames
+    ## read_text_frames ##
+
+
+def copy_audio(
+    in_file:BufferedReader,
+    out_file,
+    offset:int,
+    buffer_size:int=DEFAULT_BUFFER_SIZE,
+    length:int|None=None,
+    on_chunk=None,
+    on_copied=None,
+) -> int:
+    """
+    Copies everything from offset to the end of in_file into out_file without
+    ever holding more than buffer_size bytes in memory. When both files are real
+    files, and nobody needs to see the data, the copy is done in the kernel with
+    os.copy_file_range (or os.sendfile) so the audio never passes through Python
+    at all.
+
+    Arguments:
+        in_file: the input mp3 file opened in "rb" mode
+        out_file: a binary file object opened for writing
+        offset: where the audio starts in in_file
+        buffer_size: the size of the chunks used by the fallback copy loop
+        length: optional, the number of bytes to copy if it is already known
+        on_chunk: optional, called with a memoryview of each chunk as it is
+        copied, e.g. FrameIndex.feed
+        on_copied: optional, called with the number of bytes written after each
+        chunk, it may raise to stop the copy
+
+    Returns: an int, the number of bytes copied
+    """
+    if length is None:
+        length = os.fstat(in_file.fileno()).st_size - offset
+    if length <= 0:
+        return 0
+
+    try:
+        out_fd = out_file.fileno()
+    except (AttributeError, OSError):
+        out_fd = None
+
+    copied = 0
+    if out_fd is not None and on_chunk is None:
+        out_file.flush()
+        in_fd = in_file.fileno()
+        for kernel_copy in ("copy_file_range", "sendfile"):
+            if not hasattr(os, kernel_copy):
+                continue
+            try:
+                while copied < length:
+                    count = min(length - copied, KERNEL_COPY_CHUNK)
+                    if kernel_copy == "copy_file_range":
+                        sent = os.copy_file_range(in_fd, out_fd, count, offset + copied)
+                    else:
+                        sent = os.sendfile(out_fd, in_fd, offset + copied, count)
+                    if sent == 0:
+                        break
+                    copied += sent
+                    if on_copied:
+                        on_copied(sent)
+                return copied
+            except OSError:
+                # Not supported between these two files (e.g. a pipe or an
+                # old kernel), carry on from wherever the kernel got to
+                continue
+
+    in_file.seek(offset + copied)
+    buffer = memoryview(bytearray(buffer_size))
+    while copied < length:
+        read = in_file.readinto(buffer[: min(buffer_size, length - copied)])
+        if not read:
+            break
+        out_file.write(buffer[:read])
+        if on_chunk:
+            on_chunk(buffer[:read])
+        copied += read
+        if on_copied:
+            on_copied(read)
+    return copied
+    ## copy_audio ##
+
+
+def copy_audio_at(
+    in_file:BufferedReader,
+    out_fd:int,
+    offset:int,
+    out_offset:int,
+    length:int,
+    buffer_size:int=DEFAULT_BUFFER_SIZE,
+    on_chunk=None,
+    on_copied=None,
+) -> int:
+    """
+    Like copy_audio, but the audio is written at out_offset without the
+    position of the output file being used or moved, so several tracks can be
+    copied into the same file at once.
+
+    Arguments:
+        in_file: the input mp3 file opened in "rb" mode, used by this copy only
+        out_fd: the file descriptor of the output file
+        offset: where the audio starts in in_file
+        out_offset: where the audio goes in the output file
+        length: the number of bytes to copy
+        buffer_size: the size of the chunks used by the fallback copy loop
+        on_chunk: optional, called with a memoryview of each chunk as it is
+        copied
+        on_copied: optional, called with the number of bytes written after each
+        chunk, it may raise to stop the copy
+
+    Returns: an int, the number of bytes copied
+    """
+    copied = 0
+    if on_chunk is None and hasattr(os, "copy_file_range"):
+        in_fd = in_file.fileno()
+        try:
+            while copied < length:
+                count = min(length - copied, KERNEL_COPY_CHUNK)
+                sent = os.copy_file_range(
+                    in_fd, out_fd, count, offset + copied, out_offset + copied
+                )
+                if sent == 0:
+                    break
+                copied += sent
+                if on_copied:
+                    on_copied(sent)
+            return copied
+        except OSError:
+            pass  # carry on from wherever the kernel got to
+
+    in_file.seek(offset + copied)
+    buffer = memoryview(bytearray(buffer_size))
+    while copied < length:
+        read = in_file.readinto(buffer[: min(buffer_size, length - copied)])
+        if not read:
+            break
+        written = 0
+        while written < read:
+            written += os.pwrite(out_fd, buffer[written:read], out_offset + copied + written)
+        if on_chunk:
+            on_chunk(buffer[:read])
+        copied += read
+        if on_copied:
+            on_copied(read)
+    return copied
+    ## copy_audio_at ##
+
+
+def parse_position(tags:dict, key:str) -> tuple[int, int]|None:
+    """
+    Turns a "N/M" TPOS (disc) or TRCK (track) tag into a (N, M) tuple
+
+    Arguments:
+        tags: a {frame id: [values]} dict of ID3 text frames
+        key: "TPOS" or "TRCK"
+
+    Returns: (N, M) or None if the tag is missing or isn't of the form N/M
+    """
+    try:
+        index, count = [int(x) for x in tags[key][0].split("/")]
+    except (KeyError, IndexError, ValueError):
+        return None
+    return index, count
+    ## parse_position ##
+
+
+def skip_vbr_header_frame(
+    in_file:BufferedReader, offset:int
+) -> tuple[int, bytes|None, int|None]:
+    """
+    Looks at the first frame of the audio and steps over it if it is the
+    encoder's Xing/Info/VBRI header. That frame describes only this track so
+    it mustn't end up in the middle of the merged stream.
+
+    Arguments:
+        in_file: an mp3 file opened in "rb" mode
+        offset: where the audio starts in in_file
+
+    Returns: (offset, header, frames) where offset is where the first audio
+    frame starts, header is its 4-byte frame header, or None if no frame was
+    found there, and frames is the frame count given by the encoder's header
+    frame, or None if there isn't one
+    """
+    in_file.seek(offset)
+    frame = in_file.read(56)
+    entry = parse_frame_header(frame)
+    if entry is None:
+        return offset, None, None
+    if len(frame) >= 40 and is_vbr_header_frame(frame):
+        return offset + entry[0], frame[:4], vbr_header_frames(frame)
+    return offset, frame[:4], None
+    ## skip_vbr_header_frame ##
+
+
+def read_track_info(path:str) -> TrackInfo:
+    """
+    Opens an input mp3 file once, reads the text frames of its tag once and
+    records where its audio lives, leaving out any tags stacked at the start
+    or trailing at the end. Tags the frame walker can't handle are parsed with
+    mutagen instead.
+
+    Arguments:
+        path: the path to an input mp3 file, a TrackInfo is passed straight
+        through so callers that already scanned a file don't read it again
+
+    Returns: a TrackInfo for the file
+    """
+    if isinstance(path, TrackInfo):
+        return path
+    with open(path, "rb") as in_file:
+        try:
+            tags = read_text_frames(in_file)[1]
+        except UnsupportedTagError:
+            in_file.seek(0)
+            try:
+                id3 = ID3(in_file)
+                tags = {}
+                for frame in id3.values():
+                    if frame.FrameID in ("TXXX", "WXXX"):
+                        key = f"{frame.FrameID}:{frame.desc}"
+                    else:
+                        key = frame.FrameID
+                    if key[0] == "T":
+                        tags[key] = [str(x) for x in frame.text]
+                    elif key[0] == "W":
+                        tags[key] = tags.get(key, []) + [frame.url]
+            except ID3NoHeaderError:
+                tags = {}
+        offset, end = file_audio_range(in_file)
+        offset, first_frame, frames = skip_vbr_header_frame(in_file, offset)
+        length = max(end - offset, 0)
+        duration = estimate_duration(first_frame, length, frames) if first_frame else None
+
+    return TrackInfo(
+        path,
+        parse_position(tags, "TPOS"),
+        parse_position(tags, "TRCK"),
+        tags.get("TALB", [None])[0],
+        tags.get("TIT2", [None])[0],
+        offset,
+        length,
+        tags,
+        first_frame,
+        duration,
+    )
+    ## read_track_info ##
+
+
+def scan_tracks(
+    source_files:list[str], jobs:int=DEFAULT_JOBS, index:TagIndex|None=None
+) -> list[TrackInfo]:
+    """
+    Reads the TrackInfo of every input file, using a pool of threads so that
+    the tag reads of many files on slow storage overlap. The results come back
+    in the same order as source_files regardless of which reads finish first,
+    so the checks done afterwards by sort_tracks are deterministic.
+
+    Arguments:
+        source_files: the paths (or TrackInfo records) of the input mp3 files
+        jobs: optional, the maximum number of files read at the same time
+        index: optional, a TagIndex. Files it has an up to date entry for aren't
+        read, the others are read and added to it a batch at a time
+
+    Returns: a list of TrackInfo in the same order as source_files
+    """
+    if index is not None:
+        paths = [x for x in source_files if not isinstance(x, TrackInfo)]
+        found, identities = index.lookup(paths)
+        known = {path: TrackInfo(path, *fields) for path, fields in found.items()}
+        missing = [x for x in dict.fromkeys(paths) if x not in known]
+        for start in range(0, len(missing), BATCH_SIZE):
+            tracks = scan_tracks(missing[start : start + BATCH_SIZE], jobs)
+            index.store(tracks, identities)
+            known.update((x.path, x) for x in tracks)
+        return [x if isinstance(x, TrackInfo) else known[x] for x in source_files]
+
+    if jobs <= 1 or len(source_files) <= 1:
+        return [read_track_info(in_file) for in_file in source_files]
+    with ThreadPoolExecutor(max_workers=min(jobs, len(source_files))) as pool:
+        return list(pool.map(read_track_info, source_files))
+    ## scan_tracks ##
+
+
+def sort_tracks(source_files:list[TrackInfo], in_file_order:bool) -> list[TrackInfo]:
     """
     Constructs a dictionary of dictionaries where the outer keys the disc
     numbers and the keys of the inner dictionaries are the track numbers.
-    The values are the click-File ("rb") files passed in the command line.
+    The values are the TrackInfo records of the files passed in the command line.
     Generally, the disc and track numbers will be read from the ID3 tags in the
     files and error checking to ensure that there are no gaps in the disc or
     track numbers. The User, though is allowed to specify that the tracks
     should be combined in the order in which they were presented on the command
     line. In this case, the outer dictionary has a single disc key of 1 and the
     inner dictionary keys are the index of the file as passed in by the
-    Given the list of click.File ("rb") input mp3 files, reads the ID3 tags to
+    Given the list of TrackInfo records of the input mp3 files, uses their tags to
     determine the order of the tracks and saves a dictionary keyed on disc
     number, with sub-dictionaries keyed on track number with values that are
     individual mp3 files.
 
     Arguments:
-        source_files: a list of click.File instances that are the mp3 files that
-        are being combined
+        source_files: a list of TrackInfo records for the mp3 files that are being
+        combined
         in_file_order: Boolean, if True return the source_files in the order they
         appeared on the command line, if False sort the source_files by disc and
         track order in the ID3 tags
@@ -143,27 +750,21 @@ def sort_tracks(source_files:list[click.File], in_file_order:bool) -> list[click
     numbers, etc, the program exits after printing the list of problems encountered
     """
     if in_file_order:
-        print("Using the command line order...")
         return source_files
 
-    print("Checking tags for file ordering...")
     problems = []
     track_map = {}
     tracks_per_disc = {}
     track_list = []
     for in_file in source_files:
-        file_name = os.path.basename(in_file)
-        tag_info = EasyID3(in_file)
+        file_name = os.path.basename(in_file.path)
 
         total_discs = None
 
-        try:
-            disc_index, disc_count = [
-                int(x) for x in tag_info["discnumber"][0].split("/")
-            ]
-        except (TrackError, KeyError):
+        if in_file.disc is None:
             problems.append(f"{file_name} missing disc info")
             continue
+        disc_index, disc_count = in_file.disc
 
         if not total_discs:
             total_discs = disc_count
@@ -172,13 +773,10 @@ def sort_tracks(source_files:list[click.File], in_file_order:bool) -> list[click
         if disc_index not in track_map:
             track_map[disc_index] = {}
 
-        try:
-            track_index, track_count = [
-                int(x) for x in tag_info["tracknumber"][0].split("/")
-            ]
-        except (TrackError, KeyError):
+        if in_file.track is None:
             problems.append(f"{file_name} missing track info")
             continue
+        track_index, track_count = in_file.track
 
         if disc_index not in tracks_per_disc:
             tracks_per_disc[disc_index] = track_count
@@ -220,67 +818,437 @@ def sort_tracks(source_files:list[click.File], in_file_order:bool) -> list[click
     ## sort_tracks ##
 
 
-def get_output_file_name(a_file:click.File) -> str:
+def describe_format(format:tuple[int, int, int]) -> str:
+    layer, sample_rate, channels = format
+    return f"layer {'I' * layer} {sample_rate} Hz {'mono' if channels == 1 else 'stereo'}"
+
+
+def check_formats(
+    tracks:list[TrackInfo], jobs:int=DEFAULT_JOBS, index:TagIndex|None=None
+) -> None:
     """
-    Reads the album tag from an input mp3 file and generates a safe output file
+    Makes sure all the tracks have the same MPEG layer, sample rate and number
+    of channels before any audio is written, since players don't cope with a
+    book whose stream changes format part way through. Every frame of every
+    track is checked when NumPy is installed, otherwise just the first frame.
+
+    Arguments:
+        tracks: the TrackInfo records of the tracks, in order
+        jobs: optional, the maximum number of tracks scanned at the same time
+        index: optional, a TagIndex. Tracks whose formats it already has aren't
+        scanned again, and the formats of the others are added to it
+
+    Raises: TrackError listing the tracks that don't match the first one
+    """
+    def scan(track:TrackInfo) -> dict:
+        return stream_formats(track.path, track.audio_offset, track.audio_length)
+
+    known, identities = {}, {}
+    if index is not None:
+        known, identities = index.lookup_formats([x.path for x in tracks])
+    missing = [x for x in tracks if x.path not in known]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(missing)))) as pool:
+            scanned = dict(zip([x.path for x in missing], pool.map(scan, missing)))
+        if index is not None:
+            index.store_formats(scanned, identities)
+        known.update(scanned)
+    all_formats = [known[x.path] for x in tracks]
+
+    problems = []
+    expected = None
+    for track, formats in zip(tracks, all_formats):
+        file_name = os.path.basename(track.path)
+        if not formats:
+            problems.append(f"{file_name} has no MPEG audio frames")
+            continue
+        # Most frames decide what a track is
+        format = max(formats, key=formats.get)
+        if expected is None:
+            expected, first_name = format, file_name
+        elif format != expected:
+            problems.append(
+                f"Format mismatch: {file_name} is {describe_format(format)}, "
+                f"{first_name} is {describe_format(expected)}"
+            )
+        if len(formats) > 1:
+            others = ", ".join(describe_format(x) for x in formats if x != format)
+            problems.append(f"{file_name} also has frames in {others}")
+    if problems:
+        raise TrackError(problems)
+    ## check_formats ##
+
+
+def get_output_file_name(a_file:TrackInfo) -> str:
+    """
+    Takes the album tag of an input mp3 file and generates a safe output file
     name
 
     Arguments:
-        a_file - one of the input mp3 files
+        a_file - the TrackInfo of one of the input mp3 files
 
     Returns: a string, that should be a safe name that is based on the album tag
     in the file
     """
-    source_tags = EasyID3(a_file)
-    album = source_tags["album"][0]
+    album = a_file.album
     album = re.sub("[^0-9a-zA-Z]+", "_", album)
     return album + ".mp3"
 
 
-def write_file(tracks:list[click.File], out_name:str) -> None:
+def write_file(
+    tracks:list[TrackInfo],
+    out_name:str,
+    buffer_size:int=DEFAULT_BUFFER_SIZE,
+    frame_index:FrameIndex|None=None,
+    chapter_marks:list|None=None,
+    progress=None,
+    cancel=None,
+    profiler:Profiler|None=None,
+    manifest_tracks:list|None=None,
+    copy_threads:int=DEFAULT_COPY_THREADS,
+) -> None:
     """
     Given the list of tracks, combines all the individual mp3 files into
-    one big file.
+    one big file. Only the ID3 header of each track is read to find where its
+    audio starts, the audio itself is streamed across so memory use stays flat
+    however big the tracks are.
 
     Arguments:
-        tracks: the list containing all the tracks to be combined
+        tracks: the list of TrackInfo records of the tracks to be combined
         out_name: the click.File opened in "wb" mode into which the mp3 files
         from the tracks dictionary are combined.
+        buffer_size: optional, the size of the chunks used to copy the audio
+        frame_index: optional, a FrameIndex that is fed the audio as it is copied
+        chapter_marks: optional, a list that gets a (start seconds, end seconds,
+        start offset, end offset) tuple appended for each track, taken from the
+        running counters of frame_index and out_name, which must then be given
+        progress: optional, called as progress(phase, tracks done, track count,
+        bytes done, bytes total) as the copy goes along
+        cancel: optional, a threading.Event, the copy stops with a
+        BuildCancelledError soon after it is set
+        profiler: optional, a Profiler that measures the copy of each track
+        manifest_tracks: optional, a list that gets the manifest entry of each
+        track appended, including a hash of its audio taken as it is copied and
+        the frame_index checkpoint at its end
+        copy_threads: optional, the number of tracks copied at the same time.
+        Above 1 each track is written straight to its place in out_name, which
+        must then be a real file, and the results are the same byte for byte
+
+    Raises: BuildCancelledError if cancel is set, TrackError if a track is
+    shorter than expected when copy_threads is above 1
     """
-    print(f"Writing tracks to {out_name}...")
-    for in_file in tracks:
-        with open(in_file, "rb") as inf:
-            data = inf.read()
-        _, _, sound = split_tags_from_sound(data)
-        out_name.write(sound)
+    digest = None
+
+    def on_chunk(chunk:memoryview) -> None:
+        if frame_index:
+            frame_index.feed(chunk)
+        if digest:
+            digest.update(chunk)
+
+    if not frame_index and manifest_tracks is None:
+        on_chunk = None
+    bytes_total = sum(track.audio_length for track in tracks)
+    bytes_done = 0
+    tracks_done = 0
+    lock = threading.Lock()  # the copies may report from several threads
+    if progress:
+        progress("Writing tracks", 0, len(tracks), 0, bytes_total)
+
+    def on_copied(count:int) -> None:
+        nonlocal bytes_done
+        with lock:
+            bytes_done += count
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelledError(getattr(out_name, "name", out_name))
+            if progress:
+                progress("Writing tracks", tracks_done, len(tracks), bytes_done, bytes_total)
+
+    def record(track:TrackInfo, start_offset:int, end_offset:int, start_time:float) -> None:
+        if chapter_marks is not None:
+            chapter_marks.append((start_time, frame_index.duration, start_offset, end_offset))
+        if manifest_tracks is not None:
+            entry = manifest.track_entry(track, digest.hexdigest(), start_offset, end_offset)
+            entry["index"] = frame_index.checkpoint() if frame_index else None
+            entry["chapter"] = chapter_marks[-1] if chapter_marks is not None else None
+            manifest_tracks.append(entry)
+
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+
+    if copy_threads > 1 and len(tracks) > 1 and hasattr(os, "pwrite"):
+        # Every track's place in the file is known from the audio lengths, so
+        # the tracks are copied at once. Each copy scans and hashes its own
+        # track and the results are added up in order afterwards.
+        out_name.flush()
+        out_fd = out_name.fileno()
+        offsets = [out_name.tell()]
+        for track in tracks:
+            offsets.append(offsets[-1] + track.audio_length)
+        stop = threading.Event()
+
+        def copy_track(number:int) -> tuple[FrameLog|None, object]:
+            nonlocal tracks_done
+            track = tracks[number]
+            log = FrameLog() if frame_index else None
+            track_digest = manifest.new_hash() if manifest_tracks is not None else None
+
+            def on_track_chunk(chunk:memoryview) -> None:
+                if log:
+                    log.feed(chunk)
+                if track_digest:
+                    track_digest.update(chunk)
+
+            def on_track_copied(count:int) -> None:
+                if stop.is_set():
+                    raise BuildCancelledError(getattr(out_name, "name", out_name))
+                on_copied(count)
+
+            with profiler.track(track.path, concurrent=True), open(
+                track.path, "rb"
+            ) as inf:
+                copied = copy_audio_at(
+                    inf,
+                    out_fd,
+                    track.audio_offset,
+                    offsets[number],
+                    track.audio_length,
+                    buffer_size,
+                    on_track_chunk if log or track_digest else None,
+                    on_track_copied,
+                )
+            if copied != track.audio_length:
+                raise TrackError([f"{track.path} changed while the book was being written"])
+            with lock:
+                tracks_done += 1
+                if progress:
+                    progress("Writing tracks", tracks_done, len(tracks), bytes_done, bytes_total)
+            return log, track_digest
+
+        with ThreadPoolExecutor(max_workers=copy_threads) as pool:
+            futures = [pool.submit(copy_track, x) for x in range(len(tracks))]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            if any(x.done() and x.exception() for x in futures):
+                # Stop the other copies rather than finishing a book that won't be used
+                stop.set()
+                for future in futures:
+                    future.cancel()
+        errors = [x.exception() for x in futures if not x.cancelled() and x.exception()]
+        if errors:
+            # A copy that failed rather than one that was stopped because of it
+            raise next((x for x in errors if not isinstance(x, BuildCancelledError)), errors[0])
+
+        for number, future in enumerate(futures):
+            log, digest = future.result()
+            start_time = None
+            if frame_index:
+                start_time = frame_index.duration
+                frame_index.extend(log)
+            record(tracks[number], offsets[number], offsets[number + 1], start_time)
+        out_name.seek(offsets[-1])
+        return
+
+    for track in tracks:
+        if frame_index:
+            frame_index.new_track()
+        if manifest_tracks is not None:
+            digest = manifest.new_hash()
+        if chapter_marks is not None or manifest_tracks is not None:
+            start_offset = out_name.tell()
+        start_time = frame_index.duration if frame_index else None
+        with profiler.track(track.path), open(track.path, "rb") as inf:
+            copy_audio(
+                inf,
+                out_name,
+                track.audio_offset,
+                buffer_size,
+                track.audio_length,
+                on_chunk,
+                on_copied,
+            )
+        tracks_done += 1
+        if progress:
+            progress("Writing tracks", tracks_done, len(tracks), bytes_done, bytes_total)
+        if chapter_marks is not None or manifest_tracks is not None:
+            record(track, start_offset, out_name.tell(), start_time)
     ## write_file ##
 
 
-def add_tags(first_file:str, output_file:str) -> None:
+def book_chapters(
+    tracks:list[TrackInfo], chapter_marks:list|None=None
+) -> list[tuple[str, int, int, int, int]]:
+    """
+    Pairs each track with its place in the output to describe the chapters of
+    the book.
+
+    Arguments:
+        tracks: the TrackInfo records in the order they were written
+        chapter_marks: optional, the marks recorded by write_file. If not given
+        every chapter starts and ends at 0, which is handy for reserving room in
+        the tag before the audio has been written
+
+    Returns: a list of (title, start ms, end ms, start offset, end offset) tuples,
+    titled from each track's title tag or its file name
+    """
+    chapters = []
+    for i, track in enumerate(tracks):
+        title = track.title or os.path.splitext(os.path.basename(track.path))[0]
+        if chapter_marks:
+            start_time, end_time, start_offset, end_offset = chapter_marks[i]
+        else:
+            start_time = end_time = start_offset = end_offset = 0
+        chapters.append(
+            (
+                title,
+                round(start_time * 1000),
+                round(end_time * 1000),
+                # CHAP offsets are 32 bits, all ones means "not given"
+                min(start_offset, 0xFFFFFFFF),
+                min(end_offset, 0xFFFFFFFF),
+            )
+        )
+    return chapters
+    ## book_chapters ##
+
+
+def set_book_tags(tags:ID3, first_file:TrackInfo) -> None:
+    """
+    Copies the text and URL frames of the first input file into tags and sets
+    the title to the album as well as the track and disc numbers to 1/1.
+
+    Arguments:
+        tags: the ID3 tags of the output file, modified in place
+        first_file: the TrackInfo of the first input file
+    """
+    for key, text in first_file.tags.items():
+        frame_id, _, description = key.partition(":")
+        if frame_id == "TXXX":
+            tags.add(TXXX(encoding=3, desc=description, text=text))
+        elif frame_id == "WXXX":
+            for url in text:
+                tags.add(WXXX(encoding=3, desc=description, url=url))
+        elif frame_id not in Frames or frame_id == "TLEN":
+            # TLEN is the length of the first track, not of the book
+            continue
+        elif frame_id[0] == "W":
+            for url in text:
+                tags.add(Frames[frame_id](url=url))
+        else:
+            tags.add(Frames[frame_id](encoding=3, text=text))
+    tags.add(TIT2(encoding=3, text=first_file.tags.get("TALB", [])))
+    tags.add(TRCK(encoding=3, text=["1/1"]))
+    tags.add(TPOS(encoding=3, text=["1/1"]))
+    # The source frames may be v2.3 ones like TYER, convert them before saving
+    tags.update_to_v24()
+    ## set_book_tags ##
+
+
+def cover_frame(album_art:bytes) -> APIC:
+    """
+    Arguments:
+        album_art: the contents of a jpeg file
+
+    Returns: the APIC frame that makes album_art the front cover
+    """
+    return APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=album_art)
+    ## cover_frame ##
+
+
+def build_tag(
+    first_file:TrackInfo,
+    album_art:bytes|None=None,
+    padding:int=DEFAULT_TAG_PADDING,
+    length_ms:int|None=None,
+    size:int|None=None,
+    chapters:list|None=None,
+) -> bytes:
+    """
+    Builds the complete ID3v2.4 tag of the output file in memory: the frames
+    copied from the first input file, the book title, track and disc numbers,
+    the cover image and a padding reserve. Writing this at the start of the
+    output before the audio means the output never has to be reopened and
+    rewritten to add tags.
+
+    Arguments:
+        first_file: the TrackInfo of the first input file
+        album_art: optional, the contents of a jpeg file to use as the cover
+        padding: optional, the number of bytes of padding to leave in the tag
+        length_ms: optional, the playing time of the book for the TLEN frame
+        size: optional, pad the tag to exactly this many bytes (overriding
+        padding) so it can replace a tag that was written earlier
+        chapters: optional, the book_chapters of the book, written as CHAP frames
+        listed in a top level CTOC
+
+    Returns: the bytes of the tag, ready to be written at offset 0
+    """
+    tags = ID3()
+    set_book_tags(tags, first_file)
+    if length_ms is not None:
+        tags.add(TLEN(encoding=3, text=[str(length_ms)]))
+    if album_art:
+        tags.add(cover_frame(album_art))
+    if chapters:
+        element_ids = [f"chp{i}" for i in range(len(chapters))]
+        tags.add(
+            CTOC(
+                element_id="toc",
+                flags=CTOCFlags.TOP_LEVEL | CTOCFlags.ORDERED,
+                child_element_ids=element_ids,
+                sub_frames=[TIT2(encoding=3, text=["Chapters"])],
+            )
+        )
+        for element_id, (title, start, end, start_offset, end_offset) in zip(
+            element_ids, chapters
+        ):
+            tags.add(
+                CHAP(
+                    element_id=element_id,
+                    start_time=start,
+                    end_time=end,
+                    start_offset=start_offset,
+                    end_offset=end_offset,
+                    sub_frames=[TIT2(encoding=3, text=[title])],
+                )
+            )
+
+    def render(padding_size:int) -> bytes:
+        rendered = BytesIO()
+        tags.save(rendered, v1=0, v2_version=4, padding=lambda info: padding_size)
+        return rendered.getvalue()
+
+    if size is None:
+        return render(padding)
+    tag = render(0)
+    if len(tag) > size:
+        raise ValueError(f"The tag needs {len(tag)} bytes, only {size} reserved")
+    return render(size - len(tag))
+    ## build_tag ##
+
+
+def add_tags(first_file:TrackInfo, output_file:str) -> None:
     """
     Copies the tags from the first input file to the output file and sets title tag
     to the album tag as well as the the tracknumber and discnumber tags to 1/1.
+    run_fuzer writes these tags up front with build_tag, this is for adding them
+    to a file that has already been written.
 
     Arguments:
-        first_file: the path to the first input file, from which the tags are
+        first_file: the TrackInfo of the first input file, from which the tags are
         obtained.
         output_file: the name of the mp3 file.
     """
     print("Adding basic tags...")
-    destination_tags = mutagen.File(output_file, easy=True)
-    source_tags = EasyID3(first_file)
-    for tag in source_tags:
-        destination_tags[tag] = source_tags[tag]
-    destination_tags["title"] = destination_tags["album"]
-    destination_tags["tracknumber"] = ["1/1"]
-    destination_tags["discnumber"] = ["1/1"]
-    destination_tags.save(v2_version=4)
+    destination = MP3(output_file, ID3=ID3)
+    if destination.tags is None:
+        destination.add_tags()
+    set_book_tags(destination.tags, first_file)
+    destination.save(v2_version=4)
     ## add_tags ##
 
 
 def add_cover_art(output_file:str, cover_file:click.File) -> None:
     """
-    Adds a cover image to the mp3 that was created
+    Adds a cover image to the mp3 that was created. run_fuzer includes the cover
+    in the tag built by build_tag, this is for adding one to an existing file.
 
     Arguments:
         output_file: the name of the output file (not a click.File)
@@ -289,13 +1257,243 @@ def add_cover_art(output_file:str, cover_file:click.File) -> None:
     print("Adding cover art...")
     album_art = cover_file.read()
     audio = MP3(output_file, ID3=ID3)
-    audio.tags.add(
-        APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=album_art)
-    )
+    audio.tags.add(cover_frame(album_art))
     audio.save(v2_version=4)
     ## add_cover_art ##
 
 
+def write_output(
+    out_file,
+    track_list,
+    tag,
+    album_art,
+    buffer_size,
+    frame_index,
+    vbr_header,
+    chapter_marks,
+    progress=None,
+    cancel=None,
+    profiler:Profiler|None=None,
+    manifest_tracks:list|None=None,
+    start_track:int=0,
+    resume_at:int|None=None,
+    copy_threads:int=DEFAULT_COPY_THREADS,
+) -> None:
+    """
+    Writes the whole book to an open output file: the tag, the Xing header, the
+    audio and then, once the counts are known, the final tag and Xing header
+    over their placeholders. When resuming an incremental build the tag and
+    the first start_track tracks are already in the file and are kept. The file
+    is cut off where the audio ends, so it may have been preallocated.
+
+    Arguments:
+        out_file: the output file opened in "r+b" mode
+        track_list: the sorted TrackInfo records of the tracks
+        tag: the placeholder tag built by build_tag
+        album_art: the contents of the cover image or None
+        buffer_size: the size of the chunks used when copying audio
+        frame_index: the FrameIndex fed the audio, or None
+        vbr_header: if set, and there is a frame_index, a Xing header is written
+        in front of layer III audio
+        chapter_marks: the list write_file records chapters in, or None
+        progress: optional, see write_file
+        cancel: optional, see write_file
+        profiler: optional, a Profiler that measures the writing phases
+        manifest_tracks: optional, see write_file
+        start_track: optional, the number of leading tracks already in the file
+        resume_at: optional, the offset where the audio of track start_track goes.
+        If given, out_file starts with the book being updated and everything
+        from there on is replaced, otherwise the book is written from the start
+        copy_threads: optional, see write_file
+    """
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    first_frame = track_list[0].first_frame
+    vbr_header = (
+        vbr_header and frame_index is not None and takes_xing_frame(first_frame)
+    )
+    with profiler.phase("write_file"):
+        if resume_at is None:
+            out_file.seek(0)
+            out_file.write(tag)
+            if vbr_header:
+                out_file.write(xing_frame(first_frame))
+        else:
+            out_file.seek(resume_at)
+        write_file(
+            track_list[start_track:],
+            out_file,
+            buffer_size,
+            frame_index,
+            chapter_marks,
+            progress,
+            cancel,
+            profiler,
+            manifest_tracks,
+            copy_threads,
+        )
+        out_file.truncate(out_file.tell())
+        out_file.flush()
+
+    if frame_index:
+        if progress:
+            progress("Updating tags", len(track_list), len(track_list), 0, 0)
+        with profiler.phase("update_tags"):
+            out_file.seek(0)
+            length_ms = round(frame_index.duration * 1000)
+            out_file.write(
+                build_tag(
+                    track_list[0],
+                    album_art,
+                    length_ms=length_ms,
+                    size=len(tag),
+                    chapters=(
+                        book_chapters(track_list, chapter_marks)
+                        if chapter_marks is not None
+                        else None
+                    ),
+                )
+            )
+            if vbr_header:
+                out_file.write(xing_frame(first_frame, frame_index))
+            out_file.flush()
+    ## write_output ##
+
+
+def create_temp_file(out_name:str) -> tuple[str, BufferedReader]:
+    """
+    Creates the file a book is written to before it is given its real name.
+    It goes in the same directory so it can be renamed into place, and it is
+    hidden (and not named .mp3) so directory listings and watchers skip it.
+
+    Arguments:
+        out_name: the path the book will have
+
+    Returns: (the path of the temporary file, the file opened "r+b")
+    """
+    directory, base_name = os.path.split(os.path.abspath(out_name))
+    while True:
+        temp_name = os.path.join(directory, f".{base_name}.{secrets.token_hex(4)}.part")
+        try:
+            fd = os.open(
+                temp_name,
+                os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0),
+                0o666,
+            )
+        except FileExistsError:
+            continue
+        return temp_name, os.fdopen(fd, "r+b")
+    ## create_temp_file ##
+
+
+def preallocate(out_file, size:int) -> None:
+    """
+    Reserves the disk space of the whole book before it is written, so the
+    filesystem can allocate it in one go rather than extent by extent as the
+    file grows. Skipped where posix_fallocate isn't available or supported.
+
+    Arguments:
+        out_file: the open output file
+        size: the expected size of the book
+    """
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(out_file.fileno(), 0, size)
+    except OSError:
+        pass
+    ## preallocate ##
+
+
+def publish(temp_name:str, out_name:str, replace:bool=False) -> None:
+    """
+    Gives a finished book its real name in one atomic step. Unless replace is
+    set this fails if out_name exists, even if it was created by another build
+    after the book was started.
+
+    Arguments:
+        temp_name: the path of the finished, fsync'd temporary file
+        out_name: the path the book should have
+        replace: optional, if set an existing out_name is replaced
+
+    Raises: AlreadyExistsError if out_name exists and replace isn't set
+    """
+    if replace:
+        os.replace(temp_name, out_name)
+    else:
+        try:
+            # Unlike a rename, a link never replaces an existing file
+            os.link(temp_name, out_name)
+        except FileExistsError:
+            raise AlreadyExistsError(out_name) from None
+        except OSError:
+            # No hard links on this filesystem, settle for a rename. On Windows
+            # that fails if out_name exists, elsewhere check first.
+            if os.name != "nt" and os.path.exists(out_name):
+                raise AlreadyExistsError(out_name)
+            os.rename(temp_name, out_name)
+        else:
+            os.remove(temp_name)
+    # Make the new name itself durable
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(os.path.abspath(out_name)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    ## publish ##
+
+
+def order_tracks(
+    source_files,
+    file_order:bool,
+    jobs:int,
+    validate:bool,
+    profiler:Profiler,
+    report,
+    tag_index:str|TagIndex|None=None,
+) -> list[TrackInfo]:
+    """
+    The steps every build starts with: reads the tracks, puts them in order and
+    checks their audio formats.
+
+    Arguments:
+        source_files: the mp3 files of the book, paths or TrackInfo records
+        file_order: a flag, if set the files are kept in the order given
+        jobs: the number of input files whose tags are read concurrently
+        validate: a flag, if set check_formats is run on the tracks
+        profiler: the Profiler the steps are measured by
+        report: called as report(step, tracks done) when each step starts and
+        finishes
+        tag_index: optional, a TagIndex or the path of one, used by scan_tracks
+        and check_formats
+
+    Returns: the TrackInfo records of the tracks in the order they are merged
+
+    Raises: TrackError if the tags or the audio formats of the tracks are wrong
+    """
+    index = TagIndex(tag_index) if isinstance(tag_index, str) else tag_index
+    try:
+        report("Checking tags", 0)
+        with profiler.phase("scan_tracks"):
+            tracks = scan_tracks(source_files, jobs, index)
+        report("Checking tags", len(tracks))
+        if file_order:
+            report("Using the command line order", len(tracks))
+        with profiler.phase("sort_tracks"):
+            track_list = sort_tracks(tracks, file_order)
+        if validate:
+            report("Checking audio formats", 0)
+            with profiler.phase("check_formats"):
+                check_formats(track_list, jobs, index)
+            report("Checking audio formats", len(track_list))
+    finally:
+        if index is not tag_index:
+            index.close()
+    return track_list
+    ## order_tracks ##
+
+
 def run_fuzer(
     source_files,
     cover=None,
@@ -303,6 +1501,20 @@ def run_fuzer(
     dest_dir=None,
     file_order=False,
     raise_exceptions=True,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+    jobs=DEFAULT_JOBS,
+    tag_padding=DEFAULT_TAG_PADDING,
+    vbr_header=True,
+    chapters=False,
+    progress=None,
+    cancel=None,
+    profile=False,
+    incremental=False,
+    validate=True,
+    copy_threads=DEFAULT_COPY_THREADS,
+    tag_index=None,
+    on_event=None,
+    replace=False,
 ) -> str|None:
     """
     This function actually does the work described in fuzer.
@@ -319,10 +1531,57 @@ def run_fuzer(
         stings if problems were encountered. When running from the command line,
         exceptions are the way to go, but when called from winFuzer, strings are better
         since we want to display helpful messages in the UI
+        buffer_size: optional, the size of the chunks used when copying audio
+        jobs: optional, the number of input files whose tags are read concurrently
+        tag_padding: optional, bytes of padding to reserve in the output's tag
+        vbr_header: optional, defaults to True, if set the frames are counted while
+        the audio is copied and a Xing header with a seek TOC plus a TLEN tag
+        describing the whole book are written. Layer I and II books only get
+        the TLEN tag, Xing headers are a layer III thing
+        chapters: optional, if set a CHAP frame is written for each input track
+        (titled from its title tag) along with a CTOC listing them
+        progress: optional, called as progress(phase, tracks done, track count,
+        bytes done, bytes total) at the start of each phase and as the audio is
+        copied, at most every PROGRESS_INTERVAL seconds
+        cancel: optional, a threading.Event that stops the build when it is set.
+        The partial output file is removed and a BuildCancelledError raised (or
+        its message returned if raise_exceptions is False)
+        profile: optional, True to print a table of the time, I/O, file opens and
+        memory used by each phase and track when the build finishes, or a Profiler
+        to record them in for the caller to report
+        incremental: optional, if set a manifest of the inputs is saved next to the
+        book. If the book already exists with a manifest, it is left alone when
+        nothing changed, and otherwise the leading tracks that haven't changed are
+        kept and only the tracks from the first changed one onward are rewritten
+        validate: optional, defaults to True, if set the audio of every track is
+        checked for a sample rate, channel or layer that differs from the others
+        before anything is written, see check_formats
+        copy_threads: optional, the number of tracks copied into the book at the
+        same time, the book is the same whatever it is
+        tag_index: optional, a TagIndex or the path of one, the tags and audio
+        formats of unchanged tracks are taken from it rather than read again
+        on_event: optional, called with a ProgressEvent when each phase starts
+        and finishes and, at most every PROGRESS_INTERVAL seconds, as the audio
+        is copied
+        replace: optional, if set an existing book is built again, rather than
+        refused, and replaced once the new one is finished. With incremental, a
+        book whose manifest can be used is still updated in place
     """
+    if isinstance(profile, Profiler):
+        profiler = profile
+    else:
+        profiler = Profiler(enabled=bool(profile))
+    progress = ProgressReporter(print_progress, callback_listener(progress), on_event)
+
+    def report(phase:str, tracks_done:int=0) -> None:
+        progress(phase, tracks_done, len(source_files), 0, 0)
+
     try:
-        track_list = sort_tracks(source_files, file_order)
+        track_list = order_tracks(
+            source_files, file_order, jobs, validate, profiler, report, tag_index
+        )
     except TrackError as te:
+        progress.finish()
         if raise_exceptions:
             raise
         else:
@@ -333,37 +1592,698 @@ def run_fuzer(
     if title:
         out_name = title
     else:
-        out_name = get_output_file_name(track_list[0])
+        with profiler.phase("get_output_file_name"):
+            out_name = get_output_file_name(track_list[0])
 
     if dest_dir:
         if dest_dir[-1] != os.path.sep:
             dest_dir += os.path.sep
         out_name = dest_dir + out_name
 
-    if os.path.isfile(out_name):
-        # Don't overwrite an existing file
-        if raise_exceptions:
-            raise AlreadyExistsError(out_name)
+    existing = None
+    replacing = os.path.isfile(out_name)
+    if replacing:
+        existing = manifest.load_manifest(out_name) if incremental else None
+        # Don't overwrite an existing file. This only saves a wasted build,
+        # publish makes the final check when the book is given its name.
+        if existing is None and not replace:
+            progress.finish()
+            if raise_exceptions:
+                raise AlreadyExistsError(out_name)
+            else:
+                return f"{out_name} already exists. Delete or move it"
+
+    report("Building tags")
+    with profiler.phase("build_tag"):
+        album_art = cover.read() if cover else None
+        first_frame = track_list[0].first_frame
+        frame_index = (
+            FrameIndex() if (vbr_header or chapters) and first_frame else None
+        )
+        # Leave room for the TLEN digits that replace the placeholder "0"
+        length_ms = 0 if frame_index else None
+        chapter_marks = [] if chapters and frame_index else None
+        # Chapters have a fixed size so zeroed ones reserve the room for the real ones
+        placeholder_chapters = (
+            book_chapters(track_list) if chapter_marks is not None else None
+        )
+        tag = build_tag(
+            track_list[0],
+            album_art,
+            tag_padding + 16,
+            length_ms,
+            chapters=placeholder_chapters,
+        )
+
+    settings = {
+        "vbr_header": bool(vbr_header),
+        "chapters": bool(chapters),
+        "tags": track_list[0].tags,
+        "cover": manifest.new_hash(album_art).hexdigest() if album_art else None,
+    }
+    manifest_tracks = [] if incremental else None
+    start_track = 0
+    resume_at = None
+    if existing is not None:
+        same_layout = all(
+            existing["settings"][x] == settings[x] for x in ("vbr_header", "chapters")
+        )
+        if same_layout:
+            start_track = manifest.unchanged_prefix(existing, track_list, buffer_size)
+        if (
+            start_track == len(track_list) == len(existing["tracks"])
+            and existing["settings"] == settings
+        ):
+            # Keep any identities unchanged_prefix refreshed after hashing
+            manifest.save_manifest(out_name, existing)
+            report("Done", len(track_list))
+            return f"{out_name} is up to date"
+        if start_track:
+            # The new tag has to fit exactly where the old one is
+            try:
+                tag = build_tag(
+                    track_list[0],
+                    album_art,
+                    length_ms=length_ms,
+                    size=existing["tag_size"],
+                    chapters=placeholder_chapters,
+                )
+            except ValueError:
+                start_track = 0
+        if start_track:
+            print(f"Keeping the first {start_track} tracks of {out_name}...")
+            kept = existing["tracks"][:start_track]
+            resume_at = kept[-1]["output_end"]
+            manifest_tracks = kept
+            if frame_index:
+                frame_index = FrameIndex.resume(
+                    kept[-1]["index"],
+                    existing["index"]["positions"],
+                    existing["index"]["stride"],
+                )
+            if chapter_marks is not None:
+                chapter_marks = [tuple(x["chapter"]) for x in kept]
         else:
-            return f"{out_name} already exists. Delete or move it"
+            print(f"Rebuilding {out_name}...")
 
-    with open(out_name, "wb") as out_file:
-        write_file(track_list, out_file)
+    # The book is written under a temporary name and only renamed into place
+    # once it is complete and on disk, so a crash or a cancel never leaves a
+    # truncated book under the real name, and an existing book (and its
+    # manifest) stays valid until it is replaced
+    temp_name, out_file = create_temp_file(out_name)
+    try:
+        with out_file:
+            book_size = sum(x.audio_length for x in track_list[start_track:])
+            if resume_at:
+                with open(out_name, "rb") as old_book:
+                    # A reflink on filesystems that can, a kernel copy elsewhere
+                    copy_audio(old_book, out_file, 0, buffer_size, resume_at)
+                book_size += resume_at
+            else:
+                book_size += len(tag)
+                if vbr_header and frame_index and takes_xing_frame(first_frame):
+                    book_size += len(xing_frame(first_frame))
+            preallocate(out_file, book_size)
+            write_output(
+                out_file,
+                track_list,
+                tag,
+                album_art,
+                buffer_size,
+                frame_index,
+                vbr_header,
+                chapter_marks,
+                progress,
+                cancel,
+                profiler,
+                manifest_tracks,
+                start_track,
+                resume_at,
+                copy_threads,
+            )
+            os.fsync(out_file.fileno())
+        publish(temp_name, out_name, replace=replacing)
+    except BaseException as e:
+        progress.finish()
+        if os.path.isfile(temp_name):
+            os.remove(temp_name)
+        if isinstance(e, BuildCancelledError):
+            # Name the book rather than the temporary file
+            e = BuildCancelledError(out_name)
+            if raise_exceptions:
+                raise e from None
+        if (
+            isinstance(e, (BuildCancelledError, AlreadyExistsError, TrackError))
+            and not raise_exceptions
+        ):
+            # TrackError here is a track that changed while it was being copied
+            return e.message
+        raise
 
-    add_tags(track_list[0], out_name)
+    if incremental:
+        index = None
+        if frame_index:
+            index = {
+                "positions": list(frame_index.positions),
+                "stride": frame_index.stride,
+            }
+        manifest.save_manifest(
+            out_name,
+            {
+                "settings": settings,
+                "tag_size": len(tag),
+                "index": index,
+                "tracks": manifest_tracks,
+            },
+        )
 
-    if cover:
-        add_cover_art(out_name, cover)
-    
+    report("Done", len(track_list))
+    if profile is True:
+        print(profiler.report())
+    if start_track:
+        return f"All done: {out_name} (kept {start_track} of {len(track_list)} tracks)"
     return f"All done: {out_name}"
 
 
-@click.command()
+class CountingSink:
+    """
+    A stand-in for an output file that throws away what is written to it and
+    only keeps count, so the audio can be run through write_file to measure
+    the book before any of it is written.
+    """
+
+    def __init__(self, position:int=0):
+        self.position = position
+
+    def write(self, data) -> int:
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def __repr__(self):
+        return "the frame counter"
+    ## CountingSink ##
+
+
+def stream_book(
+    source_files,
+    out_stream,
+    cover=None,
+    file_order=False,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+    jobs=DEFAULT_JOBS,
+    tag_padding=DEFAULT_TAG_PADDING,
+    vbr_header=True,
+    chapters=False,
+    progress=None,
+    profile=False,
+    validate=True,
+    tag_index=None,
+    on_event=None,
+) -> int:
+    """
+    Builds a book into any writable binary stream, e.g. a pipe, a socket or
+    sys.stdout.buffer. The stream is written from start to end exactly once,
+    it is never seeked, read or reopened. The finished tag can only go first
+    if the frames are counted before the audio is written, so when a Xing
+    header or chapters are wanted the audio is read twice, once to count it
+    and once to send it. The book is the same as the one run_fuzer writes.
+    Messages are printed to stderr so that stdout can carry the book.
+
+    Arguments:
+        source_files: the individual mp3 files that are going to be combined
+        out_stream: a binary file object opened for writing
+        cover: optional, jpeg file containing a cover image for the book
+        file_order: a flag, if set the files are concatenated in the order given
+        buffer_size: optional, the size of the chunks used when copying audio
+        jobs: optional, the number of input files whose tags are read concurrently
+        tag_padding: optional, bytes of padding to reserve in the output's tag
+        vbr_header: optional, defaults to True, see run_fuzer
+        chapters: optional, see run_fuzer
+        progress: optional, see run_fuzer
+        profile: optional, True to print a table of the time, I/O, file opens and
+        memory used by each phase, or a Profiler to record them in
+        validate: optional, defaults to True, see run_fuzer
+        tag_index: optional, see run_fuzer
+        on_event: optional, see run_fuzer
+
+    Returns: the number of bytes written to out_stream
+
+    Raises: TrackError if the tags or the audio formats of the tracks are wrong
+    """
+    if isinstance(profile, Profiler):
+        profiler = profile
+    else:
+        profiler = Profiler(enabled=bool(profile))
+    progress = ProgressReporter(print_progress, callback_listener(progress), on_event)
+
+    def report(phase:str, tracks_done:int=0) -> None:
+        progress(phase, tracks_done, len(source_files), 0, 0)
+
+    def report_counting(phase, tracks_done, track_count, bytes_done, bytes_total) -> None:
+        progress("Counting frames", tracks_done, track_count, bytes_done, bytes_total)
+
+    with redirect_stdout(sys.stderr):
+        track_list = order_tracks(
+            source_files, file_order, jobs, validate, profiler, report, tag_index
+        )
+
+        report("Building tags")
+        with profiler.phase("build_tag"):
+            album_art = cover.read() if cover else None
+            first_frame = track_list[0].first_frame
+            frame_index = (
+                FrameIndex() if (vbr_header or chapters) and first_frame else None
+            )
+            vbr_header = (
+                vbr_header
+                and frame_index is not None
+                and takes_xing_frame(first_frame)
+            )
+            chapter_marks = [] if chapters and frame_index else None
+            # Built exactly as run_fuzer builds its placeholder so the final
+            # tag, made to the same size, matches the one in a book file
+            tag = build_tag(
+                track_list[0],
+                album_art,
+                tag_padding + 16,
+                0 if frame_index else None,
+                chapters=book_chapters(track_list) if chapter_marks is not None else None,
+            )
+        xing_length = len(xing_frame(first_frame)) if vbr_header else 0
+
+        if frame_index:
+            with profiler.phase("count_frames"):
+                write_file(
+                    track_list,
+                    CountingSink(len(tag) + xing_length),
+                    buffer_size,
+                    frame_index,
+                    chapter_marks,
+                    report_counting,
+                )
+            with profiler.phase("update_tags"):
+                tag = build_tag(
+                    track_list[0],
+                    album_art,
+                    length_ms=round(frame_index.duration * 1000),
+                    size=len(tag),
+                    chapters=(
+                        book_chapters(track_list, chapter_marks)
+                        if chapter_marks is not None
+                        else None
+                    ),
+                )
+
+        with profiler.phase("write_file"):
+            out_stream.write(tag)
+            if vbr_header:
+                out_stream.write(xing_frame(first_frame, frame_index))
+            write_file(track_list, out_stream, buffer_size, progress=progress, profiler=profiler)
+            out_stream.flush()
+
+        report("Done", len(track_list))
+        if profile is True:
+            print(profiler.report())
+    return len(tag) + xing_length + sum(x.audio_length for x in track_list)
+    ## stream_book ##
+
+
+def find_mp3_files(paths:list[str]) -> list[str]:
+    """
+    Expands a mix of mp3 files and directories into a list of mp3 files.
+    Directories are searched recursively, skipping invisible entries.
+
+    Arguments:
+        paths: mp3 file and directory paths
+
+    Returns: a sorted list of the paths of the mp3 files found
+    """
+    mp3_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            mp3_files.append(path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names[:] = [x for x in dir_names if x[0] != "."]
+            mp3_files.extend(
+                os.path.join(dir_path, x)
+                for x in file_names
+                if x[0] != "." and os.path.splitext(x)[-1].upper() == ".MP3"
+            )
+    return sorted(mp3_files)
+    ## find_mp3_files ##
+
+
+def group_by_album(tracks:list[TrackInfo]) -> tuple[dict[str, list[TrackInfo]], list[str]]:
+    """
+    Splits the tracks of a library into books using the album tag.
+
+    Arguments:
+        tracks: the TrackInfo records of every track in the library
+
+    Returns: (books, problems) where books is a {album: [TrackInfo]} dict and
+    problems lists the files that have no album tag
+    """
+    books = {}
+    problems = []
+    for track in tracks:
+        if not track.album:
+            problems.append(f"{os.path.basename(track.path)} missing album info")
+            continue
+        books.setdefault(track.album, []).append(track)
+    return books, problems
+    ## group_by_album ##
+
+
+def build_book(album:str, tracks:list[TrackInfo], options:dict) -> tuple[str, bool, str]:
+    """
+    Builds one book of a batch. This runs in a worker process so it reports
+    problems rather than raising them.
+
+    Arguments:
+        album: the album tag shared by the tracks
+        tracks: the TrackInfo records of the book's tracks
+        options: keyword arguments passed on to run_fuzer
+
+    Returns: (album, succeeded, message)
+    """
+    try:
+        return album, True, run_fuzer(tracks, **options)
+    except (TrackError, AlreadyExistsError) as e:
+        return album, False, e.message
+    except Exception as e:
+        return album, False, f"{type(e).__name__}: {e}"
+    ## build_book ##
+
+
+def run_batch(
+    paths,
+    dest_dir=None,
+    workers=DEFAULT_WORKERS,
+    jobs=DEFAULT_JOBS,
+    **options,
+) -> list[tuple[str, bool, str]]:
+    """
+    Builds every book found in a library in one go. The mp3 files are grouped
+    into books by their album tag and each book is checked by sort_tracks and
+    built by run_fuzer in a pool of worker processes. A book that fails doesn't
+    stop the others.
+
+    Arguments:
+        paths: mp3 files and directories to search for mp3 files
+        dest_dir: optional, the directory where the books are written
+        workers: optional, the number of books built at the same time
+        jobs: optional, the number of files whose tags are read concurrently
+        options: optional, other keyword arguments passed on to run_fuzer
+        (buffer_size, copy_threads, tag_padding, vbr_header, chapters,
+        incremental, validate, tag_index)
+
+    Returns: a list of (album, succeeded, message) tuples, one per book, plus
+    one with an album of None for files that couldn't be put in a book
+    """
+    print("Scanning library...")
+    index = TagIndex(options["tag_index"]) if options.get("tag_index") else None
+    try:
+        tracks = scan_tracks(find_mp3_files(paths), jobs, index)
+    finally:
+        if index is not None:
+            index.close()
+    books, problems = group_by_album(tracks)
+    results = []
+    if problems:
+        results.append((None, False, "\n".join(problems)))
+
+    print(f"Building {len(books)} books...")
+    options = dict(options, dest_dir=dest_dir, jobs=1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(build_book, album, book_tracks, options)
+            for album, book_tracks in sorted(books.items())
+        ]
+        results.extend(future.result() for future in futures)
+    return results
+    ## run_batch ##
+
+
+def book_is_complete(tracks:list[TrackInfo]) -> bool:
+    """
+    Arguments:
+        tracks: the TrackInfo records of the tracks of a book found so far
+
+    Returns: True if every disc and every track of the book is there, by the
+    same checks sort_tracks makes before a book is built
+    """
+    try:
+        sort_tracks(tracks, False)
+    except TrackError:
+        return False
+    return True
+    ## book_is_complete ##
+
+
+def ignore_interrupts() -> None:
+    """
+    Run in the worker processes of watch mode, so that Ctrl-C stops the watch
+    but lets the books being built finish
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch_library(
+    paths:list[str],
+    dest_dir:str|None=None,
+    workers:int=DEFAULT_WORKERS,
+    settle:float=DEFAULT_SETTLE_SECONDS,
+    **options,
+) -> None:
+    """
+    Watches folders that tracks are dropped into and builds each book as soon
+    as all of its tracks have arrived. Files are grouped into books by their
+    album tag and a book is complete when sort_tracks has nothing to complain
+    about. A file is only read once it hasn't changed for settle seconds, and
+    the books are built by a pool of worker processes. A book is built again,
+    and replaces the one built before, if its tracks change after it was
+    built. Runs until interrupted.
+
+    Arguments:
+        paths: the directories to watch, including their subdirectories
+        dest_dir: optional, the directory where the books are written
+        workers: optional, the number of books built at the same time
+        settle: optional, how many seconds a file has to stay unchanged
+        options: optional, other keyword arguments passed on to run_fuzer
+        (buffer_size, copy_threads, tag_padding, vbr_header, chapters,
+        incremental, validate, tag_index)
+    """
+    options = dict(options, dest_dir=dest_dir, jobs=1)
+    index = TagIndex(options["tag_index"]) if options.get("tag_index") else None
+    outputs = set()  # the books written, never taken for tracks
+    settled = {}  # path -> TrackInfo
+    unsettled = {}  # path -> ((size, mtime_ns) when last seen, when it last changed)
+    built = {}  # album -> the tracks it was last built from
+    running = {}  # future -> album
+
+    def changed(path:str, now:float) -> None:
+        path = os.path.abspath(path)
+        if os.path.splitext(path)[-1].upper() == ".MP3" and path not in outputs:
+            unsettled[path] = (None, now)
+            settled.pop(path, None)
+
+    def book_signature(tracks:list[TrackInfo]) -> frozenset|None:
+        signature = set()
+        for track in tracks:
+            try:
+                stat = os.stat(track.path)
+            except OSError:
+                return None
+            signature.add((track.path, stat.st_size, stat.st_mtime_ns))
+        return frozenset(signature)
+
+    with DirectoryWatcher(paths) as watcher, ProcessPoolExecutor(
+        max_workers=workers, initializer=ignore_interrupts
+    ) as pool:
+        how = "inotify" if watcher.inotify else "polling"
+        print(f"Watching {', '.join(watcher.roots)} ({how}), press Ctrl-C to stop...")
+        for path in watcher.existing():
+            changed(path, time.monotonic())
+        try:
+            while True:
+                events = watcher.changes(min(1.0, settle))
+                now = time.monotonic()
+                for path in events:
+                    changed(path, now)
+
+                albums = set()
+                for path, (seen, since) in list(unsettled.items()):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        del unsettled[path]
+                        continue
+                    current = (stat.st_size, stat.st_mtime_ns)
+                    if current != seen:
+                        unsettled[path] = (current, now)
+                        continue
+                    if now - since < settle:
+                        continue
+                    del unsettled[path]
+                    try:
+                        track = scan_tracks([path], 1, index)[0]
+                    except Exception as e:
+                        print(f"Skipping {path}: {e}")
+                        continue
+                    if not track.album:
+                        print(f"Skipping {path}: missing album info")
+                        continue
+                    settled[path] = track
+                    albums.add(track.album)
+
+                for future in [x for x in running if x.done()]:
+                    album, succeeded, message = future.result()
+                    print(f"{'Built' if succeeded else 'FAILED'} {album}: {message}")
+                    # Tracks may have changed while it was being built
+                    albums.add(running.pop(future))
+
+                for album in albums - set(running.values()):
+                    tracks = [x for x in settled.values() if x.album == album]
+                    signature = book_signature(tracks)
+                    if signature is None or signature == built.get(album):
+                        continue
+                    if not book_is_complete(tracks):
+                        continue
+                    # A book built earlier in this watch is replaced
+                    rebuild = album in built
+                    built[album] = signature
+                    out_name = get_output_file_name(tracks[0])
+                    outputs.add(os.path.abspath(os.path.join(dest_dir or "", out_name)))
+                    print(f"All {len(tracks)} tracks of {album} are here, building it...")
+                    running[
+                        pool.submit(build_book, album, tracks, dict(options, replace=rebuild))
+                    ] = album
+        except KeyboardInterrupt:
+            print("Stopping, waiting for the books being built...")
+            pool.shutdown(wait=True, cancel_futures=True)
+        finally:
+            if index is not None:
+                index.close()
+    ## watch_library ##
+
+
+class FuzerGroup(click.Group):
+    """
+    A click group that runs the build command when the first argument isn't
+    the name of a command, so the original "Fuzer.py [options] files..." usage
+    keeps working alongside "Fuzer.py batch ...".
+    """
+
+    default_command = "build"
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ("--help", "-h"):
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+
+def build_options(command):
+    """
+    Adds the options that control how a book is built, which are shared by the
+    build and batch commands.
+    """
+    for option in reversed(
+        [
+            click.option(
+                "--buffer-size",
+                "-bs",
+                type=click.IntRange(min=4096),
+                default=DEFAULT_BUFFER_SIZE,
+                show_default=True,
+                help="Size in bytes of the chunks used when copying audio",
+            ),
+            click.option(
+                "--jobs",
+                "-j",
+                type=click.IntRange(min=1),
+                default=DEFAULT_JOBS,
+                show_default=True,
+                help="Number of input files whose tags are read concurrently",
+            ),
+            click.option(
+                "--copy-threads",
+                "-ct",
+                type=click.IntRange(min=1),
+                default=DEFAULT_COPY_THREADS,
+                show_default=True,
+                help="Number of tracks copied into the book at the same time",
+            ),
+            click.option(
+                "--tag-padding",
+                "-tp",
+                type=click.IntRange(min=0),
+                default=DEFAULT_TAG_PADDING,
+                show_default=True,
+                help="Bytes of padding reserved in the output's tag for later edits",
+            ),
+            click.option(
+                "--vbr-header/--no-vbr-header",
+                default=True,
+                show_default=True,
+                help="Write a Xing header with a seek TOC and the length of the whole book",
+            ),
+            click.option(
+                "--chapters",
+                "-ch",
+                is_flag=True,
+                help="Add a chapter (ID3 CHAP frame) for each input track",
+            ),
+            click.option(
+                "--incremental",
+                "-i",
+                is_flag=True,
+                help="Keep a manifest so that rebuilds only rewrite what changed",
+            ),
+            click.option(
+                "--validate/--no-validate",
+                default=True,
+                show_default=True,
+                help="Check that every track has the same sample rate, channels and layer before writing",
+            ),
+            click.option(
+                "--tag-index",
+                "-ti",
+                type=click.Path(dir_okay=False),
+                default=None,
+                envvar=INDEX_ENVIRONMENT_VARIABLE,
+                help=f"SQLite index of tags to reuse for unchanged files [env: {INDEX_ENVIRONMENT_VARIABLE}]",
+            ),
+        ]
+    ):
+        command = option(command)
+    return command
+
+
+@click.group(cls=FuzerGroup)
+def cli():
+    """
+    Combines mp3 files into books. Run "Fuzer.py COMMAND --help" for the
+    options of each command, "build" is used when no command is given.
+    """
+
+
+@cli.command("build")
 @click.option(
     "--cover", "-c", type=click.File("rb"), default=None, help="JPEG cover art file"
 )
 @click.option(
-    "--title", "-t", type=click.STRING, default=None, help="The name of the output file"
+    "--title",
+    "-t",
+    type=click.STRING,
+    default=None,
+    help='The name of the output file, "-" writes the book to stdout',
 )
 @click.option(
     "--dest_dir",
@@ -372,8 +2292,46 @@ def run_fuzer(
     help="The directory where the file should be written",
 )
 @click.option("--file-order", "-fo", is_flag=True)
+@click.option(
+    "--profile",
+    "-p",
+    is_flag=True,
+    help="Print the time, I/O, file opens and memory used by each phase and track",
+)
+@click.option(
+    "--profile-json",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Write the profile to this JSON file",
+)
+@click.option(
+    "--server/--no-server",
+    "use_server",
+    default=False,
+    show_default=True,
+    help='Hand the book to a running "Fuzer.py serve" if there is one',
+)
+@build_options
 @click.argument("source_files", type=click.Path(exists=True), nargs=-1)
-def fuzer(cover, title, dest_dir, file_order, source_files):
+def fuzer(
+    cover,
+    title,
+    dest_dir,
+    file_order,
+    profile,
+    profile_json,
+    use_server,
+    buffer_size,
+    jobs,
+    copy_threads,
+    tag_padding,
+    vbr_header,
+    chapters,
+    incremental,
+    validate,
+    tag_index,
+    source_files,
+):
     """
     This script takes a list of mp3 files on the command line, strips the ID3 tags
     concatenates the sound portions, adds the ID3 tags from the first input file to the
@@ -386,17 +2344,334 @@ def fuzer(cover, title, dest_dir, file_order, source_files):
     Arguments:
         cover: optional, jpeg file containing a cover image for the combined files
         title: optional, if set it is the name of the output file, otherwise the file
-        name is generated from the title tag of the first file
+        name is generated from the title tag of the first file. "-" streams the
+        book to stdout, see stream_book
         dest_dir: optional, if set the directory where the new file should be written
         file_order: a flag, if set the files are concatenated in the order they are
         specificed on the command line
         concatenated.
+        profile: a flag, if set a table of the time, I/O, file opens and memory
+        used by each phase and track is printed
+        profile_json: optional, a file the profile is written to as JSON
+        use_server: a flag, if set and a build server is running the book is
+        built by the server. Profiled and streamed builds are always local.
+        buffer_size: the size of the chunks used when copying the audio
+        jobs: the number of input files whose tags are read concurrently
+        copy_threads: the number of tracks copied into the book at the same time
+        tag_padding: bytes of padding reserved in the output file's tag
+        vbr_header: a flag, if set a Xing header and TLEN tag are written
+        chapters: a flag, if set each input track becomes a chapter of the book
+        incremental: a flag, if set rebuilding an existing book only rewrites the
+        tracks from the first one that changed
+        validate: a flag, if set the audio formats of the tracks are checked
+        tag_index: optional, the path of a tag index to use
         source_files: the individual mp3 files that are going to be combined.
     """
-    run_fuzer(source_files, cover, title, dest_dir, file_order)
+    profiler = Profiler(enabled=profile or bool(profile_json))
+    if title == "-":
+        if incremental or dest_dir:
+            raise click.UsageError(
+                "--incremental and --dest_dir need a book file, not --title -"
+            )
+        out_stream = sys.stdout.buffer
+        # Everything else goes to stderr, stdout carries the book
+        with redirect_stdout(sys.stderr):
+            stream_book(
+                source_files,
+                out_stream,
+                cover,
+                file_order,
+                buffer_size=buffer_size,
+                jobs=jobs,
+                tag_padding=tag_padding,
+                vbr_header=vbr_header,
+                chapters=chapters,
+                profile=profiler,
+                validate=validate,
+                tag_index=tag_index,
+            )
+            if profile:
+                print(profiler.report())
+            if profile_json:
+                profiler.write_json(profile_json)
+        return
+    if (
+        use_server
+        and not (profile or profile_json)
+        and (cover is None or os.path.isfile(cover.name))
+        and server.server_available()
+    ):
+        job_status = server.build(
+            source_files,
+            cover=cover.name if cover else None,
+            title=title,
+            dest_dir=dest_dir,
+            file_order=file_order,
+            buffer_size=buffer_size,
+            jobs=jobs,
+            copy_threads=copy_threads,
+            tag_padding=tag_padding,
+            vbr_header=vbr_header,
+            chapters=chapters,
+            incremental=incremental,
+            validate=validate,
+            tag_index=tag_index,
+        )
+        if job_status["state"] != "done":
+            raise click.ClickException(job_status["message"])
+        print(job_status["message"])
+        print("All done.")
+        return
+    message = run_fuzer(
+        source_files,
+        cover,
+        title,
+        dest_dir,
+        file_order,
+        profile=profiler,
+        buffer_size=buffer_size,
+        jobs=jobs,
+        copy_threads=copy_threads,
+        tag_padding=tag_padding,
+        vbr_header=vbr_header,
+        chapters=chapters,
+        incremental=incremental,
+        validate=validate,
+        tag_index=tag_index,
+    )
+    # Where the book went
+    print(message)
+    if profile:
+        print(profiler.report())
+    if profile_json:
+        profiler.write_json(profile_json)
+    print("All done.")
+
+
+@cli.command("batch")
+@click.option(
+    "--dest_dir",
+    "-dd",
+    type=click.Path(exists=True),
+    help="The directory where the books should be written",
+)
+@click.option(
+    "--file-list",
+    "-fl",
+    type=click.File("r"),
+    default=None,
+    help="A file listing mp3 files and directories, one per line",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Number of books built at the same time",
+)
+@build_options
+@click.argument("paths", type=click.Path(exists=True), nargs=-1)
+@click.pass_context
+def batch(
+    ctx,
+    dest_dir,
+    file_list,
+    workers,
+    buffer_size,
+    jobs,
+    copy_threads,
+    tag_padding,
+    vbr_header,
+    chapters,
+    incremental,
+    validate,
+    tag_index,
+    paths,
+):
+    """
+    Builds every book in a library. The mp3 files given on the command line,
+    found in the directories given (searched recursively) and listed in the
+    --file-list file are grouped into books by their album tag, and the books
+    are built in parallel. Every book is attempted and a report of the ones
+    that failed is printed at the end.
+    """
+    paths = list(paths)
+    if file_list:
+        paths.extend(x.strip() for x in file_list if x.strip())
+    results = run_batch(
+        paths,
+        dest_dir,
+        workers,
+        jobs,
+        buffer_size=buffer_size,
+        copy_threads=copy_threads,
+        tag_padding=tag_padding,
+        vbr_header=vbr_header,
+        chapters=chapters,
+        incremental=incremental,
+        validate=validate,
+        tag_index=tag_index,
+    )
+
+    failures = 0
+    print("Batch report:")
+    for album, succeeded, message in results:
+        if succeeded:
+            print(f"  OK     {album}: {message}")
+        else:
+            failures += 1
+            heading = album if album is not None else "Not grouped"
+            print(f"  FAILED {heading}:")
+            for line in message.split("\n"):
+                print(f"           {line}")
+    if failures:
+        ctx.exit(1)
+
+
+@cli.command("watch")
+@click.option(
+    "--dest_dir",
+    "-dd",
+    type=click.Path(exists=True),
+    help="The directory where the books should be written",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    help="Number of books built at the same time",
+)
+@click.option(
+    "--settle",
+    "-s",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_SETTLE_SECONDS,
+    show_default=True,
+    help="Seconds a file has to stay unchanged before it is read",
+)
+@build_options
+@click.argument(
+    "paths", type=click.Path(exists=True, file_okay=False), nargs=-1, required=True
+)
+def watch(
+    dest_dir,
+    workers,
+    settle,
+    buffer_size,
+    jobs,
+    copy_threads,
+    tag_padding,
+    vbr_header,
+    chapters,
+    incremental,
+    validate,
+    tag_index,
+    paths,
+):
+    """
+    Watches inbox directories and builds each book as soon as all of its
+    discs and tracks have arrived. The mp3 files are grouped into books by
+    their album tag, files still being copied in are left alone until they
+    have been unchanged for --settle seconds, and up to --workers books are
+    built at once. Runs until interrupted with Ctrl-C.
+    """
+    watch_library(
+        paths,
+        dest_dir,
+        workers,
+        settle,
+        buffer_size=buffer_size,
+        copy_threads=copy_threads,
+        tag_padding=tag_padding,
+        vbr_header=vbr_header,
+        chapters=chapters,
+        incremental=incremental,
+        validate=validate,
+        tag_index=tag_index,
+    )
+
+
+@cli.command("index")
+@click.option(
+    "--tag-index",
+    "-ti",
+    type=click.Path(dir_okay=False),
+    required=True,
+    envvar=INDEX_ENVIRONMENT_VARIABLE,
+    help=f"The SQLite index to update [env: {INDEX_ENVIRONMENT_VARIABLE}]",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Number of files read concurrently",
+)
+@click.option(
+    "--formats",
+    "-f",
+    is_flag=True,
+    help="Also scan the audio formats that --validate checks",
+)
+@click.option(
+    "--prune", is_flag=True, help="Drop the entries of files under PATHS that are gone"
+)
+@click.argument("paths", type=click.Path(exists=True), nargs=-1, required=True)
+def index_library(tag_index, jobs, formats, prune, paths):
+    """
+    Brings a tag index up to date with the mp3 files found in PATHS (searched
+    recursively), so later builds, batches and winFuzer visits can take the
+    tags of unchanged files from it. Only new and changed files are read.
+    """
+    with TagIndex(tag_index) as index:
+        mp3_files = find_mp3_files(paths)
+        print(f"Indexing {len(mp3_files)} files...")
+        tracks = scan_tracks(mp3_files, jobs, index)
+        if formats:
+            print("Scanning audio formats...")
+            for start in range(0, len(tracks), BATCH_SIZE):
+                try:
+                    check_formats(tracks[start : start + BATCH_SIZE], jobs, index)
+                except TrackError:
+                    pass  # a library mixes formats, only the scan is wanted
+        if prune:
+            removed = index.prune([x for x in paths if os.path.isdir(x)])
+            print(f"Removed {removed} entries of missing files")
     print("All done.")
 
 
+@cli.command("serve")
+@click.option(
+    "--socket",
+    "-so",
+    "socket_path",
+    type=click.Path(dir_okay=False),
+    default=None,
+    envvar=server.SOCKET_ENVIRONMENT_VARIABLE,
+    help=f"The Unix socket to listen on [env: {server.SOCKET_ENVIRONMENT_VARIABLE}]",
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=click.IntRange(min=1),
+    default=server.DEFAULT_SERVER_WORKERS,
+    show_default=True,
+    help="Number of books built at the same time",
+)
+def serve(socket_path, workers):
+    """
+    Runs a build server that keeps this process warm, so later builds skip
+    the start up. While it runs, "Fuzer.py build --server" and winFuzer hand
+    their books to it, and scripts can use the lighter "server.py build"
+    client. Runs until interrupted with Ctrl-C.
+    """
+    server.serve(run_fuzer, socket_path, workers)
+
+
 ## Main ##
 if __name__ == "__main__":
-    fuzer()
+    cli()
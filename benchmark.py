@@ -0,0 +1,559 @@
+#! /usr/bin/env python
+
+"""
+Benchmarks for Fuzer. A synthetic library of valid MPEG audio tracks with
+realistic tags is generated (the number and size of the tracks, how they are
+spread over discs and the size of the cover embedded in each one are all
+configurable) and the main steps of a build are timed on it: scan_tracks,
+sort_tracks, write_file, add_tags, add_cover_art and a complete run_fuzer.
+
+Each benchmark runs in a fresh process so that its peak memory and file open
+counts aren't mixed up with the others'. The results, along with the git
+revision and the machine they were taken on, can be saved as JSON and compared
+with the results of an earlier version to spot regressions.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from io import BytesIO
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+
+import click
+from mutagen.id3 import APIC, ID3, TALB, TIT2, TPE1, TPOS, TRCK
+
+import Fuzer
+from mpeg import FrameIndex, parse_frame_header, xing_frame
+from profiling import Profiler
+
+RESULTS_VERSION = 1
+
+# MPEG 1 layer III, 128 kbps, 44.1 kHz, joint stereo, no CRC
+FRAME_HEADER = bytes((0xFF, 0xFB, 0x90, 0x44))
+
+# Frames generated at a time when writing the audio of a track
+FRAMES_PER_BLOCK = 256
+
+BENCHMARKS = (
+    "scan_tracks",
+    "sort_tracks",
+    "write_file",
+    "add_tags",
+    "add_cover_art",
+    "run_fuzer",
+)
+
+
+def synthetic_jpeg(size:int, seed:int=0) -> bytes:
+    """
+    Arguments:
+        size: the number of bytes wanted
+        seed: optional, picks the contents
+
+    Returns: size bytes that start and end like a jpeg file, to stand in for
+    cover art
+    """
+    if size < 4:
+        return b""
+    body = random.Random(seed).randbytes(size - 4)
+    return b"\xff\xd8" + body + b"\xff\xd9"
+    ## synthetic_jpeg ##
+
+
+def audio_block(seed:int) -> bytes:
+    """
+    Arguments:
+        seed: picks the contents of the frames
+
+    Returns: FRAMES_PER_BLOCK frames of valid (if noisy) MPEG audio. Like real
+    audio, the payloads are random bytes that are full of would-be frame syncs.
+    """
+    length = parse_frame_header(FRAME_HEADER)[0]
+    rng = random.Random(seed)
+    return b"".join(
+        FRAME_HEADER + rng.randbytes(length - 4) for _ in range(FRAMES_PER_BLOCK)
+    )
+    ## audio_block ##
+
+
+def make_track(
+    path:str,
+    audio_size:int,
+    album:str,
+    disc:int,
+    discs:int,
+    track:int,
+    tracks:int,
+    apic:bytes=b"",
+    block:bytes|None=None,
+) -> None:
+    """
+    Writes one synthetic track: an ID3v2.3 tag like the ones rippers and
+    stores produce, an encoder's Info header frame describing the track and
+    audio_size bytes (rounded up to a whole audio_block) of audio.
+
+    Arguments:
+        path: where to write the track
+        audio_size: roughly how many bytes of audio to write
+        album: the album tag
+        disc: the disc number
+        discs: the number of discs
+        track: the track number on the disc
+        tracks: the number of tracks on the disc
+        apic: optional, cover art to embed in the tag
+        block: optional, the audio_block to repeat, one is made if not given
+    """
+    tags = ID3()
+    tags.add(TALB(encoding=1, text=[album]))
+    tags.add(TIT2(encoding=1, text=[f"Disc {disc} track {track}"]))
+    tags.add(TPE1(encoding=1, text=["Fuzer Benchmark"]))
+    tags.add(TPOS(encoding=1, text=[f"{disc}/{discs}"]))
+    tags.add(TRCK(encoding=1, text=[f"{track}/{tracks}"]))
+    if apic:
+        tags.add(APIC(encoding=0, mime="image/jpeg", type=3, desc="", data=apic))
+    tag = BytesIO()
+    tags.save(tag, v1=0, v2_version=3, padding=lambda info: 1024)
+
+    if block is None:
+        block = audio_block(disc * 1000 + track)
+    blocks = max(-(-audio_size // len(block)), 1)
+    index = FrameIndex()
+    for _ in range(blocks):
+        index.feed(block)
+    with open(path, "wb") as out_file:
+        out_file.write(tag.getvalue())
+        out_file.write(xing_frame(FRAME_HEADER, index))
+        for _ in range(blocks):
+            out_file.write(block)
+    ## make_track ##
+
+
+def make_corpus(
+    directory:str,
+    tracks:int,
+    track_size:int,
+    discs:int=1,
+    apic_size:int=0,
+    album:str="Fuzer Benchmark",
+    seed:int=0,
+) -> list[str]:
+    """
+    Generates a synthetic book, its tracks spread as evenly as possible over
+    its discs.
+
+    Arguments:
+        directory: where to write the tracks
+        tracks: the total number of tracks
+        track_size: roughly how many bytes of audio each track has
+        discs: optional, the number of discs
+        apic_size: optional, the size of the cover art embedded in each track
+        album: optional, the album tag of the tracks
+        seed: optional, picks the contents and the order of the paths returned
+
+    Returns: the paths of the tracks, shuffled so that sorting them is work
+    """
+    os.makedirs(directory, exist_ok=True)
+    apic = synthetic_jpeg(apic_size, seed)
+    block = audio_block(seed)
+    paths = []
+    per_disc, extra = divmod(tracks, discs)
+    for disc in range(1, discs + 1):
+        disc_tracks = per_disc + (disc <= extra)
+        for track in range(1, disc_tracks + 1):
+            path = os.path.join(directory, f"d{disc:02d}t{track:03d}.mp3")
+            make_track(path, track_size, album, disc, discs, track, disc_tracks, apic, block)
+            paths.append(path)
+    random.Random(seed).shuffle(paths)
+    return paths
+    ## make_corpus ##
+
+
+def run_benchmark(name:str, paths:list[str], work_dir:str, options:dict) -> dict:
+    """
+    Runs one benchmark, options["repeat"] times. Meant to be run in a process
+    of its own, anything Fuzer prints is thrown away.
+
+    Arguments:
+        name: one of BENCHMARKS
+        paths: the tracks of the corpus
+        work_dir: a directory outputs can be written to
+        options: the buffer_size, apic_size and repeat settings
+
+    Returns: the benchmark's results, see summarize
+    """
+    buffer_size = options["buffer_size"]
+    cover = synthetic_jpeg(options["apic_size"], 1)
+    out_name = os.path.join(work_dir, f"{name}.mp3")
+    input_bytes = sum(os.path.getsize(x) for x in paths)
+    profiler = Profiler()
+    data_bytes = None
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        tracks = Fuzer.scan_tracks(paths)
+
+        def write_book(tagged:bool=False) -> None:
+            with open(out_name, "wb") as out_file:
+                Fuzer.write_file(
+                    Fuzer.sort_tracks(tracks, False),
+                    out_file,
+                    buffer_size,
+                    FrameIndex(),
+                )
+            if tagged:
+                Fuzer.add_tags(tracks[0], out_name)
+
+        for _ in range(options["repeat"]):
+            if name == "scan_tracks":
+                data_bytes = input_bytes
+                with profiler.phase(name):
+                    Fuzer.scan_tracks(paths)
+            elif name == "sort_tracks":
+                with profiler.phase(name):
+                    Fuzer.sort_tracks(tracks, False)
+            elif name == "write_file":
+                data_bytes = sum(x.audio_length for x in tracks)
+                with profiler.phase(name), open(out_name, "wb") as out_file:
+                    Fuzer.write_file(
+                        Fuzer.sort_tracks(tracks, False),
+                        out_file,
+                        buffer_size,
+                        FrameIndex(),
+                    )
+            elif name == "add_tags":
+                write_book()
+                data_bytes = os.path.getsize(out_name)
+                with profiler.phase(name):
+                    Fuzer.add_tags(tracks[0], out_name)
+            elif name == "add_cover_art":
+                write_book(tagged=True)
+                data_bytes = os.path.getsize(out_name)
+                with profiler.phase(name):
+                    Fuzer.add_cover_art(out_name, BytesIO(cover))
+            elif name == "run_fuzer":
+                data_bytes = input_bytes
+                cover_name = os.path.join(work_dir, "cover.jpg")
+                with open(cover_name, "wb") as cover_file:
+                    cover_file.write(cover)
+                with profiler.phase(name), open(cover_name, "rb") as cover_file:
+                    Fuzer.run_fuzer(
+                        paths,
+                        cover_file,
+                        os.path.basename(out_name),
+                        work_dir,
+                        buffer_size=buffer_size,
+                    )
+            else:
+                raise ValueError(f"Unknown benchmark {name}")
+            if os.path.exists(out_name):
+                os.remove(out_name)
+
+    return summarize(name, profiler.phases, data_bytes, len(paths))
+    ## run_benchmark ##
+
+
+def summarize(name:str, runs:list[dict], data_bytes:int|None, track_count:int) -> dict:
+    """
+    Arguments:
+        name: the name of the benchmark
+        runs: the Profiler phase records of each run
+        data_bytes: the number of bytes each run processes, None where a rate in
+        MB/s doesn't mean anything
+        track_count: the number of tracks each run processes
+
+    Returns: a dict with the best and median times, the best throughput in MB/s
+    and tracks/s, the peak memory and the files opened per run, plus the
+    records of the runs themselves
+    """
+    seconds = [x["seconds"] for x in runs]
+    best = min(seconds)
+    return {
+        "name": name,
+        "runs": runs,
+        "best_seconds": best,
+        "median_seconds": statistics.median(seconds),
+        "bytes": data_bytes,
+        "mb_per_s": data_bytes / 2**20 / best if data_bytes and best > 0 else None,
+        "tracks_per_s": track_count / best if best > 0 else None,
+        "peak_memory": max((x["peak_memory"] or 0) for x in runs) or None,
+        "opens": runs[-1]["opens"],
+    }
+    ## summarize ##
+
+
+def git_revision() -> str|None:
+    """
+    Returns: the git commit the benchmarked Fuzer came from, None if unknown
+    """
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+    ## git_revision ##
+
+
+def run_benchmarks(
+    names:list[str],
+    work_dir:str,
+    tracks:int,
+    track_size:int,
+    discs:int=1,
+    apic_size:int=0,
+    repeat:int=3,
+    buffer_size:int=Fuzer.DEFAULT_BUFFER_SIZE,
+) -> dict:
+    """
+    Generates a corpus in work_dir and runs the benchmarks on it.
+
+    Arguments:
+        names: the benchmarks to run, from BENCHMARKS
+        work_dir: the directory the corpus and the outputs are written to
+        tracks: the number of tracks in the corpus
+        track_size: roughly how many bytes of audio each track has
+        discs: optional, the number of discs the tracks are spread over
+        apic_size: optional, the size of the cover art in each track and of
+        the cover added to the book
+        repeat: optional, how many times each benchmark is run
+        buffer_size: optional, the buffer_size given to Fuzer
+
+    Returns: the results, ready to be saved as JSON
+    """
+    corpus = {
+        "tracks": tracks,
+        "track_size": track_size,
+        "discs": discs,
+        "apic_size": apic_size,
+    }
+    options = {"buffer_size": buffer_size, "apic_size": apic_size, "repeat": repeat}
+    print(f"Generating {tracks} tracks in {work_dir}...")
+    paths = make_corpus(os.path.join(work_dir, "corpus"), tracks, track_size, discs, apic_size)
+
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    for name in names:
+        print(f"Running {name}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            results.append(pool.submit(run_benchmark, name, paths, work_dir, options).result())
+
+    return {
+        "version": RESULTS_VERSION,
+        "revision": git_revision(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus,
+        "options": options,
+        "benchmarks": results,
+    }
+    ## run_benchmarks ##
+
+
+def report(results:dict) -> str:
+    """
+    Returns: the results of run_benchmarks as a table for printing
+    """
+
+    def number(value:float|None, digits:int=1) -> str:
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    lines = [
+        f"{'':<16} {'best s':>9} {'median s':>9} {'MB/s':>9} {'tracks/s':>9} "
+        f"{'opens':>6} {'peak MB':>9}"
+    ]
+    for x in results["benchmarks"]:
+        peak = x["peak_memory"] / 2**20 if x["peak_memory"] else None
+        lines.append(
+            f"{x['name']:<16} {x['best_seconds']:>9.4f} {x['median_seconds']:>9.4f} "
+            f"{number(x['mb_per_s']):>9} {number(x['tracks_per_s']):>9} "
+            f"{x['opens']:>6} {number(peak):>9}"
+        )
+    return "\n".join(lines)
+    ## report ##
+
+
+def compare(old:dict, new:dict, threshold:float) -> tuple[str, list[str]]:
+    """
+    Compares the best times of two sets of results
+
+    Arguments:
+        old: the results of the earlier version
+        new: the results of this version
+        threshold: the fraction a benchmark may slow down before it counts as
+        a regression
+
+    Returns: (a table of the changes for printing, the names of the benchmarks
+    that regressed)
+    """
+    old_benchmarks = {x["name"]: x for x in old["benchmarks"]}
+    lines = [
+        f"Compared with {old.get('revision') or 'unknown'} from {old.get('date')}",
+        f"{'':<16} {'old s':>9} {'new s':>9} {'change':>8}",
+    ]
+    regressions = []
+    if old.get("corpus") != new.get("corpus"):
+        lines.insert(1, "Warning: the corpus settings differ")
+    for x in new["benchmarks"]:
+        before = old_benchmarks.get(x["name"])
+        if before is None:
+            continue
+        change = x["best_seconds"] / before["best_seconds"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(x["name"])
+            flag = "  REGRESSION"
+        lines.append(
+            f"{x['name']:<16} {before['best_seconds']:>9.4f} "
+            f"{x['best_seconds']:>9.4f} {change:>+8.1%}{flag}"
+        )
+    return "\n".join(lines), regressions
+    ## compare ##
+
+
+@click.command()
+@click.option(
+    "--tracks",
+    "-n",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="Number of tracks in the corpus",
+)
+@click.option(
+    "--track-size",
+    "-s",
+    type=click.IntRange(min=1),
+    default=4 * 2**20,
+    show_default=True,
+    help="Bytes of audio in each track",
+)
+@click.option(
+    "--discs",
+    "-d",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of discs the tracks are spread over",
+)
+@click.option(
+    "--apic-size",
+    "-a",
+    type=click.IntRange(min=0),
+    default=100 * 1024,
+    show_default=True,
+    help="Bytes of cover art embedded in each track and added to the book",
+)
+@click.option(
+    "--repeat",
+    "-r",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="Number of times each benchmark is run",
+)
+@click.option(
+    "--buffer-size",
+    "-bs",
+    type=click.IntRange(min=4096),
+    default=Fuzer.DEFAULT_BUFFER_SIZE,
+    show_default=True,
+    help="Size in bytes of the chunks used when copying audio",
+)
+@click.option(
+    "--benchmark",
+    "-b",
+    "names",
+    type=click.Choice(BENCHMARKS),
+    multiple=True,
+    help="Run only this benchmark, can be given more than once",
+)
+@click.option(
+    "--work-dir",
+    "-w",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Where to generate the corpus, a temporary directory by default",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Write the results to this JSON file",
+)
+@click.option(
+    "--compare",
+    "-c",
+    "compare_with",
+    type=click.File("r"),
+    default=None,
+    help="Compare with results saved from an earlier run",
+)
+@click.option(
+    "--threshold",
+    "-t",
+    type=click.FloatRange(min=0),
+    default=0.1,
+    show_default=True,
+    help="Fraction a benchmark may slow down before it is a regression",
+)
+@click.pass_context
+def benchmark(
+    ctx,
+    tracks,
+    track_size,
+    discs,
+    apic_size,
+    repeat,
+    buffer_size,
+    names,
+    work_dir,
+    output,
+    compare_with,
+    threshold,
+):
+    """
+    Times Fuzer on a generated library and prints the results. With --compare,
+    exits with status 1 if any benchmark is slower than it was in the saved
+    results by more than the threshold.
+    """
+    names = list(names) or list(BENCHMARKS)
+    temporary = work_dir is None
+    if temporary:
+        work_dir = tempfile.mkdtemp(prefix="fuzer-benchmark-")
+    try:
+        results = run_benchmarks(
+            names, work_dir, tracks, track_size, discs, apic_size, repeat, buffer_size
+        )
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(report(results))
+    if output:
+        with open(output, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+    if compare_with:
+        table, regressions = compare(json.load(compare_with), results, threshold)
+        print(table)
+        if regressions:
+            ctx.exit(1)
+
+
+## Main ##
+if __name__ == "__main__":
+    benchmark()
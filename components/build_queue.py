@@ -0,0 +1,266 @@
+"""
+winFuzer's queue of books. Each book added keeps its own mp3 files, cover and
+destination, so the next one can be prepared while the queue is worked
+through. The books are built by a pool of worker processes, up to
+queue_workers of them at a time, which leaves the window responsive however
+many are queued. Progress reports and results come back to the UI thread
+through Qt signals, and the book_queue state is set whenever anything about
+the queue changes.
+"""
+
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PySide6.QtCore import QCoreApplication, QObject, Signal
+from winup import state
+from Fuzer import ignore_interrupts
+from components.queue_worker import build_queued_book
+
+# Books are mostly copied, more than a few at a time just compete for the disk
+DEFAULT_QUEUE_WORKERS = 2
+MAX_QUEUE_WORKERS = 8
+
+messages = state.create("messages")
+# Set to a count of the changes each time a book is added, starts, reports
+# progress or finishes
+book_queue = state.create("book_queue")
+# The number of books built at the same time
+queue_workers = state.create("queue_workers", DEFAULT_QUEUE_WORKERS)
+
+UNFINISHED_STATES = ("queued", "building")
+
+_books = {}  # number -> QueuedBook, in the order they were added
+_numbers = itertools.count(1)
+_generation = 0
+_pool = None
+_pool_workers = None
+_manager = None
+_events = None
+
+
+class QueuedBook:
+    """
+    A book waiting in, or worked through by, the queue
+
+    Attributes:
+        number: the book's place in the queue, counting from 1
+        name: what the book is called in the queue panel
+        mp3_files: the mp3 files of the book
+        cover_image: the jpeg file of the cover or None
+        destination_dir: the directory the book is written to
+        state: "queued", "building", "done", "failed" or "cancelled"
+        message: what the build said when it finished
+        progress: the latest ProgressEvent of the build, or None
+    """
+
+    __slots__ = (
+        "number",
+        "name",
+        "mp3_files",
+        "cover_image",
+        "destination_dir",
+        "state",
+        "message",
+        "progress",
+        "cancel",
+        "future",
+    )
+
+    def __init__(self, number:int, name:str, mp3_files:list[str], cover_image:str|None, destination_dir:str):
+        self.number = number
+        self.name = name
+        self.mp3_files = mp3_files
+        self.cover_image = cover_image
+        self.destination_dir = destination_dir
+        self.state = "queued"
+        self.message = None
+        self.progress = None
+        self.cancel = None
+        self.future = None
+    ## QueuedBook ##
+
+
+class QueueSignals(QObject):
+    """
+    Progress arrives on a relay thread and results on the pool's thread,
+    emitting them gets them onto the UI thread before they touch any state.
+    """
+
+    progress = Signal(int, object)
+    finished = Signal(object)
+
+
+queue_signals = QueueSignals()
+
+
+def changed() -> None:
+    global _generation
+    _generation += 1
+    book_queue.set(_generation)
+
+
+def relay_events() -> None:
+    """
+    Runs on a background thread for as long as the shared queue exists
+    """
+    while True:
+        try:
+            number, progress = _events.get()
+        except (EOFError, OSError):
+            return  # winFuzer is closing
+        queue_signals.progress.emit(number, progress)
+
+
+def pool() -> ProcessPoolExecutor:
+    """
+    Returns: the pool of worker processes, started when first needed. Workers
+    are spawned rather than forked, forking a process running Qt isn't safe.
+    """
+    global _pool, _pool_workers, _manager, _events
+    context = multiprocessing.get_context("spawn")
+    if _manager is None:
+        _manager = context.Manager()
+        _events = _manager.Queue()
+        threading.Thread(target=relay_events, daemon=True).start()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(shutdown)
+    if _pool is None:
+        _pool_workers = queue_workers.get()
+        _pool = ProcessPoolExecutor(
+            max_workers=_pool_workers, mp_context=context, initializer=ignore_interrupts
+        )
+    return _pool
+
+
+def books() -> list[QueuedBook]:
+    return list(_books.values())
+
+
+def add_book(mp3_files:list[str], cover_image:str|None, destination_dir:str, name:str|None=None) -> QueuedBook:
+    """
+    Puts a book at the end of the queue. It is built as soon as a worker is free.
+
+    Arguments:
+        mp3_files: the mp3 files of the book
+        cover_image: the jpeg file of the cover or None
+        destination_dir: the directory the book is written to
+        name: optional, what to call the book, e.g. its album, the name of the
+        directory of its first file is used if not given
+
+    Returns: the QueuedBook
+    """
+    if not name:
+        name = os.path.basename(os.path.dirname(os.path.abspath(mp3_files[0])))
+    book = QueuedBook(next(_numbers), name, list(mp3_files), cover_image, destination_dir)
+    workers = pool()
+    book.cancel = _manager.Event()
+    book.future = workers.submit(
+        build_queued_book,
+        book.number,
+        book.mp3_files,
+        book.cover_image,
+        book.destination_dir,
+        _events,
+        book.cancel,
+    )
+    book.future.add_done_callback(lambda future: on_future_done(book.number, future))
+    _books[book.number] = book
+    changed()
+    return book
+    ## add_book ##
+
+
+def on_future_done(number:int, future) -> None:
+    if future.cancelled():
+        result = (number, "cancelled", "Cancelled before it started")
+    else:
+        try:
+            result = future.result()
+        except Exception as e:  # e.g. the worker process died
+            result = (number, "failed", f"{type(e).__name__}: {e}")
+    queue_signals.finished.emit(result)
+
+
+def on_progress(number:int, progress) -> None:
+    book = _books.get(number)
+    if book is None or book.state not in UNFINISHED_STATES:
+        return
+    book.state = "building"
+    book.progress = progress
+    changed()
+
+
+def on_finished(result:tuple[int, str, str]) -> None:
+    global _pool
+    number, book_state, message = result
+    book = _books.get(number)
+    if book is None:
+        return
+    book.state = book_state
+    book.message = message
+    messages.set(f"{book.name}: {message}")
+    if _pool is not None and _pool_workers != queue_workers.get() and not unfinished():
+        # The number of workers was changed while books were being built
+        _pool.shutdown(wait=False)
+        _pool = None
+    changed()
+
+
+queue_signals.progress.connect(on_progress)
+queue_signals.finished.connect(on_finished)
+
+
+def unfinished() -> list[QueuedBook]:
+    return [x for x in _books.values() if x.state in UNFINISHED_STATES]
+
+
+def cancel_book(number:int) -> None:
+    """
+    Takes a book off the queue if it hasn't started, otherwise stops its build
+    (the partial book is removed).
+    """
+    book = _books.get(number)
+    if book is None or book.state not in UNFINISHED_STATES:
+        return
+    if not book.future.cancel():
+        book.cancel.set()
+        messages.set(f"Cancelling {book.name}...")
+
+
+def clear_finished() -> None:
+    for book in [x for x in _books.values() if x.state not in UNFINISHED_STATES]:
+        del _books[book.number]
+    changed()
+
+
+def set_workers(workers:int) -> None:
+    """
+    Changes the number of books built at the same time. The pool can't be
+    resized, so a new one is started for the next book once the queue is idle.
+    """
+    global _pool
+    if workers == queue_workers.get():
+        return
+    queue_workers.set(workers)
+    if _pool is not None and _pool_workers != workers and not unfinished():
+        _pool.shutdown(wait=False)
+        _pool = None
+    changed()
+
+
+def shutdown() -> None:
+    # Stop the builds when winFuzer's window is closed rather than keep the
+    # process alive until they finish, cancelled builds remove their partial books
+    for book in unfinished():
+        if not book.future.cancel():
+            try:
+                book.cancel.set()
+            except (EOFError, OSError):
+                pass
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+    if _manager is not None:
+        _manager.shutdown()
@@ -1,6 +1,13 @@
 import os
-from winup import ui, component, state
+import threading
+from PySide6.QtCore import QObject, Signal
+from winup import ui, component, state, tasks
 from Fuzer import run_fuzer
+from components.track_preview import get_previews, predicted_order
+from components.build_queue import add_book
+import server
+from tagindex import default_index_path
+from progress import format_eta
 
 selected_mp3_files = state.create("selected_mp3_files")
 selected_jpg_file = state.create("selected_jpg_file")
@@ -8,6 +15,100 @@ current_directory = state.create("current_directory")
 input_files = state.create("input_files")
 cover_file = state.create("cover_file")
 messages = state.create("messages")
+build_running = state.create("build_running", False)
+
+# Set by the Cancel button, checked by run_fuzer as it copies the audio
+cancel_build = threading.Event()
+
+
+class BuildSignals(QObject):
+    """
+    run_fuzer reports progress from the background thread; emitting it through
+    a signal gets it onto the UI thread before it touches the messages state.
+    """
+
+    progress = Signal(str)
+
+
+build_signals = BuildSignals()
+build_signals.progress.connect(lambda msg: messages.set(msg))
+
+
+def progress_message(
+    phase:str,
+    tracks_done:int,
+    track_count:int,
+    bytes_done:int,
+    bytes_total:int,
+    eta:float|None=None,
+) -> str:
+    if not bytes_total:
+        return f"{phase}..."
+    message = (
+        f"{phase}: track {min(tracks_done + 1, track_count)} of {track_count}, "
+        f"{bytes_done / 2**20:.1f} of {bytes_total / 2**20:.1f} MB "
+        f"({100 * bytes_done // bytes_total}%)"
+    )
+    if eta is not None:
+        message += f", {format_eta(eta)} left"
+    return message
+
+
+def build_book(mp3_files:list[str], cover_image:str, destination_dir:str) -> str:
+    """
+    Runs on a background thread so the window stays responsive during the build.
+    The book is handed to the build server if one is running.
+    """
+    last_message = None
+
+    def show(message:str) -> None:
+        nonlocal last_message
+        if message != last_message:
+            last_message = message
+            build_signals.progress.emit(message)
+
+    def on_progress(*args) -> None:
+        show(progress_message(*args))
+
+    def on_event(event) -> None:
+        show(progress_message(*event.as_tuple(), eta=event.eta))
+
+    if server.server_available():
+        job_status = server.build(
+            mp3_files,
+            progress=on_progress,
+            cancel_event=cancel_build,
+            cover=cover_image if os.path.isfile(cover_image) else None,
+            dest_dir=destination_dir,
+            tag_index=default_index_path(),
+        )
+        return job_status["message"]
+
+    cover = open(cover_image, "rb") if os.path.isfile(cover_image) else None
+    try:
+        return run_fuzer(
+            mp3_files,
+            cover=cover,
+            dest_dir=destination_dir,
+            raise_exceptions=False,
+            on_event=on_event,
+            cancel=cancel_build,
+            tag_index=default_index_path(),
+        )
+    finally:
+        if cover:
+            cover.close()
+
+
+def on_build_finished(msg:str|None) -> None:
+    build_running.set(False)
+    if msg:
+        messages.set(msg)
+
+
+def on_build_error(error:tuple) -> None:
+    build_running.set(False)
+    messages.set(f"Build failed: {error[0]}")
 
 
 @component
@@ -15,15 +116,11 @@ def ButtonPanel() -> ui.Column:
     def on_mp3_button_click() -> None:
         files = selected_mp3_files.get()
         cur_dir = current_directory.get()
-        input_files.set(
-            sorted(
-                [
-                    cur_dir + x
-                    for x in files
-                    if os.path.splitext(x)[-1].upper() == ".MP3"
-                ]
-            )
-        )
+        paths = [
+            cur_dir + x for x in files if os.path.splitext(x)[-1].upper() == ".MP3"
+        ]
+        # The order run_fuzer will use, if the tags have been read already
+        input_files.set(predicted_order(paths, get_previews(paths))[0])
 
     def on_clear_mp3_button() -> None:
         input_files.set([])
@@ -41,14 +138,41 @@ def ButtonPanel() -> ui.Column:
         cover_file.set("Select a jpeg for the cover...")
 
     def make_book() -> None:
+        if build_running.get():
+            return
         destination_dir = current_directory.get()
         mp3_files = input_files.get()
         cover_image = cover_file.get()
-        cover_image = open(cover_image, "rb") if os.path.isfile(cover_image) else None
 
-        msg = run_fuzer(mp3_files, cover=cover_image, dest_dir=destination_dir, raise_exceptions=False)
-        if msg:
-            messages.set(msg)
+        cancel_build.clear()
+        build_running.set(True)
+        messages.set("Starting build...")
+        tasks.run(on_finish=on_build_finished, on_error=on_build_error)(build_book)(
+            mp3_files, cover_image, destination_dir
+        )
+
+    def queue_book() -> None:
+        mp3_files = input_files.get()
+        if not mp3_files:
+            return
+        cover_image = cover_file.get()
+        # Named after the album if its tags have been read
+        albums = [x.album for x in get_previews(mp3_files).values() if x and x.album]
+        book = add_book(
+            mp3_files,
+            cover_image if os.path.isfile(cover_image) else None,
+            current_directory.get(),
+            name=albums[0] if albums else None,
+        )
+        messages.set(f"Queued {book.name}")
+        # Ready for the next book
+        input_files.set([])
+        cover_file.set("Select a jpeg for the cover...")
+
+    def cancel_book() -> None:
+        if build_running.get():
+            cancel_build.set()
+            messages.set("Cancelling...")
 
     clear_mp3_button_props = (
         {"class": "add-button-disabled"}
@@ -60,6 +184,21 @@ def ButtonPanel() -> ui.Column:
         if cover_file.get() == "Select a jpeg for the cover..."
         else {"class": "add-button"}
     )
+    make_book_props = (
+        {"class": "add-button-disabled"}
+        if input_files.get() == [] or build_running.get()
+        else {"class": "add-button"}
+    )
+    queue_book_props = (
+        {"class": "add-button-disabled"}
+        if input_files.get() == []
+        else {"class": "add-button"}
+    )
+    cancel_props = (
+        {"class": "add-button"}
+        if build_running.get()
+        else {"class": "add-button-disabled"}
+    )
 
     return ui.Column(
         children=[
@@ -84,7 +223,11 @@ def ButtonPanel() -> ui.Column:
                 props=clear_mp3_button_props,
             ),
             ui.Button(
-                "Make book", on_click=lambda: make_book(), props=clear_mp3_button_props
+                "Make book", on_click=lambda: make_book(), props=make_book_props
+            ),
+            ui.Button(
+                "Add to queue", on_click=lambda: queue_book(), props=queue_book_props
             ),
+            ui.Button("Cancel", on_click=lambda: cancel_book(), props=cancel_props),
         ]
     )
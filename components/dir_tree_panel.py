@@ -1,5 +1,6 @@
 import os
 from winup import ui, state, component
+from components.directory_cache import get_snapshot
 
 current_directory = state.create("current_directory", os.getcwd() + os.path.sep)
 expanded_nodes = state.create("expanded_nodes", set())
@@ -39,13 +40,10 @@ def TreeViewPanel() -> ui.Row:
         if i == len(dir_parts) - 1:
             selected_tree_node.set(new_node)
 
-    leaf_contents = sorted(os.listdir(cur_dir))
-    leaf_contents = [
-        x for x in leaf_contents if x[0] != "."
-    ]  # Get rid of invisible directories
-    for lc in leaf_contents:
-        if os.path.isdir(cur_dir + lc):
-            leaf[lc + "/"] = {}
+    # The subdirectories appear once the background scan of cur_dir is done
+    snapshot = get_snapshot(cur_dir)
+    for lc in snapshot.dirs if snapshot else []:
+        leaf[lc + "/"] = {}
 
     return ui.Row(
         props={"spacing": 5},
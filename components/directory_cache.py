@@ -0,0 +1,184 @@
+"""
+Directory listings shared by TreeViewPanel and FilePanel. A directory is read
+with a single os.scandir on a background thread, which on most platforms tells
+files from directories without a stat per entry, and the snapshot is kept until
+the directory changes. A QFileSystemWatcher (inotify on Linux) drops snapshots
+as soon as their directory changes; where it can't watch, e.g. on many network
+shares, a snapshot is checked against the directory's mtime, also in the
+background, each time it is shown.
+"""
+
+import os
+import time
+from PySide6.QtCore import QFileSystemWatcher
+from winup import state, tasks
+
+messages = state.create("messages")
+# Set to each new or changed snapshot once its scan finishes
+directory_snapshot = state.create("directory_snapshot")
+
+# Number of directories kept, the least recently scanned are dropped first
+MAX_SNAPSHOTS = 256
+
+# Seconds before a directory that couldn't be read is tried again
+RETRY_SECONDS = 5
+
+_snapshots = {}  # key -> DirectorySnapshot
+_fresh = set()  # keys watched without a change since they were scanned
+_pending = set()  # keys being scanned
+_failed = {}  # key -> time.monotonic() of the last failed scan
+_generations = {}  # key -> the number of changes seen to the directory
+_watcher = None
+
+
+class DirectorySnapshot:
+    """
+    The visible contents of a directory at the time it was scanned
+
+    Attributes:
+        path: the directory as it was asked for
+        mtime_ns: the modification time of the directory when it was scanned
+        files: the names of the files, sorted
+        dirs: the names of the subdirectories, sorted
+    """
+
+    __slots__ = ("path", "mtime_ns", "files", "dirs")
+
+    def __init__(self, path:str, mtime_ns:int, files:list[str], dirs:list[str]):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.dirs = dirs
+
+    def __repr__(self):
+        return f"DirectorySnapshot({self.path!r}, {len(self.files)} files, {len(self.dirs)} dirs)"
+    ## DirectorySnapshot ##
+
+
+def directory_key(path:str) -> str:
+    return os.path.normpath(path)
+
+
+def scan_directory(path:str, known_mtime_ns:int|None=None) -> tuple[str, DirectorySnapshot|None]:
+    """
+    Runs on a background thread. Invisible (dot) entries are left out.
+
+    Arguments:
+        path: the directory to scan
+        known_mtime_ns: optional, the mtime of the snapshot already held, the
+        directory isn't read again if it still has it
+
+    Returns: (path, snapshot), snapshot is None if the directory hasn't changed
+    """
+    mtime_ns = os.stat(path).st_mtime_ns
+    if mtime_ns == known_mtime_ns:
+        return path, None
+    files = []
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name[0] == ".":
+                continue
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                continue  # e.g. a broken link or an entry removed meanwhile
+    return path, DirectorySnapshot(path, mtime_ns, sorted(files), sorted(dirs))
+    ## scan_directory ##
+
+
+def watcher() -> QFileSystemWatcher:
+    global _watcher
+    if _watcher is None:
+        _watcher = QFileSystemWatcher()
+        _watcher.directoryChanged.connect(on_directory_changed)
+    return _watcher
+
+
+def on_directory_changed(path:str) -> None:
+    key = directory_key(path)
+    _fresh.discard(key)
+    _generations[key] = _generations.get(key, 0) + 1
+    refresh(path)
+
+
+def on_scanned(result:tuple[str, DirectorySnapshot|None]) -> None:
+    path, snapshot = result
+    key = directory_key(path)
+    _pending.discard(key)
+    _failed.pop(key, None)
+    if snapshot is None:
+        return
+    _snapshots.pop(key, None)
+    _snapshots[key] = snapshot
+    _generations[key] = _generations.get(key, 0) + 1
+    while len(_snapshots) > MAX_SNAPSHOTS:
+        old_key = next(iter(_snapshots))
+        del _snapshots[old_key]
+        _fresh.discard(old_key)
+        watcher().removePath(old_key)
+    if key in watcher().directories() or watcher().addPath(key):
+        _fresh.add(key)
+    directory_snapshot.set(snapshot)
+
+
+def on_scan_error(path:str, error:tuple) -> None:
+    # Show the directory as empty rather than waiting for it forever, it is
+    # scanned again when it is next shown after RETRY_SECONDS
+    key = directory_key(path)
+    _pending.discard(key)
+    _failed[key] = time.monotonic()
+    _snapshots[key] = DirectorySnapshot(path, None, [], [])
+    messages.set(f"Couldn't read {path}: {error[0]}")
+    directory_snapshot.set(_snapshots[key])
+
+
+def refresh(path:str) -> None:
+    """
+    Starts a background scan of path unless one is already running. The
+    directory_snapshot state is set when it finishes, if anything changed.
+    """
+    key = directory_key(path)
+    if key in _pending:
+        return
+    _pending.add(key)
+    known = _snapshots.get(key)
+    tasks.run(
+        on_finish=on_scanned, on_error=lambda error: on_scan_error(path, error)
+    )(scan_directory)(path, known.mtime_ns if known else None)
+
+
+def get_snapshot(path:str) -> DirectorySnapshot|None:
+    """
+    Called on the UI thread when a panel renders, never touches the disk.
+
+    Arguments:
+        path: a directory
+
+    Returns: the latest snapshot of path, or None if it hasn't been scanned
+    yet. Unless the snapshot is known to be current a background scan is
+    started, and directory_snapshot is set when it finds a change.
+    """
+    key = directory_key(path)
+    failed = _failed.get(key)
+    if key not in _fresh and (failed is None or time.monotonic() - failed > RETRY_SECONDS):
+        refresh(path)
+    return _snapshots.get(key)
+    ## get_snapshot ##
+
+
+def generation(path:str) -> int:
+    """
+    Called on the UI thread, never touches the disk.
+
+    Arguments:
+        path: a directory
+
+    Returns: a number that goes up each time a change to path is seen, by the
+    watcher or by a scan that found the directory changed
+    """
+    return _generations.get(directory_key(path), 0)
+    ## generation ##
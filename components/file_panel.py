@@ -1,5 +1,14 @@
 import os
+from PySide6.QtCore import QItemSelection, QItemSelectionModel
 from winup import ui, component, state
+from components.directory_cache import directory_key, get_snapshot
+from components.row_list import row_list, selected_rows
+from components.track_preview import (
+    format_duration,
+    get_previews,
+    total_duration,
+    track_rows,
+)
 
 current_directory = state.create("current_directory")
 selected_mp3_files = state.create("selected_mp3_files", [])
@@ -8,45 +17,115 @@ selected_jpg_file = state.create("selected_jpg_file", "")
 
 @component
 def FilePanel() -> ui.Column:
-    cur_dir = state.get("current_directory")
-    dir_items = [
-        x for x in os.listdir(cur_dir) if x[0] != "."
-    ]  # ingnore invisible files
-    dir_items = sorted(
-        [x for x in dir_items if os.path.isfile(cur_dir + x)]
-    )  # Throw out directories
-    mp3_items = [x for x in dir_items if os.path.splitext(x)[-1].upper() == ".MP3"]
-    jpg_items = [
-        x for x in dir_items if os.path.splitext(x)[-1].upper() in (".JPG", ".JPEG")
-    ]
-
-    def on_mp3_select(items:list[str]) -> None:
-        selected_mp3_files.set(items)
-
-    def on_jpg_select(item:str) -> None:
-        selected_jpg_file.set(item)
+    # Made once by winFuzer and kept up to date from the states, so the lists
+    # keep their selections while the tags are read in the background
+    mp3_list, mp3_model = row_list(250, multi_select=True)
+    jpg_list, jpg_model = row_list(250)
+    mp3_label = ui.Label("mp3 files", props={"class": "h2"})
+    summary_label = ui.Label("")
+    problems_label = ui.Label("")
+    directory_label = ui.Label("", props={"class": "h1"})
+    current_directory.bind_to(
+        directory_label,
+        "text",
+        lambda cur_dir: f"Current Directory:\n{cur_dir.rstrip(os.path.sep).split(os.path.sep)[-1]}",
+    )
+    shown_dir = None
+    mp3_order = []  # the files of the mp3 rows, in the order shown
+    jpg_items = []
+    shown = set()
+    updating = False
+
+    def on_mp3_select() -> None:
+        if updating:
+            return  # the rows and mp3_order don't match yet
+        names = [os.path.basename(mp3_order[x]) for x in selected_rows(mp3_list)]
+        if names != selected_mp3_files.get():
+            selected_mp3_files.set(names)
+
+    def on_jpg_select() -> None:
+        rows = selected_rows(jpg_list)
+        item = jpg_items[rows[0]] if rows else ""
+        if item != selected_jpg_file.get():
+            selected_jpg_file.set(item)
+
+    def select_mp3_files(names:list[str]) -> None:
+        # The rows move as the predicted order changes, so the selection is
+        # put back by name
+        selection = QItemSelection()
+        for row, path in enumerate(mp3_order):
+            if os.path.basename(path) in names:
+                selection.select(mp3_model.index(row), mp3_model.index(row))
+        mp3_list.selectionModel().select(
+            selection, QItemSelectionModel.SelectionFlag.ClearAndSelect
+        )
+
+    def show_files() -> None:
+        nonlocal shown_dir, updating
+        cur_dir = current_directory.get()
+        selected = selected_mp3_files.get() or []
+        if cur_dir != shown_dir:
+            # Another directory, nothing in it is selected yet
+            shown_dir = cur_dir
+            selected = []
+            jpg_list.clearSelection()
+        # Already sorted, without directories or invisible files. None while
+        # the directory is being read in the background
+        snapshot = get_snapshot(cur_dir)
+        dir_items = snapshot.files if snapshot else []
+        mp3_items = [x for x in dir_items if os.path.splitext(x)[-1].upper() == ".MP3"]
+        jpg_items[:] = [
+            x for x in dir_items if os.path.splitext(x)[-1].upper() in (".JPG", ".JPEG")
+        ]
+        jpg_model.set_rows(jpg_items)
+        # Tags are read in the background, the rows fill in as they arrive
+        paths = [cur_dir + x for x in mp3_items]
+        previews = get_previews(paths)
+        order, rows, problems = track_rows(paths, previews)
+        updating = True
+        mp3_order[:] = order
+        mp3_model.set_rows(rows)
+        select_mp3_files(selected)
+        updating = False
+        on_mp3_select()
+        on_jpg_select()
+        mp3_label.setText("mp3 files" if snapshot else "mp3 files (loading...)")
+        summary = f"{len(mp3_items)} files, {format_duration(total_duration(previews.values()))}"
+        if len(previews) < len(mp3_items):
+            summary += " (reading tags...)"
+        summary_label.setText(summary)
+        problems_label.setText("\n".join(problems))
+        shown.clear()
+        shown.update(paths)
+
+    def on_directory_snapshot_change(snapshot) -> None:
+        # A background scan finished, only of interest if it's of the
+        # directory shown
+        if snapshot and directory_key(snapshot.path) == directory_key(
+            current_directory.get()
+        ):
+            show_files()
+
+    def on_track_previews_change(previews) -> None:
+        # Tags were read in the background, only of interest if they're of
+        # the files listed
+        if previews and not shown.isdisjoint(previews[1]):
+            show_files()
+
+    mp3_list.selectionModel().selectionChanged.connect(lambda *args: on_mp3_select())
+    jpg_list.selectionModel().selectionChanged.connect(lambda *args: on_jpg_select())
+    state.subscribe("current_directory", lambda cur_dir: show_files())
+    state.subscribe("directory_snapshot", on_directory_snapshot_change)
+    state.subscribe("track_previews", on_track_previews_change)
 
     return ui.Column(
         children=[
-            ui.Label(
-                f"Current Directory:\n{current_directory.get().rstrip(os.path.sep).split(os.path.sep)[-1]}",
-                props={"class": "h1"},
-            ),
+            directory_label,
             ui.Label("jpeg files", props={"class": "h2"}),
-            ui.List(
-                items=jpg_items,
-                multi_select=False,
-                on_select=lambda item: on_jpg_select(item),
-                width=250,
-                # height=250
-            ),
-            ui.Label("mp3 files", props={"class": "h2"}),
-            ui.List(
-                items=mp3_items,
-                multi_select=True,
-                on_select=lambda items: on_mp3_select(items),
-                width=250,
-                # height=250
-            ),
+            jpg_list,
+            mp3_label,
+            mp3_list,
+            summary_label,
+            problems_label,
         ]
     )
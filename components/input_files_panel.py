@@ -1,23 +1,57 @@
-import os
 from winup import ui, component, state
+from components.row_list import row_list
+from components.track_preview import (
+    format_duration,
+    get_previews,
+    total_duration,
+    track_rows,
+)
 
 input_files = state.create("input_files", [])
 cover_file = state.create("cover_file", "Select a jpeg for the cover...")
 
+
 @component
 def InputFilesPanel():
+    # Made once by winFuzer and kept up to date from the states rather than
+    # made again on every change, a selection of a thousand or more tracks is
+    # slow to rebuild. Only the rows in sight are drawn.
+    cover_label = ui.Label("", props={"class": "QLabel"})
+    cover_file.bind_to(cover_label, "text", lambda cover: cover)
+    track_list, model = row_list(400, 450, multi_select=True)
+    summary_label = ui.Label("")
+    problems_label = ui.Label("")
+    shown = set()
+
+    def show_tracks() -> None:
+        paths = input_files.get()
+        previews = get_previews(paths)
+        _, rows, problems = track_rows(paths, previews)
+        model.set_rows(rows)
+        summary = f"Total: {format_duration(total_duration(previews.values()))}"
+        if len(previews) < len(rows):
+            summary += " (reading tags...)"
+        summary_label.setText(summary)
+        problems_label.setText("\n".join(problems))
+        shown.clear()
+        shown.update(paths)
+
+    def on_track_previews_change(previews) -> None:
+        # Tags were read in the background, only of interest if they're of
+        # the files listed
+        if previews and not shown.isdisjoint(previews[1]):
+            show_tracks()
+
+    state.subscribe("input_files", lambda paths: show_tracks())
+    state.subscribe("track_previews", on_track_previews_change)
 
     return ui.Column(
         children=[
             ui.Label("Cover image", props={"class": "h1"}),
-            ui.Label(cover_file.get(), props={"class": "QLabel"}),
+            cover_label,
             ui.Label("mp3 Files", props={"class": "h1"}),
-            ui.List(
-                items=[x.split(os.path.sep)[-1] for x in input_files.get()],
-                multi_select=True,
-                width=400,
-                height=450
-            ),
-
+            track_list,
+            summary_label,
+            problems_label,
         ]
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,85 @@
+from winup import ui, component, state
+from components.build_queue import (
+    MAX_QUEUE_WORKERS,
+    books,
+    cancel_book,
+    clear_finished,
+    queue_workers,
+    set_workers,
+    unfinished,
+)
+from components.button_panel import progress_message
+
+book_queue = state.create("book_queue")
+selected_queued_book = state.create("selected_queued_book", None)
+
+
+def book_status(book) -> str:
+    if book.state == "building" and book.progress:
+        return progress_message(*book.progress.as_tuple(), eta=book.progress.eta)
+    if book.state in ("done", "failed", "cancelled") and book.message:
+        return f"{book.state}: {book.message.splitlines()[-1]}"
+    return book.state
+
+
+@component
+def QueuePanel() -> ui.Column:
+    queued = books()
+    items = [f"{x.number}. {x.name} - {book_status(x)}" for x in queued]
+    numbers = [x.number for x in queued]
+    selected = selected_queued_book.get()
+    selected_index = numbers.index(selected) if selected in numbers else None
+
+    def on_book_select(item:str|None) -> None:
+        # The rows start with the book's number
+        selected_queued_book.set(int(item.split(".", 1)[0]) if item else None)
+
+    def on_cancel_click() -> None:
+        if selected_queued_book.get() is not None:
+            cancel_book(selected_queued_book.get())
+
+    def on_workers_change(text:str) -> None:
+        set_workers(int(text))
+
+    cancel_props = (
+        {"class": "add-button"}
+        if any(x.number == selected for x in unfinished())
+        else {"class": "add-button-disabled"}
+    )
+    clear_props = (
+        {"class": "add-button"}
+        if len(unfinished()) < len(queued)
+        else {"class": "add-button-disabled"}
+    )
+    workers = ui.ComboBox(
+        items=[str(x) for x in range(1, MAX_QUEUE_WORKERS + 1)],
+        on_change=lambda text: on_workers_change(text),
+    )
+    # set_workers ignores the value it already has
+    workers.setCurrentText(str(queue_workers.get()))
+
+    return ui.Column(
+        children=[
+            ui.Label("Queue", props={"class": "h1"}),
+            ui.List(
+                items=items,
+                selected_index=selected_index,
+                multi_select=False,
+                on_select=lambda item: on_book_select(item),
+                width=400,
+                height=150,
+            ),
+            ui.Row(
+                children=[
+                    ui.Button(
+                        "Cancel book", on_click=lambda: on_cancel_click(), props=cancel_props
+                    ),
+                    ui.Button(
+                        "Clear finished", on_click=lambda: clear_finished(), props=clear_props
+                    ),
+                    ui.Label("Books at once"),
+                    workers,
+                ]
+            ),
+        ]
+    )
@@ -0,0 +1,67 @@
+"""
+The part of winFuzer's build queue that runs in the worker processes. It is
+kept apart from the panels so the workers only import Fuzer, not winup or Qt.
+"""
+
+from Fuzer import AlreadyExistsError, BuildCancelledError, TrackError, run_fuzer
+from tagindex import default_index_path
+
+
+class QueueProgress:
+    """
+    The on_event listener given to run_fuzer in a worker. The events, already
+    rate limited by run_fuzer, are put on the queue shared with winFuzer.
+    """
+
+    def __init__(self, number:int, events):
+        self.number = number
+        self.events = events
+
+    def __call__(self, event) -> None:
+        self.events.put((self.number, event))
+    ## QueueProgress ##
+
+
+def build_queued_book(
+    number:int,
+    mp3_files:list[str],
+    cover_image:str|None,
+    destination_dir:str,
+    events,
+    cancel,
+) -> tuple[int, str, str]:
+    """
+    Runs in a worker process and builds one book of the queue.
+
+    Arguments:
+        number: the book's number in the queue
+        mp3_files: the mp3 files of the book
+        cover_image: the jpeg file of the cover or None
+        destination_dir: the directory the book is written to
+        events: the queue the book's ProgressEvents are put on
+        cancel: an Event shared with winFuzer, the build stops when it is set
+
+    Returns: (number, state, message), where state is "done", "failed" or
+    "cancelled"
+    """
+    cover = open(cover_image, "rb") if cover_image else None
+    try:
+        message = run_fuzer(
+            mp3_files,
+            cover=cover,
+            dest_dir=destination_dir,
+            on_event=QueueProgress(number, events),
+            cancel=cancel,
+            tag_index=default_index_path(),
+        )
+    except BuildCancelledError as e:
+        return number, "cancelled", e.message
+    except (TrackError, AlreadyExistsError) as e:
+        return number, "failed", e.message
+    except Exception as e:
+        return number, "failed", f"{type(e).__name__}: {e}"
+    finally:
+        if cover:
+            cover.close()
+    return number, "done", message
+    ## build_queued_book ##
@@ -0,0 +1,87 @@
+"""
+The lists of files in winFuzer's panels. Each is a QListView over a
+RowListModel that is made once and given new rows as the directory, the
+selection or the tags read change, rather than being made again each time,
+so the view keeps its scroll position and selection.
+"""
+
+import difflib
+from PySide6.QtCore import QAbstractListModel, QModelIndex, Qt
+from PySide6.QtWidgets import QAbstractItemView, QListView
+
+
+class RowListModel(QAbstractListModel):
+    """
+    The rows of a list of files. set_rows only touches the rows that differ
+    from the ones shown, so the view keeps its scroll position and selection
+    and only redraws what changed.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and index.isValid():
+            return self.rows[index.row()]
+        return None
+
+    def set_rows(self, rows:list[str]) -> None:
+        if rows == self.rows:
+            return
+        matcher = difflib.SequenceMatcher(None, self.rows, rows, autojunk=False)
+        # Applied from the end so the positions of the earlier changes still hold
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if tag == "replace" and i2 - i1 == j2 - j1:
+                self.rows[i1:i2] = rows[j1:j2]
+                self.dataChanged.emit(self.index(i1), self.index(i2 - 1))
+                continue
+            if i2 > i1:
+                self.beginRemoveRows(QModelIndex(), i1, i2 - 1)
+                del self.rows[i1:i2]
+                self.endRemoveRows()
+            if j2 > j1:
+                self.beginInsertRows(QModelIndex(), i1, i1 + j2 - j1 - 1)
+                self.rows[i1:i1] = rows[j1:j2]
+                self.endInsertRows()
+        ## set_rows ##
+    ## RowListModel ##
+
+
+def row_list(width:int, height:int|None=None, multi_select:bool=False) -> tuple[QListView, RowListModel]:
+    """
+    Arguments:
+        width: the width of the list in pixels
+        height: the height of the list in pixels, or None to leave it to the
+        layout
+        multi_select: whether more than one row can be selected
+
+    Returns: (view, model), a list showing the model's rows
+    """
+    view = QListView()
+    model = RowListModel(view)
+    view.setModel(model)
+    # Every row is the same height, so the view doesn't measure them all
+    view.setUniformItemSizes(True)
+    view.setSelectionMode(
+        QAbstractItemView.SelectionMode.MultiSelection
+        if multi_select
+        else QAbstractItemView.SelectionMode.SingleSelection
+    )
+    view.setFixedWidth(width)
+    if height is not None:
+        view.setFixedHeight(height)
+    return view, model
+    ## row_list ##
+
+
+def selected_rows(view:QListView) -> list[int]:
+    """
+    Returns: the numbers of the rows selected in view, in order
+    """
+    return sorted(x.row() for x in view.selectionModel().selectedRows())
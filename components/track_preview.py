@@ -0,0 +1,188 @@
+"""
+Tag previews for winFuzer. The disc, track, album and duration of mp3 files are
+read on a background task by a pool of threads as soon as their directory is
+shown, so the panels can show the order the files will be merged in, how long
+the book will be and any problems sort_tracks would complain about before
+"Make book" is clicked. Each file's TrackInfo is cached along with its size and
+mtime, so going back to a directory costs nothing unless the directory cache
+has seen a change to it since, and then only a background stat per file.
+When FUZER_TAG_INDEX names a tag index, files it knows about aren't read at
+all, and the ones that are read are added to it.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
+import threading
+from winup import state, tasks
+from components.directory_cache import generation
+from Fuzer import DEFAULT_JOBS, TrackError, TrackInfo, read_track_info, sort_tracks
+from tagindex import TagIndex, default_index_path
+
+# Set to (a count of the updates, the paths whose previews changed) each time a
+# background read finds changes
+track_previews = state.create("track_previews")
+
+_generation = 0
+_previews = {}  # path -> (size, mtime_ns, TrackInfo or None if unreadable)
+_pending = set()  # paths being read
+_checked = {}  # path -> the generation of its directory when it was last read
+_index = None  # the TagIndex named by FUZER_TAG_INDEX, once opened
+_index_lock = threading.Lock()
+
+
+def tag_index() -> TagIndex|None:
+    """
+    Returns: the shared TagIndex named by FUZER_TAG_INDEX, or None if it isn't
+    set or the index can't be opened
+    """
+    global _index
+    path = default_index_path()
+    if path is None:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            try:
+                _index = TagIndex(path)
+            except (OSError, sqlite3.Error):
+                return None
+        return _index
+
+
+def read_previews(
+    paths:list[str], known:dict[str, tuple[int, int]]
+) -> list[tuple[str, int, int, TrackInfo|None]]:
+    """
+    Runs on a background thread. Only files that are new or whose size or
+    mtime changed are looked at, and of those only the ones the tag index
+    doesn't know about are read.
+
+    Arguments:
+        paths: the mp3 files to preview
+        known: the (size, mtime_ns) of the files already in the cache
+
+    Returns: a (path, size, mtime_ns, TrackInfo) tuple for each file read, the
+    TrackInfo is None if the file couldn't be read
+    """
+    changed = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+            changed.append((path, stat.st_size, stat.st_mtime_ns))
+
+    def read(path:str) -> TrackInfo|None:
+        try:
+            return read_track_info(path)
+        except Exception:
+            return None
+
+    index = tag_index()
+    found, identities = index.lookup([x[0] for x in changed]) if index else ({}, {})
+    missing = [x[0] for x in changed if x[0] not in found]
+    with ThreadPoolExecutor(max_workers=DEFAULT_JOBS) as pool:
+        tracks = dict(zip(missing, pool.map(read, missing)))
+    if index:
+        index.store([x for x in tracks.values() if x is not None], identities)
+    tracks.update((path, TrackInfo(path, *fields)) for path, fields in found.items())
+    return [(path, size, mtime_ns, tracks[path]) for path, size, mtime_ns in changed]
+    ## read_previews ##
+
+
+def on_previews_read(results:list, paths:list[str], generations:dict[str, int]) -> None:
+    global _generation
+    _pending.difference_update(paths)
+    _checked.update(generations)
+    for path, size, mtime_ns, track in results:
+        _previews[path] = (size, mtime_ns, track)
+    if results:
+        _generation += 1
+        track_previews.set((_generation, tuple(x[0] for x in results)))
+
+
+def get_previews(paths:list[str]) -> dict[str, TrackInfo|None]:
+    """
+    Called on the UI thread when a panel renders, never touches the disk. If
+    the directory cache has seen a change to the directory of any of paths
+    since it was last read, a background read of those files is started to
+    catch up, and track_previews is set when it finds changes.
+
+    Arguments:
+        paths: mp3 files
+
+    Returns: the cached TrackInfo of each of paths that has one, None for the
+    ones that couldn't be read
+    """
+    generations = {}
+    for path in paths:
+        if path not in _pending:
+            current = generation(os.path.dirname(path))
+            if _checked.get(path) != current:
+                generations[path] = current
+    wanted = list(generations)
+    if wanted:
+        _pending.update(wanted)
+        known = {x: _previews[x][:2] for x in wanted if x in _previews}
+        tasks.run(
+            on_finish=lambda results: on_previews_read(results, wanted, generations),
+            on_error=lambda error: _pending.difference_update(wanted),
+        )(read_previews)(wanted, known)
+    return {x: _previews[x][2] for x in paths if x in _previews}
+    ## get_previews ##
+
+
+def predicted_order(paths:list[str], previews:dict[str, TrackInfo|None]) -> tuple[list[str], list[str]]:
+    """
+    Arguments:
+        paths: the mp3 files of a book
+        previews: what get_previews returned for them
+
+    Returns: (order, problems) where order is paths in the order run_fuzer will
+    merge them, or sorted by name if the tags don't give one, and problems
+    lists what is wrong with the tags (the TrackError problems of sort_tracks)
+    """
+    if not paths or any(x not in previews for x in paths):
+        return sorted(paths), []
+    unreadable = [x for x in paths if previews[x] is None]
+    if unreadable:
+        return sorted(paths), [f"Can't read {os.path.basename(x)}" for x in unreadable]
+    try:
+        ordered = sort_tracks([previews[x] for x in paths], False)
+    except TrackError as te:
+        return sorted(paths), te.problems
+    return [x.path for x in ordered], []
+    ## predicted_order ##
+
+
+def total_duration(tracks:list[TrackInfo|None]) -> float:
+    return sum(x.duration or 0 for x in tracks if x is not None)
+
+
+def format_duration(seconds:float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def track_rows(paths:list[str], previews:dict[str, TrackInfo|None]) -> tuple[list[str], list[str], list[str]]:
+    """
+    Arguments:
+        paths: the mp3 files of a book
+        previews: what get_previews returned for them
+
+    Returns: (order, rows, problems), paths in the order the book will be built
+    in, as far as the tags read so far can tell, the row of a list showing each
+    of them and what predicted_order found wrong with the tags
+    """
+    order, problems = predicted_order(paths, previews)
+    rows = []
+    for i, path in enumerate(order):
+        track = previews.get(path)
+        duration = format_duration(track.duration) if track and track.duration else "?"
+        rows.append(f"{i + 1}. {os.path.basename(path)} ({duration})")
+    return order, rows, problems
+    ## track_rows ##
@@ -0,0 +1,192 @@
+"""
+Reports the files that change under a set of directory trees, for Fuzer's watch
+mode. On Linux the kernel's inotify is used (through ctypes, so nothing needs
+installing) and new subdirectories are watched as they appear; elsewhere, or if
+inotify can't be set up, the trees are polled.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify event bits, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def walk_files(root:str) -> set[str]:
+    """
+    Returns: the paths of the visible files under root
+    """
+    found = set()
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [x for x in dir_names if x[0] != "."]
+        found.update(os.path.join(dir_path, x) for x in file_names if x[0] != ".")
+    return found
+
+
+class DirectoryWatcher:
+    """
+    Watches directory trees for files that are added, changed, moved or
+    removed.
+
+    Attributes:
+        roots: the directories watched
+        inotify: True if inotify is in use, False if the trees are polled
+    """
+
+    def __init__(self, roots:list[str], poll_interval:float=2.0):
+        self.roots = [os.path.abspath(x) for x in roots]
+        self.poll_interval = poll_interval
+        self._fd = None
+        self._watches = {}  # wd -> directory
+        self._snapshot = {}  # path -> (size, mtime_ns), when polling
+        self._libc = None
+        if sys.platform.startswith("linux"):
+            try:
+                self._start_inotify()
+            except OSError:
+                self.close()
+        self.inotify = self._fd is not None
+        if not self.inotify:
+            self._snapshot = self._poll_snapshot()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _start_inotify(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            self._fd = None
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for root in self.roots:
+            self._watch_tree(root)
+
+    def _watch_tree(self, root:str) -> set[str]:
+        """
+        Adds a watch for root and every directory below it.
+
+        Returns: the files already in the tree, which no event will report
+        """
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names[:] = [x for x in dir_names if x[0] != "."]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"Can't watch {dir_path}: {os.strerror(errno)}")
+            self._watches[wd] = dir_path
+        return walk_files(root)
+
+    def existing(self) -> set[str]:
+        """
+        Returns: every file currently in the watched trees
+        """
+        found = set()
+        for root in self.roots:
+            found |= walk_files(root)
+        return found
+
+    def changes(self, timeout:float) -> set[str]:
+        """
+        Waits up to timeout seconds for something to happen in the watched
+        trees.
+
+        Arguments:
+            timeout: the longest to wait, in seconds
+
+        Returns: the paths of the files that were added, written to, moved or
+        removed, possibly empty. Check with os.stat which of them still exist.
+        """
+        if not self.inotify:
+            return self._poll(timeout)
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            position = 0
+            while position < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size
+                name = data[position : position + length].rstrip(b"\0")
+                position += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, report everything so nothing is missed
+                    changed |= self.existing()
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None or not name or name[:1] == b".":
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            changed |= self._watch_tree(path)
+                        except OSError:
+                            pass  # gone again already
+                    continue
+                changed.add(path)
+        return changed
+
+    def _poll_snapshot(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for path in self.existing():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _poll(self, timeout:float) -> set[str]:
+        time.sleep(min(timeout, self.poll_interval))
+        snapshot = self._poll_snapshot()
+        changed = {
+            x for x in snapshot.keys() | self._snapshot.keys()
+            if snapshot.get(x) != self._snapshot.get(x)
+        }
+        self._snapshot = snapshot
+        return changed
+    ## DirectoryWatcher ##
@@ -0,0 +1,159 @@
+"""
+The sidecar manifest Fuzer writes next to a book built with incremental=True.
+It records every input track's path, size, modification time, a hash of its
+audio and where that audio landed in the book, along with the state of the
+frame counters at the end of each track. When the book is rebuilt the leading
+tracks that haven't changed can be kept as they are in the existing output and
+only the rest is written again.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+# Suffix added to the name of the book to get the name of its manifest
+MANIFEST_SUFFIX = ".fuzer.json"
+
+
+def manifest_path(out_name:str) -> str:
+    return out_name + MANIFEST_SUFFIX
+
+
+def new_hash(data:bytes=b""):
+    """
+    Arguments:
+        data: optional, bytes to start the hash with
+
+    Returns: the hash object used for the audio of a track
+    """
+    return hashlib.blake2b(data, digest_size=16)
+
+
+def audio_hash(path:str, offset:int, length:int, buffer_size:int) -> str:
+    """
+    Hashes the audio of a track the same way it is hashed while it is copied
+
+    Arguments:
+        path: the path of the track
+        offset: where the audio starts
+        length: how many bytes of audio there are
+        buffer_size: the size of the chunks read
+
+    Returns: the hex digest of the audio
+    """
+    digest = new_hash()
+    with open(path, "rb") as in_file:
+        in_file.seek(offset)
+        while length > 0:
+            chunk = in_file.read(min(buffer_size, length))
+            if not chunk:
+                break
+            digest.update(chunk)
+            length -= len(chunk)
+    return digest.hexdigest()
+
+
+def track_entry(track, digest:str, output_start:int, output_end:int) -> dict:
+    """
+    Arguments:
+        track: the TrackInfo of a track that was just written
+        digest: the hex digest of its audio
+        output_start: where its audio starts in the book
+        output_end: where its audio ends in the book
+
+    Returns: the manifest entry for the track
+    """
+    stat = os.stat(track.path)
+    return {
+        "path": os.path.abspath(track.path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "audio_offset": track.audio_offset,
+        "audio_length": track.audio_length,
+        "hash": digest,
+        "output_start": output_start,
+        "output_end": output_end,
+    }
+
+
+def load_manifest(out_name:str) -> dict|None:
+    """
+    Reads the manifest of a book, as long as the book is still exactly what was
+    written when the manifest was saved.
+
+    Arguments:
+        out_name: the path of the book
+
+    Returns: the manifest, or None if there isn't a usable one
+    """
+    try:
+        with open(manifest_path(out_name)) as manifest_file:
+            manifest = json.load(manifest_file)
+        stat = os.stat(out_name)
+    except (OSError, ValueError):
+        return None
+    if (
+        manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("output_size") != stat.st_size
+        or manifest.get("output_mtime_ns") != stat.st_mtime_ns
+    ):
+        return None
+    return manifest
+
+
+def save_manifest(out_name:str, manifest:dict) -> None:
+    """
+    Writes the manifest of a book that has just been finished
+
+    Arguments:
+        out_name: the path of the book
+        manifest: the manifest, its version and the book's size and modification
+        time are filled in here
+    """
+    stat = os.stat(out_name)
+    manifest = dict(
+        manifest,
+        version=MANIFEST_VERSION,
+        output_size=stat.st_size,
+        output_mtime_ns=stat.st_mtime_ns,
+    )
+    temp_name = manifest_path(out_name) + ".tmp"
+    with open(temp_name, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(temp_name, manifest_path(out_name))
+
+
+def unchanged_prefix(manifest:dict, tracks:list, buffer_size:int) -> int:
+    """
+    Counts how many of the leading tracks of the book are the same as when the
+    manifest was written. A track whose size or modification time changed is
+    hashed, so a file that was only touched (or only had its tags edited)
+    still counts as unchanged.
+
+    Arguments:
+        manifest: the manifest of the existing book
+        tracks: the TrackInfo records of the tracks of the new book, in order
+        buffer_size: the size of the chunks read when a track has to be hashed
+
+    Returns: the number of leading tracks whose audio is already in the book
+    """
+    count = 0
+    for track, entry in zip(tracks, manifest["tracks"]):
+        if os.path.abspath(track.path) != entry["path"]:
+            break
+        stat = os.stat(track.path)
+        if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+            if track.audio_length != entry["audio_length"]:
+                break
+            digest = audio_hash(
+                track.path, track.audio_offset, track.audio_length, buffer_size
+            )
+            if digest != entry["hash"]:
+                break
+            # Same audio, remember the new identity so it isn't hashed again
+            entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+            entry["audio_offset"] = track.audio_offset
+        count += 1
+    return count
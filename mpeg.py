@@ -0,0 +1,614 @@
+"""
+MPEG audio frame helpers used by Fuzer: decoding frame headers, spotting the
+Xing/Info/VBRI header frame that encoders put at the start of each track,
+counting the frames of the merged stream while it is copied and building the
+single Xing header (with seek TOC) that describes the finished book.
+"""
+
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:  # stream_formats falls back to looking at the first frame
+    np = None
+
+# Bitrates in kbps indexed by the bitrate bits of the header, keyed on
+# (MPEG1?, layer)
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# Sample rates indexed by the sample rate bits, keyed on the version bits
+SAMPLE_RATES = {
+    0: (11025, 12000, 8000),  # MPEG 2.5
+    2: (22050, 24000, 16000),  # MPEG 2
+    3: (44100, 48000, 32000),  # MPEG 1
+}
+
+# Number of bytes in the Xing header: tag, flags, frames, bytes and the TOC
+XING_SIZE = 4 + 4 + 4 + 4 + 100
+
+# Bytes of audio stream_formats looks at in one go, and the most a frame can
+# be longer than that (a 384 kbps layer II frame at 32 kHz with padding)
+SCAN_CHUNK = 16 * 1024 * 1024
+MAX_FRAME_LENGTH = 1729
+
+# Frames of one format in a row that stream_formats wants to see before it
+# trusts a header found after the chain of frames was broken
+RESYNC_FRAMES = 4
+
+# Frame positions kept by FrameIndex before it halves its resolution. The TOC
+# only has 100 entries so a few thousand samples are plenty.
+MAX_POSITIONS = 4096
+
+
+def _build_frame_table() -> list[tuple[int, int, int, int]|None]:
+    """
+    Precomputes the frame parameters for every possible value of the second
+    and third bytes of a frame header, so that decoding a header while copying
+    is a single list lookup.
+
+    Returns: a list indexed by (byte1 << 8) | byte2 of
+    (frame length, samples per frame, sample rate, bitrate) tuples, or None
+    where the bytes aren't a valid (non free-format) header
+    """
+    table = [None] * 65536
+    for byte1 in range(0xE0, 0x100):
+        version = (byte1 >> 3) & 3
+        layer = 4 - ((byte1 >> 1) & 3)
+        if version == 1 or layer == 4:
+            continue
+        mpeg1 = version == 3
+        for byte2 in range(256):
+            bitrate_index = byte2 >> 4
+            rate_index = (byte2 >> 2) & 3
+            if bitrate_index in (0, 15) or rate_index == 3:
+                continue
+            bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+            sample_rate = SAMPLE_RATES[version][rate_index]
+            padding = (byte2 >> 1) & 1
+            if layer == 1:
+                samples = 384
+                length = (12 * bitrate // sample_rate + padding) * 4
+            else:
+                samples = 1152 if (layer == 2 or mpeg1) else 576
+                length = samples // 8 * bitrate // sample_rate + padding
+            table[(byte1 << 8) | byte2] = (length, samples, sample_rate, bitrate)
+    return table
+    ## _build_frame_table ##
+
+
+FRAME_TABLE = _build_frame_table()
+
+if np is not None:
+    # FRAME_TABLE as arrays, 0 where the bytes aren't a valid header
+    FRAME_LENGTHS = np.array([x[0] if x else 0 for x in FRAME_TABLE], dtype=np.int64)
+    FRAME_RATES = np.array([x[2] if x else 0 for x in FRAME_TABLE], dtype=np.int64)
+
+
+def frame_format(header:bytes) -> tuple[int, int, int]|None:
+    """
+    Arguments:
+        header: the first four bytes of a frame
+
+    Returns: (layer, sample rate, channels) of the frame, or None if header
+    isn't the start of a valid frame
+    """
+    entry = parse_frame_header(header)
+    if entry is None:
+        return None
+    return 4 - ((header[1] >> 1) & 3), entry[2], 1 if header[3] >> 6 == 3 else 2
+    ## frame_format ##
+
+
+def stream_formats(path:str, offset:int, length:int) -> dict[tuple[int, int, int], int]:
+    """
+    Finds every frame in the audio of a track and counts how many there are of
+    each format. The frames are followed from the first one, each starting
+    where the one before it ends, so sync patterns inside the audio data are
+    never mistaken for headers. Only if the chain breaks, e.g. at a stretch of
+    junk, is the audio searched for the next run of RESYNC_FRAMES frames. With
+    NumPy the candidate headers are found and decoded in bulk and the chain is
+    followed through them. Without NumPy only the first frame is looked at.
+
+    Arguments:
+        path: the path of the track
+        offset: where its audio starts
+        length: how many bytes of audio it has
+
+    Returns: a {(layer, sample rate, channels): frame count} dict
+    """
+    if np is None or length <= 0:
+        with open(path, "rb") as in_file:
+            in_file.seek(offset)
+            format = frame_format(in_file.read(4))
+        return {format: 1} if format else {}
+
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(length,))
+    counts = {}  # format id -> frames
+    expected = 0  # where the next frame of the chain starts
+    synced = True
+    for start in range(0, length, SCAN_CHUNK):
+        # Look past the chunk so the chains leaving it can be followed
+        window = np.asarray(
+            data[start : start + SCAN_CHUNK + RESYNC_FRAMES * MAX_FRAME_LENGTH + 4]
+        )
+        syncs = np.flatnonzero((window[:-3] == 0xFF) & (window[1:-2] >= 0xE0))
+        key = (window[syncs + 1].astype(np.int64) << 8) | window[syncs + 2]
+        frame_length = FRAME_LENGTHS[key]
+        valid = frame_length > 0
+        syncs, key, frame_length = syncs[valid], key[valid], frame_length[valid]
+        # The version, layer, sample rate and channels of each header as one number
+        format_id = key & 0x1E0C | (window[syncs + 3] >> 6 == 3)
+        following = syncs + frame_length
+        at = np.searchsorted(syncs, following)
+        found = at < len(syncs)
+        found[found] = syncs[at[found]] == following[found]
+        positions = syncs.tolist()
+        ends = following.tolist()
+        ids = format_id.tolist()
+        # The header a frame's length leads to, -1 if there isn't one there
+        chain = np.where(found, at, -1).tolist()
+        end = min(SCAN_CHUNK, length - start)
+
+        def resync(position:int) -> int:
+            # The first header at or after position that starts RESYNC_FRAMES
+            # chained frames of one format, or that the audio ends after
+            for i in range(bisect_left(positions, position), len(positions)):
+                if positions[i] >= end:
+                    break
+                j = i
+                for _ in range(RESYNC_FRAMES - 1):
+                    if start + ends[j] == length:
+                        return i
+                    j = chain[j]
+                    if j < 0 or ids[j] != ids[i]:
+                        break
+                else:
+                    return i
+            return -1
+
+        position = expected - start
+        while position < end:
+            if synced:
+                i = bisect_left(positions, position)
+                if i == len(positions) or positions[i] != position:
+                    synced = False
+                    continue
+            else:
+                i = resync(position)
+                if i < 0:
+                    position = end
+                    break
+                synced = True
+            while i >= 0 and positions[i] < end:
+                counts[ids[i]] = counts.get(ids[i], 0) + 1
+                position = ends[i]
+                i = chain[i]
+            if i >= 0:
+                position = positions[i]  # the chain goes on in the next chunk
+            elif position < end:
+                synced = False
+        expected = start + position
+
+    formats = {}
+    for format_id, count in counts.items():
+        version = (format_id >> 11) & 3
+        format = (
+            4 - ((format_id >> 9) & 3),
+            SAMPLE_RATES[version][(format_id >> 2) & 3],
+            1 if format_id & 1 else 2,
+        )
+        formats[format] = formats.get(format, 0) + count
+    return formats
+    ## stream_formats ##
+
+
+def parse_frame_header(header:bytes) -> tuple[int, int, int, int]|None:
+    """
+    Arguments:
+        header: at least the first four bytes of an MPEG audio frame
+
+    Returns: (frame length, samples per frame, sample rate, bitrate) or None if
+    header isn't the start of a valid frame
+    """
+    if len(header) < 4 or header[0] != 0xFF:
+        return None
+    return FRAME_TABLE[(header[1] << 8) | header[2]]
+    ## parse_frame_header ##
+
+
+def takes_xing_frame(header:bytes) -> bool:
+    """
+    Arguments:
+        header: the first four bytes of a stream's first audio frame
+
+    Returns: True if a Xing header can be put in front of the stream. They're
+    only defined for layer III, layers I and II have no side information for
+    one to follow
+    """
+    return (header[1] >> 1) & 3 == 1
+    ## takes_xing_frame ##
+
+
+def side_info_size(header:bytes) -> int:
+    """
+    Arguments:
+        header: the first four bytes of a layer III frame
+
+    Returns: the size of the side information that follows the frame header,
+    which is where a Xing/Info header lives
+    """
+    mpeg1 = (header[1] >> 3) & 3 == 3
+    mono = header[3] >> 6 == 3
+    if mpeg1:
+        return 17 if mono else 32
+    return 9 if mono else 17
+    ## side_info_size ##
+
+
+def is_vbr_header_frame(frame:bytes) -> bool:
+    """
+    Checks whether a frame is an encoder's Xing, Info or VBRI header frame
+    rather than audio.
+
+    Arguments:
+        frame: the start of the frame, at least 40 bytes of it
+
+    Returns: True if the frame carries a Xing, Info or VBRI header
+    """
+    xing_at = 4 + side_info_size(frame)
+    return frame[xing_at : xing_at + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+    ## is_vbr_header_frame ##
+
+
+def vbr_header_frames(frame:bytes) -> int|None:
+    """
+    Arguments:
+        frame: the start of a Xing, Info or VBRI header frame, at least 56 bytes
+        of it
+
+    Returns: the number of frames of the track according to the header, or
+    None if the header doesn't say
+    """
+    xing_at = 4 + side_info_size(frame)
+    if frame[xing_at : xing_at + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(frame[xing_at + 4 : xing_at + 8], "big")
+        if flags & 0x01 and len(frame) >= xing_at + 12:
+            return int.from_bytes(frame[xing_at + 8 : xing_at + 12], "big")
+        return None
+    if frame[36:40] == b"VBRI" and len(frame) >= 54:
+        return int.from_bytes(frame[50:54], "big")
+    return None
+    ## vbr_header_frames ##
+
+
+def estimate_duration(header:bytes, audio_length:int, frames:int|None=None) -> float|None:
+    """
+    Works out the playing time of a track from its headers alone.
+
+    Arguments:
+        header: the 4-byte header of the first audio frame of the track
+        audio_length: the number of bytes of audio in the track
+        frames: optional, the frame count from the track's VBR header frame,
+        without it the track is assumed to be constant bitrate
+
+    Returns: the playing time in seconds, or None if header isn't a frame header
+    """
+    entry = parse_frame_header(header)
+    if entry is None:
+        return None
+    length, samples, sample_rate, bitrate = entry
+    if frames:
+        return frames * samples / sample_rate
+    return audio_length * 8 / bitrate
+    ## estimate_duration ##
+
+
+class FrameIndex:
+    """
+    Counts the frames, bytes and playing time of an MPEG stream as it is fed
+    through in arbitrary sized chunks, and keeps a bounded sample of frame
+    positions so that a seek TOC can be built at the end without a second
+    pass over the audio.
+
+    Attributes:
+        frames: the number of frames seen
+        fed: the number of bytes seen, frames or not
+        duration: the playing time of the frames seen in seconds
+        vbr: True if the frames don't all have the same bitrate
+    """
+
+    __slots__ = (
+        "frames",
+        "fed",
+        "duration",
+        "vbr",
+        "bitrate",
+        "positions",
+        "stride",
+        "skip",
+        "carry",
+    )
+
+    def __init__(self):
+        self.frames = 0
+        self.fed = 0
+        self.duration = 0.0
+        self.vbr = False
+        self.bitrate = None
+        self.positions = array("Q")
+        self.stride = 1
+        self.skip = 0
+        self.carry = b""
+
+    def checkpoint(self) -> dict:
+        """
+        Returns: the counters as they stand, to be saved and later handed to
+        resume. Call it between tracks.
+        """
+        return {
+            "frames": self.frames,
+            "fed": self.fed,
+            "duration": self.duration,
+            "vbr": self.vbr,
+            "bitrate": self.bitrate,
+        }
+
+    @classmethod
+    def resume(cls, checkpoint:dict, positions:list[int], stride:int) -> "FrameIndex":
+        """
+        Recreates the FrameIndex of a stream as it was at a checkpoint, so more
+        tracks can be counted onto the end of an existing stream without
+        reading it again.
+
+        Arguments:
+            checkpoint: what checkpoint returned at that point
+            positions: the positions of the FrameIndex of the finished stream,
+            only the ones before the checkpoint are kept
+            stride: the stride of the FrameIndex of the finished stream
+
+        Returns: a FrameIndex ready to be fed the next track
+        """
+        index = cls()
+        index.frames = checkpoint["frames"]
+        index.fed = checkpoint["fed"]
+        index.duration = checkpoint["duration"]
+        index.vbr = checkpoint["vbr"]
+        index.bitrate = checkpoint["bitrate"]
+        index.stride = stride
+        index.positions = array("Q", positions[: -(-index.frames // stride)])
+        return index
+
+    def new_track(self) -> None:
+        """
+        Forgets any partial frame left at the end of the previous track, the
+        next byte fed is expected to be the start of a frame.
+        """
+        self.skip = 0
+        self.carry = b""
+
+    def feed(self, chunk:memoryview|bytes) -> None:
+        """
+        Arguments:
+            chunk: the next bytes of the stream
+        """
+        size = len(chunk)
+        if self.carry:
+            # A frame header was split across the previous chunk and this one
+            carried = len(self.carry)
+            window = self.carry + bytes(chunk[:3])
+            position = self._scan(window, 0, carried, self.fed - carried)
+            if position < carried:
+                self.carry = window[position:]
+                self.fed += size
+                return
+            self.carry = b""
+            position -= carried
+        else:
+            position = self.skip
+
+        if position < size:
+            position = self._scan(chunk, position, size, self.fed)
+        if position < size:
+            self.carry = bytes(chunk[position:])
+            self.skip = 0
+        else:
+            self.skip = position - size
+        self.fed += size
+
+    def _scan(self, data, position:int, limit:int, base:int) -> int:
+        """
+        Records every frame whose header starts in data[position:limit].
+
+        Arguments:
+            data: the bytes being scanned
+            position: where the next frame header is expected
+            limit: stop at frame headers starting at or after this position
+            base: the stream offset of data[0]
+
+        Returns: the position in data of the next frame header, which may be
+        beyond the end of data, or the position of a header that was cut off
+        by the end of data
+        """
+        table = FRAME_TABLE
+        end = len(data) - 3
+        while position < limit:
+            if position >= end:
+                return position
+            entry = None
+            if data[position] == 0xFF:
+                entry = table[(data[position + 1] << 8) | data[position + 2]]
+            if entry is None:
+                # Lost sync, e.g. a trailing ID3v1 tag. Hunt for the next frame
+                position += 1
+                continue
+
+            length, samples, sample_rate, bitrate = entry
+            if self.frames % self.stride == 0:
+                self.positions.append(base + position)
+                if len(self.positions) >= MAX_POSITIONS:
+                    self.positions = self.positions[::2]
+                    self.stride *= 2
+            self.frames += 1
+            self.duration += samples / sample_rate
+            if self.bitrate is None:
+                self.bitrate = bitrate
+            elif bitrate != self.bitrate:
+                self.vbr = True
+            position += length
+        return position
+
+    def extend(self, log:"FrameLog") -> None:
+        """
+        Counts a track that was scanned on its own by a FrameLog onto the end
+        of the stream, exactly as if its bytes had been fed here after a
+        new_track.
+
+        Arguments:
+            log: the FrameLog fed the whole track
+        """
+        base = self.fed
+        offset = 0
+        entries = log.entries
+        gaps = log.gaps
+        for number, kind in enumerate(log.kinds):
+            offset += gaps.get(number, 0)
+            length, samples, sample_rate, bitrate = entries[kind]
+            if self.frames % self.stride == 0:
+                self.positions.append(base + offset)
+                if len(self.positions) >= MAX_POSITIONS:
+                    self.positions = self.positions[::2]
+                    self.stride *= 2
+            self.frames += 1
+            self.duration += samples / sample_rate
+            if self.bitrate is None:
+                self.bitrate = bitrate
+            elif bitrate != self.bitrate:
+                self.vbr = True
+            offset += length
+        self.fed += log.fed
+        self.skip = 0
+        self.carry = b""
+
+    def position_of_frame(self, frame:int) -> int:
+        """
+        Arguments:
+            frame: a frame number
+
+        Returns: the stream offset of the nearest sampled frame at or before frame
+        """
+        if not self.positions:
+            return 0
+        return self.positions[min(frame // self.stride, len(self.positions) - 1)]
+    ## FrameIndex ##
+
+
+class FrameLog(FrameIndex):
+    """
+    Scans one track of a stream whose tracks are copied at the same time, so
+    the frame counts of the whole stream aren't known yet. To be counted onto
+    the stream with FrameIndex.extend once the tracks before it have been, it
+    keeps which of the track's few distinct FRAME_TABLE entries each frame
+    has, two bytes a frame, and the bytes skipped wherever sync was lost.
+    That places every frame exactly without keeping its offset.
+
+    Attributes:
+        entries: the distinct FRAME_TABLE entries of the track's frames
+        kinds: the place in entries of each frame's entry
+        gaps: {frame number: bytes skipped before it} for the frames that
+        don't start where the one before them ends
+    """
+
+    __slots__ = ("entries", "kinds", "gaps", "_kind_of", "_next")
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+        self.kinds = array("H")
+        self.gaps = {}
+        self._kind_of = {}
+        self._next = 0
+
+    def _scan(self, data, position:int, limit:int, base:int) -> int:
+        table = FRAME_TABLE
+        end = len(data) - 3
+        while position < limit:
+            if position >= end:
+                return position
+            entry = None
+            if data[position] == 0xFF:
+                entry = table[(data[position + 1] << 8) | data[position + 2]]
+            if entry is None:
+                position += 1
+                continue
+            offset = base + position
+            if offset != self._next:
+                self.gaps[len(self.kinds)] = offset - self._next
+            kind = self._kind_of.get(entry)
+            if kind is None:
+                kind = self._kind_of[entry] = len(self.entries)
+                self.entries.append(entry)
+            self.kinds.append(kind)
+            self._next = offset + entry[0]
+            position += entry[0]
+        return position
+    ## FrameLog ##
+
+
+def xing_frame(first_header:bytes, index:FrameIndex|None=None) -> bytes:
+    """
+    Builds a silent frame carrying a Xing (VBR) or Info (CBR) header with the
+    frame count, byte count and a 100 entry seek TOC for the stream described
+    by index. The frame always has the same size for a given first_header so
+    a placeholder can be written before the audio and overwritten afterwards.
+
+    Arguments:
+        first_header: the first four bytes of the stream's first audio frame
+        index: optional, the FrameIndex of the stream, an empty header is built
+        if it isn't given
+
+    Returns: the bytes of the frame to put in front of the audio
+
+    Raises: ValueError if first_header isn't a layer III header, see
+    takes_xing_frame
+    """
+    if not takes_xing_frame(first_header):
+        raise ValueError("Xing headers are only defined for layer III streams")
+    side_info = side_info_size(first_header)
+    needed = 4 + side_info + XING_SIZE
+    # Keep the version, layer, sample rate and channels of the stream, turn
+    # off the CRC and pick the smallest bitrate with room for the Xing data
+    byte1 = first_header[1] | 0x01
+    byte2_base = first_header[2] & 0x0C
+    for bitrate_index in range(1, 15):
+        byte2 = (bitrate_index << 4) | byte2_base
+        entry = FRAME_TABLE[(byte1 << 8) | byte2]
+        if entry and entry[0] >= needed:
+            break
+    length = entry[0]
+
+    frame = bytearray(length)
+    frame[0:4] = bytes((0xFF, byte1, byte2, first_header[3]))
+    xing_at = 4 + side_info
+    if index is None:
+        index = FrameIndex()
+    frame[xing_at : xing_at + 4] = b"Xing" if index.vbr else b"Info"
+    frame[xing_at + 4 : xing_at + 8] = (0x07).to_bytes(4, "big")  # frames, bytes, toc
+    total = min(length + index.fed, 0xFFFFFFFF)
+    frame[xing_at + 8 : xing_at + 12] = index.frames.to_bytes(4, "big")
+    frame[xing_at + 12 : xing_at + 16] = total.to_bytes(4, "big")
+    toc = bytearray(100)
+    if index.frames:
+        for i in range(100):
+            position = length + index.position_of_frame(index.frames * i // 100)
+            toc[i] = min(255, position * 256 // total)
+    frame[xing_at + 16 : xing_at + 116] = toc
+    return bytes(frame)
+    ## xing_frame ##
@@ -0,0 +1,201 @@
+"""
+Lightweight per-phase and per-track profiling for Fuzer. Each measurement is a
+handful of cheap counter reads taken at the start and end of a phase, so it is
+fine to leave on for real builds:
+
+- wall time from time.perf_counter
+- bytes read and written from /proc/self/io, which also counts the copies done
+  in the kernel by os.copy_file_range and os.sendfile (Linux only)
+- files opened, counted by an audit hook on the "open" event
+- the peak resident memory of the process so far, from getrusage
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_open_count = 0
+_hook_lock = threading.Lock()
+_hook_installed = False
+# (pid, fd) of the open /proc/self/io, kept open so that reading the counters
+# doesn't count as opening a file. The pid notices a fork into a new process.
+_io_file = (None, None)
+
+
+def _audit_hook(event:str, args:tuple) -> None:
+    global _open_count
+    if event == "open":
+        _open_count += 1
+
+
+def _install_audit_hook() -> None:
+    """
+    Audit hooks can't be removed, so the hook is only installed the first time
+    a Profiler is enabled and it does nothing more than bump a counter.
+    """
+    global _hook_installed
+    with _hook_lock:
+        if not _hook_installed:
+            sys.addaudithook(_audit_hook)
+            _hook_installed = True
+
+
+def io_counters() -> tuple[int, int]|None:
+    """
+    Returns: (bytes read, bytes written) by the process so far, or None where
+    /proc/self/io isn't available
+    """
+    global _io_file
+    try:
+        pid, fd = _io_file
+        if pid != os.getpid():
+            fd = os.open("/proc/self/io", os.O_RDONLY)
+            _io_file = (os.getpid(), fd)
+        contents = os.pread(fd, 4096, 0)
+    except OSError:
+        return None
+    fields = dict(line.split(b":") for line in contents.splitlines())
+    return int(fields[b"rchar"]), int(fields[b"wchar"])
+
+
+def peak_memory() -> int|None:
+    """
+    Returns: the peak resident set size of the process in bytes, or None where
+    it can't be found
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    """
+    Collects timings and I/O counts for the phases of a build and for each
+    track copied. A disabled Profiler records nothing, so callers can use one
+    unconditionally.
+
+    Attributes:
+        enabled: whether anything is recorded
+        phases: a list of dicts, one per phase, in the order they ran
+        tracks: a list of dicts, one per track copied
+    """
+
+    def __init__(self, enabled:bool=True):
+        self.enabled = enabled
+        self.phases = []
+        self.tracks = []
+        if enabled:
+            _install_audit_hook()
+
+    def _snapshot(self) -> tuple:
+        return time.perf_counter(), io_counters(), _open_count
+
+    def _measure(self, name:str, start:tuple, counters:bool=True) -> dict:
+        end = self._snapshot()
+        record = {
+            "name": name,
+            "seconds": end[0] - start[0],
+            "bytes_read": None,
+            "bytes_written": None,
+            "opens": end[2] - start[2] if counters else None,
+            "peak_memory": peak_memory(),
+        }
+        if counters and start[1] is not None and end[1] is not None:
+            record["bytes_read"] = end[1][0] - start[1][0]
+            record["bytes_written"] = end[1][1] - start[1][1]
+        return record
+
+    @contextmanager
+    def phase(self, name:str):
+        """
+        Measures the body of a with statement as one phase of the build
+
+        Arguments:
+            name: the name of the phase, usually the function doing the work
+        """
+        if not self.enabled:
+            yield
+            return
+        start = self._snapshot()
+        try:
+            yield
+        finally:
+            self.phases.append(self._measure(name, start))
+
+    @contextmanager
+    def track(self, path:str, concurrent:bool=False):
+        """
+        Measures the body of a with statement as the copy of one track
+
+        Arguments:
+            path: the path of the track
+            concurrent: optional, set when other tracks are copied at the same
+            time. The I/O and open counters belong to the whole process, so
+            they would count the other tracks too and only the time is kept.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = self._snapshot()
+        try:
+            yield
+        finally:
+            self.tracks.append(self._measure(path, start, not concurrent))
+
+    def to_dict(self) -> dict:
+        total = sum(x["seconds"] for x in self.phases)
+        return {"total_seconds": total, "phases": self.phases, "tracks": self.tracks}
+
+    def write_json(self, path:str) -> None:
+        with open(path, "w") as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+    def report(self, show_tracks:bool=True) -> str:
+        """
+        Returns: the measurements as a table for printing
+        """
+
+        def size(value:int|None) -> str:
+            return "-" if value is None else f"{value / 2**20:.1f}"
+
+        def count(value:int|None) -> str:
+            return "-" if value is None else str(value)
+
+        def rows(records:list[dict]) -> list[str]:
+            lines = []
+            for x in records:
+                seconds = x["seconds"]
+                rate = "-"
+                if x["bytes_written"] and seconds > 0:
+                    rate = f"{x['bytes_written'] / 2**20 / seconds:.1f}"
+                lines.append(
+                    f"{x['name'][-32:]:<32} {seconds:>9.3f} {size(x['bytes_read']):>9} "
+                    f"{size(x['bytes_written']):>9} {rate:>8} {count(x['opens']):>6} "
+                    f"{size(x['peak_memory']):>9}"
+                )
+            return lines
+
+        header = (
+            f"{'':<32} {'seconds':>9} {'read MB':>9} {'write MB':>9} "
+            f"{'MB/s':>8} {'opens':>6} {'peak MB':>9}"
+        )
+        lines = ["Phases", header] + rows(self.phases)
+        lines.append(f"{'total':<32} {self.to_dict()['total_seconds']:>9.3f}")
+        if show_tracks and self.tracks:
+            lines += ["", "Tracks", header] + rows(self.tracks)
+            if any(x["opens"] is None for x in self.tracks):
+                lines.append(
+                    "Tracks copied in parallel only have their I/O counted in the phases"
+                )
+        return "\n".join(lines)
+    ## Profiler ##
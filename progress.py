@@ -0,0 +1,215 @@
+"""
+Progress events for Fuzer builds. run_fuzer and stream_book report each phase
+as it starts and finishes and, while the audio is copied, which track is being
+written, the bytes copied so far and an estimate of the time left. The copy
+reports after every chunk, so the events are rate limited: a phase starting
+or finishing always gets through, but the reports in between are dropped if
+they come less than PROGRESS_INTERVAL seconds after the last one sent. That
+keeps a GUI or a log from being flooded however fast the disk is. The report
+that completes a phase's tracks or bytes is always sent.
+
+The messages Fuzer prints as it goes ("Building tags..." and so on) are just
+one listener, print_progress.
+"""
+
+import threading
+import time
+
+# Least number of seconds between the progress events sent while a phase goes on
+PROGRESS_INTERVAL = 0.25
+
+# The kinds of event
+STARTED = "started"
+PROGRESS = "progress"
+FINISHED = "finished"
+DONE = "done"
+
+# The phase reported when the build is complete
+DONE_PHASE = "Done"
+
+
+class ProgressEvent:
+    """
+    Attributes:
+        kind: STARTED, PROGRESS or FINISHED for a phase, DONE once the build is
+        complete
+        phase: the name of the phase, e.g. "Writing tracks"
+        tracks_done: the number of tracks the phase has finished with
+        track_count: the number of tracks in the book
+        bytes_done: the bytes of audio copied so far in the phase
+        bytes_total: the bytes of audio the phase copies, 0 if it copies none
+        elapsed: seconds since the phase started
+        eta: estimated seconds until the phase finishes, or None if it can't
+        be told
+    """
+
+    __slots__ = (
+        "kind",
+        "phase",
+        "tracks_done",
+        "track_count",
+        "bytes_done",
+        "bytes_total",
+        "elapsed",
+        "eta",
+    )
+
+    def __init__(
+        self,
+        kind:str,
+        phase:str,
+        tracks_done:int=0,
+        track_count:int=0,
+        bytes_done:int=0,
+        bytes_total:int=0,
+        elapsed:float=0.0,
+        eta:float|None=None,
+    ):
+        self.kind = kind
+        self.phase = phase
+        self.tracks_done = tracks_done
+        self.track_count = track_count
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        self.elapsed = elapsed
+        self.eta = eta
+
+    def as_tuple(self) -> tuple[str, int, int, int, int]:
+        """
+        Returns: (phase, tracks done, track count, bytes done, bytes total), the
+        arguments of a progress callback
+        """
+        return self.phase, self.tracks_done, self.track_count, self.bytes_done, self.bytes_total
+
+    def __repr__(self):
+        return f"ProgressEvent({self.kind!r}, {self.phase!r}, {self.tracks_done}/{self.track_count}, {self.bytes_done}/{self.bytes_total})"
+    ## ProgressEvent ##
+
+
+class ProgressReporter:
+    """
+    Turns the progress(phase, tracks done, track count, bytes done, bytes total)
+    calls made during a build into rate limited ProgressEvents for its
+    listeners. A call naming a new phase finishes the one before it. It can be
+    called from several threads.
+
+    Attributes:
+        listeners: the callables each event is passed to
+        interval: least number of seconds between PROGRESS events
+    """
+
+    def __init__(self, *listeners, interval:float=PROGRESS_INTERVAL):
+        self.listeners = [x for x in listeners if x is not None]
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._phase = None
+        self._started = 0.0
+        self._sent = 0.0
+        self._last = None
+
+    def __call__(
+        self,
+        phase:str,
+        tracks_done:int=0,
+        track_count:int=0,
+        bytes_done:int=0,
+        bytes_total:int=0,
+    ) -> None:
+        report = (phase, tracks_done, track_count, bytes_done, bytes_total)
+        with self._lock:
+            now = time.monotonic()
+            if phase != self._phase:
+                self._finish(now)
+                self._phase = phase
+                self._started = now
+                kind = DONE if phase == DONE_PHASE else STARTED
+            elif report == self._last.as_tuple():
+                return
+            elif (bytes_total and bytes_done >= bytes_total) or (
+                track_count and tracks_done >= track_count
+            ):
+                kind = PROGRESS  # the end of the phase's work always gets through
+            elif now - self._sent < self.interval:
+                return
+            else:
+                kind = PROGRESS
+            elapsed = now - self._started
+            eta = None
+            if bytes_total and bytes_done:
+                eta = elapsed * (bytes_total - bytes_done) / bytes_done
+            self._last = ProgressEvent(
+                kind, phase, tracks_done, track_count, bytes_done, bytes_total, elapsed, eta
+            )
+            self._sent = now
+            self._send(self._last)
+        ## __call__ ##
+
+    def finish(self) -> None:
+        """
+        Finishes the current phase, e.g. when the build stops part way through
+        """
+        with self._lock:
+            self._finish(time.monotonic())
+            self._phase = None
+
+    def _finish(self, now:float) -> None:
+        if self._phase is None or self._phase == DONE_PHASE:
+            return
+        last = self._last
+        self._send(
+            ProgressEvent(
+                FINISHED,
+                self._phase,
+                last.tracks_done,
+                last.track_count,
+                last.bytes_done,
+                last.bytes_total,
+                now - self._started,
+                0.0,
+            )
+        )
+
+    def _send(self, event:ProgressEvent) -> None:
+        for listener in self.listeners:
+            listener(event)
+    ## ProgressReporter ##
+
+
+def callback_listener(progress):
+    """
+    Arguments:
+        progress: a callback taking (phase, tracks done, track count, bytes
+        done, bytes total), or None
+
+    Returns: a listener that passes it every event except FINISHED, or None
+    """
+    if progress is None:
+        return None
+
+    def listener(event:ProgressEvent) -> None:
+        if event.kind != FINISHED:
+            progress(*event.as_tuple())
+
+    return listener
+    ## callback_listener ##
+
+
+def print_progress(event:ProgressEvent) -> None:
+    """
+    The listener that prints the name of each phase as it starts
+    """
+    if event.kind == STARTED:
+        print(f"{event.phase}...")
+
+
+def format_eta(seconds:float|None) -> str:
+    """
+    Returns: seconds as e.g. "1:05" or "1:02:05", "?" if it is None
+    """
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
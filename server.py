@@ -0,0 +1,528 @@
+#! /usr/bin/env python
+
+"""
+A build server that keeps one warm Fuzer process running, so scripts and
+winFuzer don't pay for starting Python and importing click and mutagen for
+every book. The server listens on a Unix domain socket and builds the books
+it is sent on a bounded pool of threads.
+
+The protocol is one JSON object per line each way. Every request has an "op":
+
+- {"op": "ping"}
+- {"op": "submit", "args": {...}} where args are run_fuzer keyword arguments
+  with "source_files" (and "cover", if any) given as absolute paths. The
+  reply carries the "job" number
+- {"op": "status", "job": N, "wait": seconds} waits up to wait seconds (at
+  most MAX_WAIT) for job N to finish and returns its "state" (queued,
+  running, done, failed or cancelled), "message" and latest "progress"
+- {"op": "cancel", "job": N}
+
+Replies have "ok": true, or "ok": false and an "error".
+
+This module only imports the standard library until the server itself is
+started, so it doubles as a thin client: "python server.py build ..." hands a
+book to a running server and waits for it.
+"""
+
+import argparse
+import getpass
+import itertools
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Environment variable naming the socket used when none is given
+SOCKET_ENVIRONMENT_VARIABLE = "FUZER_SOCKET"
+
+# Number of books the server builds at the same time
+DEFAULT_SERVER_WORKERS = 2
+
+# Number of finished jobs the server remembers the outcome of
+MAX_FINISHED_JOBS = 1000
+
+# Longest a status request waits for a job to finish, in seconds
+MAX_WAIT = 30
+
+# Largest request line accepted, in bytes
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# The run_fuzer arguments a client may set and the type of each, any of them
+# may also be null
+JOB_ARGUMENTS = {
+    "source_files": list,
+    "cover": str,
+    "title": str,
+    "dest_dir": str,
+    "file_order": bool,
+    "buffer_size": int,
+    "jobs": int,
+    "copy_threads": int,
+    "tag_padding": int,
+    "vbr_header": bool,
+    "chapters": bool,
+    "incremental": bool,
+    "validate": bool,
+    "tag_index": str,
+}
+
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class ServerError(Exception):
+    def __init__(self, message):
+        sys.tracebacklimit = 0  # Don't show traceback for this exception
+        self.message = message
+        super().__init__(self.message)
+
+
+def default_socket_path() -> str:
+    """
+    Returns: the socket named by the FUZER_SOCKET environment variable, or a
+    per-user socket in $XDG_RUNTIME_DIR or the temporary directory
+    """
+    path = os.environ.get(SOCKET_ENVIRONMENT_VARIABLE)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "fuzer.sock")
+    return os.path.join(tempfile.gettempdir(), f"fuzer-{getpass.getuser()}.sock")
+
+
+## Client ##
+def request(payload:dict, socket_path:str|None=None, timeout:float|None=None) -> dict:
+    """
+    Sends one request to the server and waits for the reply.
+
+    Arguments:
+        payload: the request, see the module doc-string
+        socket_path: optional, the server's socket, default_socket_path if None
+        timeout: optional, seconds to wait for the server
+
+    Returns: the reply
+
+    Raises: OSError if the server can't be reached, ServerError if it refused
+    the request
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall(json.dumps(payload).encode() + b"\n")
+        with sock.makefile("rb") as replies:
+            line = replies.readline()
+    if not line:
+        raise ServerError("The server closed the connection")
+    reply = json.loads(line)
+    if not reply.get("ok"):
+        raise ServerError(reply.get("error", "The server refused the request"))
+    return reply
+    ## request ##
+
+
+def server_available(socket_path:str|None=None) -> bool:
+    """
+    Returns: True if a server answers on socket_path (default_socket_path if None)
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    try:
+        request({"op": "ping"}, socket_path, timeout=1)
+    except (OSError, ValueError, ServerError):
+        return False
+    return True
+
+
+def submit(source_files:list[str], socket_path:str|None=None, **options) -> int:
+    """
+    Hands a book to the server. Paths are made absolute here, since the server
+    doesn't share the caller's working directory, and the book goes in the
+    current directory if neither dest_dir nor an absolute title says otherwise.
+
+    Arguments:
+        source_files: the mp3 files of the book
+        socket_path: optional, the server's socket
+        options: optional, other run_fuzer keyword arguments, with cover given
+        as the path of the jpeg file
+
+    Returns: the job number
+    """
+    args = dict(options, source_files=[os.path.abspath(x) for x in source_files])
+    for key in ("cover", "dest_dir", "tag_index"):
+        if args.get(key):
+            args[key] = os.path.abspath(args[key])
+    title = args.get("title")
+    if not args.get("dest_dir") and not (title and os.path.isabs(title)):
+        args["dest_dir"] = os.getcwd()
+    return request({"op": "submit", "args": args}, socket_path)["job"]
+
+
+def status(job:int, wait:float=0, socket_path:str|None=None) -> dict:
+    """
+    Arguments:
+        job: a job number returned by submit
+        wait: optional, seconds to wait for the job to finish
+        socket_path: optional, the server's socket
+
+    Returns: the job's "state", "message" and "progress"
+    """
+    return request({"op": "status", "job": job, "wait": wait}, socket_path)
+
+
+def cancel(job:int, socket_path:str|None=None) -> None:
+    request({"op": "cancel", "job": job}, socket_path)
+
+
+def build(
+    source_files:list[str],
+    socket_path:str|None=None,
+    progress=None,
+    cancel_event=None,
+    poll:float=0.25,
+    **options,
+) -> dict:
+    """
+    Has the server build a book and waits for it, like run_fuzer does locally.
+
+    Arguments:
+        source_files: the mp3 files of the book
+        socket_path: optional, the server's socket
+        progress: optional, called like run_fuzer's progress as the server
+        reports it
+        cancel_event: optional, a threading.Event, the job is cancelled when it
+        is set
+        poll: optional, seconds between progress updates
+        options: optional, other arguments for submit
+
+    Returns: the final status of the job
+    """
+    job = submit(source_files, socket_path, **options)
+    last_progress = None
+    cancelled = False
+    while True:
+        if cancel_event is not None and cancel_event.is_set() and not cancelled:
+            cancel(job, socket_path)
+            cancelled = True
+        job_status = status(job, poll, socket_path)
+        if progress and job_status["progress"] and job_status["progress"] != last_progress:
+            last_progress = job_status["progress"]
+            progress(*last_progress)
+        if job_status["state"] in FINISHED_STATES:
+            return job_status
+    ## build ##
+
+
+## Server ##
+def is_number(value, kinds) -> bool:
+    """
+    Returns: True if value is an instance of kinds, JSON's true and false
+    don't count as numbers
+    """
+    return isinstance(value, kinds) and not isinstance(value, bool)
+
+
+class Job:
+    """
+    A book the server was asked to build
+
+    Attributes:
+        number: the job number given to the client
+        args: the run_fuzer keyword arguments
+        state: queued, running, done, failed or cancelled
+        message: what run_fuzer returned, or what went wrong
+        progress: the latest (phase, tracks done, track count, bytes done,
+        bytes total) reported by run_fuzer, or None
+        cancel: the threading.Event run_fuzer checks
+        finished: set once the job is done, failed or cancelled
+    """
+
+    __slots__ = ("number", "args", "state", "message", "progress", "cancel", "finished")
+
+    def __init__(self, number:int, args:dict):
+        self.number = number
+        self.args = args
+        self.state = "queued"
+        self.message = None
+        self.progress = None
+        self.cancel = threading.Event()
+        self.finished = threading.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "ok": True,
+            "job": self.number,
+            "state": self.state,
+            "message": self.message,
+            "progress": self.progress,
+        }
+
+    def finish(self, state:str, message:str) -> None:
+        self.state = state
+        self.message = message
+        self.finished.set()
+    ## Job ##
+
+
+class BuildServer:
+    """
+    Keeps track of the jobs and runs them on a pool of threads
+
+    Attributes:
+        run_fuzer: the function that builds a book, Fuzer's run_fuzer
+        workers: the number of books built at the same time
+    """
+
+    def __init__(self, run_fuzer, workers:int=DEFAULT_SERVER_WORKERS):
+        self.run_fuzer = run_fuzer
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = {}  # number -> Job, oldest first
+        self._numbers = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle(self, payload:dict) -> dict:
+        """
+        Arguments:
+            payload: a request, see the module doc-string
+
+        Returns: the reply
+        """
+        op = payload.get("op")
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid(), "workers": self.workers}
+        if op == "submit":
+            args = payload.get("args") or {}
+            if not isinstance(args, dict):
+                return {"ok": False, "error": "args must be an object"}
+            return self.submit(args)
+        if op in ("status", "cancel"):
+            number = payload.get("job")
+            if not is_number(number, int):
+                return {"ok": False, "error": f"job must be a job number, not {number!r}"}
+            wait = payload.get("wait") or 0
+            if not is_number(wait, (int, float)):
+                return {"ok": False, "error": f"wait must be a number of seconds, not {wait!r}"}
+            with self._lock:
+                job = self._jobs.get(number)
+            if job is None:
+                return {"ok": False, "error": f"No job {number!r}"}
+            if op == "cancel":
+                job.cancel.set()
+            elif wait > 0:
+                job.finished.wait(min(wait, MAX_WAIT))
+            return job.to_dict()
+        return {"ok": False, "error": f"Unknown op {op!r}"}
+        ## handle ##
+
+    def submit(self, args:dict) -> dict:
+        unknown = set(args) - set(JOB_ARGUMENTS)
+        if unknown:
+            return {"ok": False, "error": f"Unknown arguments {', '.join(sorted(unknown))}"}
+        for name, value in args.items():
+            kind = JOB_ARGUMENTS[name]
+            if value is not None and not (
+                is_number(value, kind) if kind is int else isinstance(value, kind)
+            ):
+                return {"ok": False, "error": f"{name} must be a {kind.__name__}"}
+        source_files = args.get("source_files")
+        if not source_files or not all(
+            isinstance(x, str) and os.path.isabs(x) for x in source_files
+        ):
+            return {"ok": False, "error": "source_files must be a list of absolute paths"}
+        with self._lock:
+            job = Job(next(self._numbers), args)
+            self._jobs[job.number] = job
+            finished = [x for x in self._jobs.values() if x.finished.is_set()]
+            for old_job in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[old_job.number]
+        self._pool.submit(self.run_job, job)
+        return job.to_dict()
+        ## submit ##
+
+    def run_job(self, job:Job) -> None:
+        if job.cancel.is_set():
+            job.finish("cancelled", "Cancelled before it started")
+            return
+        job.state = "running"
+        args = dict(job.args)
+        cover = None
+
+        def on_progress(*progress) -> None:
+            job.progress = progress
+
+        try:
+            if args.get("cover"):
+                cover = open(args["cover"], "rb")
+            args["cover"] = cover
+            message = self.run_fuzer(
+                args.pop("source_files"), progress=on_progress, cancel=job.cancel, **args
+            )
+        except Exception as e:
+            # Fuzer's own errors (TrackError, AlreadyExistsError and
+            # BuildCancelledError) carry a message for the user
+            if not hasattr(e, "message"):
+                job.finish("failed", f"{type(e).__name__}: {e}")
+            elif job.cancel.is_set():
+                job.finish("cancelled", e.message)
+            else:
+                job.finish("failed", e.message)
+        else:
+            job.finish("done", message)
+        finally:
+            if cover:
+                cover.close()
+        print(f"Job {job.number} {job.state}: {job.message}")
+        ## run_job ##
+
+    def shutdown(self) -> None:
+        """
+        Cancels the jobs that haven't started and waits for the running ones
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.state == "queued":
+                    job.cancel.set()
+        self._pool.shutdown(wait=True)
+    ## BuildServer ##
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE + 1)
+            if not line:
+                return
+            try:
+                if len(line) > MAX_REQUEST_SIZE:
+                    raise ValueError("Request too long")
+                payload = json.loads(line)
+                if not isinstance(payload, dict):
+                    raise ValueError("A request must be a JSON object")
+                reply = self.server.builds.handle(payload)
+            except (ValueError, TypeError, KeyError) as e:
+                # A malformed request gets an error rather than losing the
+                # connection
+                reply = {"ok": False, "error": f"Bad request: {e}"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def stop_server(signal_number, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(
+    run_fuzer, socket_path:str|None=None, workers:int=DEFAULT_SERVER_WORKERS
+) -> None:
+    """
+    Runs the build server until it is interrupted or sent SIGTERM, then waits
+    for the books being built. The socket is only accessible to the user
+    running the server.
+
+    Arguments:
+        run_fuzer: the function that builds a book, passed in by Fuzer's serve
+        command rather than imported here, which would load Fuzer a second time
+        when it is running as __main__
+        socket_path: optional, the socket to listen on, default_socket_path if None
+        workers: optional, the number of books built at the same time
+
+    Raises: ServerError if another server is already listening on socket_path
+    """
+    socket_path = socket_path or default_socket_path()
+    if os.path.exists(socket_path):
+        if server_available(socket_path):
+            raise ServerError(f"A server is already running on {socket_path}")
+        os.remove(socket_path)  # left behind by a server that died
+
+    builds = BuildServer(run_fuzer, workers)
+    old_umask = os.umask(0o177)
+    try:
+        server = UnixServer(socket_path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.builds = builds
+    signal.signal(signal.SIGTERM, stop_server)
+    print(f"Serving on {socket_path} with {workers} workers, press Ctrl-C to stop...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping, waiting for the books being built...")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        builds.shutdown()
+    ## serve ##
+
+
+## Thin client command line ##
+def main(argv:list[str]|None=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Talks to a running Fuzer build server (start one with "
+        '"Fuzer.py serve")'
+    )
+    parser.add_argument("--socket", default=None, help="The server's socket")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Build a book and wait for it")
+    build_parser.add_argument("--cover", "-c", default=None)
+    build_parser.add_argument("--title", "-t", default=None)
+    build_parser.add_argument("--dest_dir", "-dd", default=None)
+    build_parser.add_argument("--file-order", "-fo", action="store_true")
+    build_parser.add_argument("--chapters", "-ch", action="store_true")
+    build_parser.add_argument("--incremental", "-i", action="store_true")
+    build_parser.add_argument("--no-vbr-header", dest="vbr_header", action="store_false")
+    build_parser.add_argument("--no-validate", dest="validate", action="store_false")
+    build_parser.add_argument("--tag-index", "-ti", default=None)
+    build_parser.add_argument(
+        "--no-wait", dest="wait", action="store_false", help="Print the job number and exit"
+    )
+    build_parser.add_argument("source_files", nargs="+")
+
+    for name, help_text in (("status", "Show a job"), ("cancel", "Cancel a job")):
+        command_parser = commands.add_parser(name, help=help_text)
+        command_parser.add_argument("job", type=int)
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "build":
+            options = {
+                "cover": args.cover,
+                "title": args.title,
+                "dest_dir": args.dest_dir,
+                "file_order": args.file_order,
+                "chapters": args.chapters,
+                "incremental": args.incremental,
+                "vbr_header": args.vbr_header,
+                "validate": args.validate,
+                "tag_index": args.tag_index or os.environ.get("FUZER_TAG_INDEX"),
+            }
+            if not args.wait:
+                print(submit(args.source_files, args.socket, **options))
+                return 0
+            job_status = build(args.source_files, args.socket, **options)
+        elif args.command == "status":
+            job_status = status(args.job, socket_path=args.socket)
+        else:
+            cancel(args.job, args.socket)
+            return 0
+    except (OSError, ServerError) as e:
+        print(getattr(e, "message", e), file=sys.stderr)
+        return 2
+    print(job_status["message"] or job_status["state"])
+    return 0 if job_status["state"] in ("done", "queued", "running") else 1
+    ## main ##
+
+
+## Main ##
+if __name__ == "__main__":
+    sys.exit(main())
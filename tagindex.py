@@ -0,0 +1,272 @@
+"""
+An optional on-disk index of the tags of mp3 files, shared by every Fuzer run,
+batch, watch and winFuzer that is pointed at it. For each file it keeps what
+read_track_info found (disc, track, album, title, text frames, where the audio
+is, the first frame header and the playing time) and, once check_formats has
+scanned it, the formats of its frames. Entries are keyed on the path and are
+only used while the file still has the size and modification time it had
+when it was read, so a changed file is simply read again.
+
+The index is a SQLite database in WAL mode, so several processes can use it at
+once. Writes are batched into transactions of BATCH_SIZE files.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+INDEX_VERSION = 3
+
+# Environment variable naming the index used when none is given
+INDEX_ENVIRONMENT_VARIABLE = "FUZER_TAG_INDEX"
+
+# Number of files written to the index per transaction
+BATCH_SIZE = 500
+
+# Seconds to wait for another process that is writing to the index
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    disc INTEGER,
+    disc_count INTEGER,
+    track INTEGER,
+    track_count INTEGER,
+    album TEXT,
+    title TEXT,
+    audio_offset INTEGER NOT NULL,
+    audio_length INTEGER NOT NULL,
+    tags TEXT NOT NULL,
+    first_frame BLOB,
+    duration REAL,
+    formats TEXT
+)
+"""
+
+
+def default_index_path() -> str|None:
+    """
+    Returns: the index named by the FUZER_TAG_INDEX environment variable, or
+    None if it isn't set
+    """
+    return os.environ.get(INDEX_ENVIRONMENT_VARIABLE) or None
+
+
+def file_identity(path:str) -> tuple[int, int]|None:
+    """
+    Returns: (size, mtime_ns) of path, or None if it can't be stat'ed
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def split_position(position:tuple[int, int]|None) -> tuple[int|None, int|None]:
+    return position if position is not None else (None, None)
+
+
+def join_position(index:int|None, count:int|None) -> tuple[int, int]|None:
+    return None if index is None else (index, count)
+
+
+class TagIndex:
+    """
+    A connection to a tag index. It can be shared by the threads of a process.
+
+    Attributes:
+        path: the path of the database
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, check_same_thread=False
+        )
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != INDEX_VERSION:
+                # It's only a cache, start again rather than migrate
+                self._connection.execute("DROP TABLE IF EXISTS tracks")
+                self._connection.execute(f"PRAGMA user_version={INDEX_VERSION}")
+            self._connection.execute(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def lookup(
+        self, paths:list[str]
+    ) -> tuple[dict[str, tuple], dict[str, tuple[int, int]]]:
+        """
+        Arguments:
+            paths: mp3 files
+
+        Returns: (found, identities). found maps each of paths the index has an
+        up to date entry for to the TrackInfo fields after the path (disc,
+        track, album, title, audio_offset, audio_length, tags, first_frame,
+        duration). identities maps each of paths that exists to its (size,
+        mtime_ns), to be handed to store once the other files have been read.
+        """
+        identities = {}
+        for path in paths:
+            identity = file_identity(path)
+            if identity is not None:
+                identities[path] = identity
+        found = {}
+        with self._lock:
+            for path, identity in identities.items():
+                row = self._connection.execute(
+                    "SELECT disc, disc_count, track, track_count, album, title, "
+                    "audio_offset, audio_length, tags, first_frame, duration "
+                    "FROM tracks WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    (os.path.abspath(path), *identity),
+                ).fetchone()
+                if row is not None:
+                    found[path] = (
+                        join_position(row[0], row[1]),
+                        join_position(row[2], row[3]),
+                        row[4],
+                        row[5],
+                        row[6],
+                        row[7],
+                        json.loads(row[8]),
+                        row[9],
+                        row[10],
+                    )
+        return found, identities
+        ## lookup ##
+
+    def store(self, tracks:list, identities:dict[str, tuple[int, int]]) -> None:
+        """
+        Adds or replaces the entries of tracks, in transactions of BATCH_SIZE.
+
+        Arguments:
+            tracks: TrackInfo records just read
+            identities: the (size, mtime_ns) of each track's path taken before
+            it was read, as returned by lookup. Tracks without one are skipped.
+        """
+        rows = []
+        for track in tracks:
+            identity = identities.get(track.path)
+            if identity is None:
+                continue
+            rows.append(
+                (
+                    os.path.abspath(track.path),
+                    *identity,
+                    *split_position(track.disc),
+                    *split_position(track.track),
+                    track.album,
+                    track.title,
+                    track.audio_offset,
+                    track.audio_length,
+                    json.dumps(track.tags),
+                    track.first_frame,
+                    track.duration,
+                )
+            )
+        for start in range(0, len(rows), BATCH_SIZE):
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO tracks (path, size, mtime_ns, disc, "
+                    "disc_count, track, track_count, album, title, audio_offset, "
+                    "audio_length, tags, first_frame, duration) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows[start : start + BATCH_SIZE],
+                )
+        ## store ##
+
+    def lookup_formats(
+        self, paths:list[str]
+    ) -> tuple[dict[str, dict], dict[str, tuple[int, int]]]:
+        """
+        Arguments:
+            paths: mp3 files
+
+        Returns: (found, identities) like lookup, but found maps paths to the
+        {(layer, sample rate, channels): frame count} dict stored by
+        store_formats
+        """
+        identities = {}
+        for path in paths:
+            identity = file_identity(path)
+            if identity is not None:
+                identities[path] = identity
+        found = {}
+        with self._lock:
+            for path, identity in identities.items():
+                row = self._connection.execute(
+                    "SELECT formats FROM tracks "
+                    "WHERE path = ? AND size = ? AND mtime_ns = ? AND formats IS NOT NULL",
+                    (os.path.abspath(path), *identity),
+                ).fetchone()
+                if row is not None:
+                    found[path] = {tuple(x[:3]): x[3] for x in json.loads(row[0])}
+        return found, identities
+        ## lookup_formats ##
+
+    def store_formats(
+        self, formats:dict[str, dict], identities:dict[str, tuple[int, int]]
+    ) -> None:
+        """
+        Records the frame formats of files that are already in the index.
+
+        Arguments:
+            formats: maps paths to what stream_formats found in them
+            identities: the (size, mtime_ns) of each path taken before it was
+            scanned, as returned by lookup_formats
+        """
+        rows = [
+            (json.dumps([[*key, count] for key, count in found.items()]),
+             os.path.abspath(path), *identities[path])
+            for path, found in formats.items()
+            if path in identities
+        ]
+        for start in range(0, len(rows), BATCH_SIZE):
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    "UPDATE tracks SET formats = ? WHERE path = ? AND size = ? AND mtime_ns = ?",
+                    rows[start : start + BATCH_SIZE],
+                )
+        ## store_formats ##
+
+    def prune(self, roots:list[str]|None=None) -> int:
+        """
+        Removes the entries of files that no longer exist.
+
+        Arguments:
+            roots: optional, only look at files under these directories
+
+        Returns: the number of entries removed
+        """
+        with self._lock:
+            paths = [x[0] for x in self._connection.execute("SELECT path FROM tracks")]
+        if roots is not None:
+            prefixes = tuple(os.path.join(os.path.abspath(x), "") for x in roots)
+            paths = [x for x in paths if x.startswith(prefixes)]
+        gone = [(x,) for x in paths if not os.path.isfile(x)]
+        for start in range(0, len(gone), BATCH_SIZE):
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    "DELETE FROM tracks WHERE path = ?", gone[start : start + BATCH_SIZE]
+                )
+        return len(gone)
+        ## prune ##
+    ## TagIndex ##
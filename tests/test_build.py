@@ -0,0 +1,154 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import benchmark
+import Fuzer
+import manifest
+
+
+@pytest.fixture
+def corpus(tmp_path) -> list[str]:
+    return benchmark.make_corpus(str(tmp_path / "tracks"), 6, 40000, discs=2)
+
+
+def build(paths:list[str], dest_dir, **options) -> str:
+    """
+    Returns: the path of the book run_fuzer built from paths in dest_dir
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    Fuzer.run_fuzer(paths, dest_dir=str(dest_dir), **options)
+    (name,) = [x for x in os.listdir(dest_dir) if x.endswith(".mp3")]
+    return os.path.join(dest_dir, name)
+
+
+def test_replace_rebuilds_an_existing_book(corpus, tmp_path):
+    book = build(corpus, tmp_path / "out")
+    with open(book, "rb") as book_file:
+        first = book_file.read()
+    with pytest.raises(Fuzer.AlreadyExistsError):
+        Fuzer.run_fuzer(corpus, dest_dir=str(tmp_path / "out"))
+    benchmark.make_track(sorted(corpus)[-1], 20000, "Fuzer Benchmark", 2, 2, 3, 3)
+    build(corpus, tmp_path / "out", replace=True)
+    with open(book, "rb") as book_file:
+        assert book_file.read() != first
+
+
+def test_publish_never_overwrites(tmp_path):
+    out_name = str(tmp_path / "book.mp3")
+    with open(out_name, "wb") as out_file:
+        out_file.write(b"theirs")
+    temp_name, temp_file = Fuzer.create_temp_file(out_name)
+    with temp_file:
+        temp_file.write(b"ours")
+    with pytest.raises(Fuzer.AlreadyExistsError):
+        Fuzer.publish(temp_name, out_name)
+    with open(out_name, "rb") as out_file:
+        assert out_file.read() == b"theirs"
+    Fuzer.publish(temp_name, out_name, replace=True)
+    assert not os.path.exists(temp_name)
+    with open(out_name, "rb") as out_file:
+        assert out_file.read() == b"ours"
+
+
+def test_book_made_during_a_build_is_kept(corpus, tmp_path, monkeypatch):
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    write_output = Fuzer.write_output
+
+    def racing_write_output(out_file, track_list, *args):
+        # Another build finishes the same book while this one is writing
+        with open(out_dir / Fuzer.get_output_file_name(track_list[0]), "wb") as other:
+            other.write(b"theirs")
+        write_output(out_file, track_list, *args)
+
+    monkeypatch.setattr(Fuzer, "write_output", racing_write_output)
+    with pytest.raises(Fuzer.AlreadyExistsError):
+        Fuzer.run_fuzer(corpus, dest_dir=str(out_dir))
+    (name,) = os.listdir(out_dir)  # and no temporary file is left behind
+    with open(out_dir / name, "rb") as book_file:
+        assert book_file.read() == b"theirs"
+
+
+def test_cancelled_build_leaves_nothing(corpus, tmp_path):
+    cancel = threading.Event()
+    cancel.set()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    with pytest.raises(Fuzer.BuildCancelledError):
+        Fuzer.run_fuzer(corpus, dest_dir=str(out_dir), cancel=cancel)
+    assert os.listdir(out_dir) == []
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"chapters": True}, {"vbr_header": False}, {"incremental": True}],
+)
+def test_parallel_copy_matches_sequential(corpus, tmp_path, options):
+    with open(sorted(corpus)[1], "ab") as track_file:
+        track_file.write(bytes(1000))  # junk the frame scan has to step over
+    books = []
+    for copy_threads in (1, 4):
+        book = build(corpus, tmp_path / str(copy_threads), copy_threads=copy_threads, **options)
+        with open(book, "rb") as book_file:
+            contents = book_file.read()
+        saved = manifest.load_manifest(book)
+        if saved:
+            # The frame counts and hashes of every track, not the book's mtime
+            contents = (contents, saved["tracks"], saved["index"])
+        books.append(contents)
+    assert books[0] == books[1]
+
+
+class Sink:
+    """
+    A stream that can only be written to, like a pipe or a socket
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data) -> int:
+        self.data += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+COVER = os.path.join(os.path.dirname(__file__), "..", "test_data", "Fuzer.jpg")
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"chapters": True}, {"vbr_header": False}, {"cover": True}]
+)
+def test_stream_book_matches_the_file_build(corpus, tmp_path, options):
+    with open(COVER, "rb") as cover_file:
+        cover = cover_file.read()
+
+    def with_cover() -> dict:
+        # Each build reads the cover from its own file object
+        return dict(options, cover=io.BytesIO(cover)) if options.get("cover") else options
+
+    book = build(corpus, tmp_path / "out", **with_cover())
+    sink = Sink()
+    written = Fuzer.stream_book(corpus, sink, **with_cover())
+    with open(book, "rb") as book_file:
+        assert bytes(sink.data) == book_file.read()
+    assert written == len(sink.data)
+
+
+def test_title_dash_writes_the_book_to_stdout(corpus, tmp_path):
+    book = build(corpus, tmp_path / "out")
+    result = subprocess.run(
+        [sys.executable, Fuzer.__file__, "build", "--title", "-", *corpus],
+        capture_output=True,
+        check=True,
+    )
+    with open(book, "rb") as book_file:
+        assert result.stdout == book_file.read()
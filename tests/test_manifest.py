@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import benchmark
+import Fuzer
+import manifest
+
+ALBUM = "Fuzer Benchmark"
+
+
+@pytest.fixture
+def corpus(tmp_path) -> list[str]:
+    # Sorted by name the paths are in book order
+    return sorted(benchmark.make_corpus(str(tmp_path / "tracks"), 6, 40000, discs=2))
+
+
+def build(paths:list[str], dest_dir, **options) -> tuple[str, str]:
+    """
+    Returns: (what run_fuzer returned, the path of the book)
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    message = Fuzer.run_fuzer(paths, dest_dir=str(dest_dir), **options)
+    (name,) = [x for x in os.listdir(dest_dir) if x.endswith(".mp3")]
+    return message, os.path.join(dest_dir, name)
+
+
+def read(path:str) -> bytes:
+    with open(path, "rb") as in_file:
+        return in_file.read()
+
+
+def test_unchanged_book_is_left_alone(corpus, tmp_path):
+    _, book = build(corpus, tmp_path / "out", incremental=True)
+    before = read(book), os.stat(book).st_mtime_ns
+    # Only touched, the audio is hashed and found to be the same
+    os.utime(corpus[2], ns=(0, 0))
+    message, _ = build(corpus, tmp_path / "out", incremental=True)
+    assert message.endswith("is up to date")
+    assert (read(book), os.stat(book).st_mtime_ns) == before
+
+
+def test_unchanged_prefix_stops_at_the_first_changed_track(corpus, tmp_path):
+    _, book = build(corpus, tmp_path / "out", incremental=True)
+    existing = manifest.load_manifest(book)
+    tracks = Fuzer.scan_tracks(corpus, 1)
+    assert manifest.unchanged_prefix(existing, tracks, 4096) == 6
+    benchmark.make_track(corpus[4], 40000, ALBUM, 2, 2, 2, 3)
+    tracks = Fuzer.scan_tracks(corpus, 1)
+    assert manifest.unchanged_prefix(existing, tracks, 4096) == 4
+
+
+@pytest.mark.parametrize("options", [{}, {"chapters": True}, {"vbr_header": False}])
+def test_partial_rebuild_matches_a_full_build(corpus, tmp_path, options):
+    _, book = build(corpus, tmp_path / "out", incremental=True, **options)
+    benchmark.make_track(corpus[4], 60000, ALBUM, 2, 2, 2, 3)
+    message, _ = build(corpus, tmp_path / "out", incremental=True, **options)
+    assert message.endswith("(kept 4 of 6 tracks)")
+    _, fresh = build(corpus, tmp_path / "fresh", incremental=True, **options)
+    assert read(book) == read(fresh)
+    assert manifest.load_manifest(book)["tracks"] == manifest.load_manifest(fresh)["tracks"]
+
+
+def test_book_changed_since_its_manifest_is_not_overwritten(corpus, tmp_path):
+    _, book = build(corpus, tmp_path / "out", incremental=True)
+    with open(book, "ab") as book_file:
+        book_file.write(b"edited")
+    assert manifest.load_manifest(book) is None
+    with pytest.raises(Fuzer.AlreadyExistsError):
+        build(corpus, tmp_path / "out", incremental=True)
@@ -0,0 +1,101 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import mpeg
+
+# MPEG 1 layer III, 128 kbps, 44.1 kHz, joint stereo, no CRC
+FRAME_HEADER = bytes((0xFF, 0xFB, 0x90, 0x44))
+
+
+def cbr_audio(frames:int, seed:int=0) -> bytes:
+    # Random payloads, like real audio, are full of would-be frame syncs
+    length = mpeg.parse_frame_header(FRAME_HEADER)[0]
+    rng = random.Random(seed)
+    return b"".join(FRAME_HEADER + rng.randbytes(length - 4) for _ in range(frames))
+
+
+@pytest.mark.skipif(mpeg.np is None, reason="needs NumPy")
+def test_stream_formats_ignores_syncs_in_the_payload(tmp_path):
+    audio = cbr_audio(20000)
+    assert audio.count(b"\xff") > 20000 * 2  # the payload has sync bytes
+    path = tmp_path / "track.mp3"
+    path.write_bytes(audio)
+    assert mpeg.stream_formats(str(path), 0, len(audio)) == {(3, 44100, 2): 20000}
+
+
+@pytest.mark.skipif(mpeg.np is None, reason="needs NumPy")
+def test_stream_formats_ignores_chained_syncs_in_the_payload(tmp_path):
+    # A layer I 32 kHz header followed one frame length (48 bytes) later by
+    # another, both inside the payload of a real frame
+    fake = bytes((0xFF, 0xFF, 0x18, 0x00))
+    audio = bytearray(cbr_audio(100))
+    length = mpeg.parse_frame_header(FRAME_HEADER)[0]
+    audio[50 * length + 10 : 50 * length + 14] = fake
+    audio[50 * length + 58 : 50 * length + 62] = fake
+    path = tmp_path / "track.mp3"
+    path.write_bytes(audio)
+    assert mpeg.stream_formats(str(path), 0, len(audio)) == {(3, 44100, 2): 100}
+
+
+@pytest.mark.skipif(mpeg.np is None, reason="needs NumPy")
+def test_stream_formats_resyncs_after_junk(tmp_path):
+    audio = cbr_audio(2000)
+    length = mpeg.parse_frame_header(FRAME_HEADER)[0]
+    junk = random.Random(1).randbytes(1000)
+    data = audio[: 1000 * length] + junk + audio[1000 * length :]
+    path = tmp_path / "track.mp3"
+    path.write_bytes(data)
+    assert mpeg.stream_formats(str(path), 0, len(data)) == {(3, 44100, 2): 2000}
+
+
+@pytest.mark.skipif(mpeg.np is None, reason="needs NumPy")
+def test_stream_formats_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(mpeg, "SCAN_CHUNK", 10007)
+    audio = cbr_audio(3000, seed=2)
+    path = tmp_path / "track.mp3"
+    path.write_bytes(audio)
+    assert mpeg.stream_formats(str(path), 0, len(audio)) == {(3, 44100, 2): 3000}
+
+
+# MPEG 1 layer II, 160 kbps, 44.1 kHz, stereo, no CRC
+LAYER_2_HEADER = bytes((0xFF, 0xFD, 0x90, 0x04))
+
+
+def test_xing_frame_is_layer_3_only():
+    assert mpeg.takes_xing_frame(FRAME_HEADER)
+    assert not mpeg.takes_xing_frame(LAYER_2_HEADER)
+    with pytest.raises(ValueError):
+        mpeg.xing_frame(LAYER_2_HEADER)
+
+
+def test_layer_2_book_has_no_xing_frame(tmp_path):
+    from mutagen.id3 import ID3, TALB, TIT2, TPOS, TRCK
+    import Fuzer
+
+    length = mpeg.parse_frame_header(LAYER_2_HEADER)[0]
+    rng = random.Random(0)
+    audio = b"".join(LAYER_2_HEADER + rng.randbytes(length - 4) for _ in range(200))
+    paths = []
+    for track in (1, 2):
+        path = tmp_path / f"{track}.mp3"
+        path.write_bytes(audio)
+        tags = ID3()
+        tags.add(TALB(encoding=3, text=["Layer II"]))
+        tags.add(TIT2(encoding=3, text=[f"Part {track}"]))
+        tags.add(TPOS(encoding=3, text=["1/1"]))
+        tags.add(TRCK(encoding=3, text=[f"{track}/2"]))
+        tags.save(str(path), v2_version=3)
+        paths.append(str(path))
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    Fuzer.run_fuzer(paths, dest_dir=str(out_dir), chapters=True)
+    (book,) = out_dir.iterdir()
+    data = book.read_bytes()
+    with open(book, "rb") as book_file:
+        offset = Fuzer.audio_offset(book_file)
+    # The audio starts with the tracks' own frames, with no Xing frame in front
+    assert data[offset:] == audio * 2
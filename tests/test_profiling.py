@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import benchmark
+import Fuzer
+import profiling
+from profiling import Profiler
+
+
+def test_parallel_tracks_have_no_io_counts(tmp_path):
+    paths = benchmark.make_corpus(str(tmp_path / "tracks"), 4, 40000)
+    profiler = Profiler()
+    Fuzer.run_fuzer(paths, dest_dir=str(tmp_path), profile=profiler, copy_threads=4)
+    assert len(profiler.tracks) == 4
+    for track in profiler.tracks:
+        assert track["seconds"] >= 0
+        assert track["bytes_read"] is track["bytes_written"] is track["opens"] is None
+    assert "only have their I/O counted in the phases" in profiler.report()
+
+
+def test_build_phases_are_recorded(tmp_path):
+    paths = benchmark.make_corpus(str(tmp_path / "tracks"), 3, 40000)
+    profiler = Profiler()
+    Fuzer.run_fuzer(paths, dest_dir=str(tmp_path), profile=profiler)
+    names = [x["name"] for x in profiler.phases]
+    assert names == [
+        "scan_tracks",
+        "sort_tracks",
+        "check_formats",
+        "get_output_file_name",
+        "build_tag",
+        "write_file",
+        "update_tags",
+    ]
+    assert all(x["seconds"] >= 0 and x["opens"] >= 0 for x in profiler.phases)
+    assert sorted(x["name"] for x in profiler.tracks) == sorted(paths)
+    if profiling.io_counters() is not None:
+        # Every track's audio is read while it's copied
+        assert all(x["bytes_read"] >= 40000 for x in profiler.tracks)
+    report = profiler.report()
+    assert "write_file" in report and "Tracks" in report
+    profiler.write_json(str(tmp_path / "profile.json"))
+    with open(tmp_path / "profile.json") as json_file:
+        assert json.load(json_file) == json.loads(json.dumps(profiler.to_dict()))
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(enabled=False)
+    with profiler.phase("build_tag"), profiler.track("a.mp3"):
+        pass
+    assert profiler.phases == [] and profiler.tracks == []
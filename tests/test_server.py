@@ -0,0 +1,47 @@
+import json
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import Fuzer
+import server
+
+
+class FakeServer:
+    def __init__(self, builds:server.BuildServer):
+        self.builds = builds
+
+
+def exchange(builds:server.BuildServer, *requests:bytes) -> list[dict]:
+    """
+    Returns: the replies RequestHandler sends to requests over one connection
+    """
+    ours, theirs = socket.socketpair()
+    with ours, theirs:
+        ours.sendall(b"".join(requests))
+        ours.shutdown(socket.SHUT_WR)
+        server.RequestHandler(theirs, None, FakeServer(builds))
+        theirs.close()
+        with ours.makefile("rb") as replies:
+            return [json.loads(x) for x in replies]
+
+
+def test_malformed_requests_get_errors():
+    builds = server.BuildServer(Fuzer.run_fuzer, workers=1)
+    try:
+        replies = exchange(
+            builds,
+            b'{"op": "status", "job": [1]}\n',
+            b'{"op": "cancel", "job": true}\n',
+            b'{"op": "status", "job": 1, "wait": "long"}\n',
+            b'{"op": "submit", "args": ["/a.mp3"]}\n',
+            b'{"op": "submit", "args": {"source_files": "/a.mp3"}}\n',
+            b'{"op": "submit", "args": {"source_files": ["/a.mp3"], "jobs": "4"}}\n',
+            b"[1, 2]\n",
+            b'{"op": "ping"}\n',
+        )
+    finally:
+        builds.shutdown()
+    assert [x["ok"] for x in replies] == [False] * 7 + [True]
+    assert all(x["error"] for x in replies[:7])
@@ -0,0 +1,56 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import Fuzer
+
+FRAME = b"\xff\xfb\x90\x44" + bytes(413)
+
+
+def synchsafe(size:int) -> bytes:
+    return bytes(((size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F))
+
+
+def v24_tag(*frames:tuple[bytes, int, bytes]) -> bytes:
+    body = b"".join(
+        frame_id + synchsafe(len(data)) + bytes((0, flags)) + data
+        for frame_id, flags, data in frames
+    )
+    return b"ID3\x04\x00\x00" + synchsafe(len(body)) + body
+
+
+def test_user_defined_and_url_frames_are_kept():
+    tag = v24_tag(
+        (b"TALB", 0, b"\x03Album"),
+        (b"TXXX", 0, b"\x03MusicBrainz Album Id\x00abc-123"),
+        (b"WOAR", 0, b"http://artist.example/"),
+        (b"WXXX", 0, b"\x01\xff\xfeh\x00o\x00m\x00e\x00\x00\x00http://home.example/"),
+    )
+    offset, frames = Fuzer.read_text_frames(io.BytesIO(tag + FRAME))
+    assert offset == len(tag)
+    assert frames == {
+        "TALB": ["Album"],
+        "TXXX:MusicBrainz Album Id": ["abc-123"],
+        "WOAR": ["http://artist.example/"],
+        "WXXX:home": ["http://home.example/"],
+    }
+
+
+def test_grouped_frames_skip_the_group_byte():
+    tag = v24_tag((b"TALB", 0x40, b"\x07\x03Album"))
+    assert Fuzer.read_text_frames(io.BytesIO(tag + FRAME))[1] == {"TALB": ["Album"]}
+
+
+def test_audio_offset_agrees_with_audio_range():
+    id3v1 = b"TAG" + bytes(125)
+    stacked = v24_tag((b"TALB", 0, b"\x03One")) + v24_tag((b"TIT2", 0, b"\x03Two"))
+    for data in (
+        id3v1 + FRAME * 3,  # a leading TAG is audio, not an ID3v1 tag
+        stacked + FRAME * 3 + id3v1,
+        FRAME * 3,
+        id3v1,
+    ):
+        start, end = Fuzer.audio_range(data)
+        assert Fuzer.audio_offset(io.BytesIO(data)) == start
+    assert Fuzer.audio_range(stacked + FRAME + id3v1) == (len(stacked), len(stacked) + len(FRAME))
@@ -9,6 +9,8 @@ from components.file_panel import FilePanel
 from components.input_files_panel import InputFilesPanel
 from components.button_panel import ButtonPanel
 from components.messages_panel import MessagesPanel
+from components.queue_panel import QueuePanel
+from components.directory_cache import directory_key
 
 # Add the project root to the path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -18,12 +20,9 @@ input_files = state.create("input_files")
 cover_file = state.create("cover_file")
 current_directory = state.create("current_directory")
 messages = state.create("messages")
-
-# dir_label = ui.Label(text=current_directory.get()[-1])
-dir_label = ui.Label(text="")
-current_directory.bind_to(
-    dir_label, "text", lambda cd: f"Directory: {current_directory.get()[-1]}"
-)
+build_running = state.create("build_running")
+directory_snapshot = state.create("directory_snapshot")
+book_queue = state.create("book_queue")
 
 
 def App() -> ui.Column:
@@ -43,37 +42,58 @@ def App() -> ui.Column:
     messages_container = ui.Frame(
         props={"id": "messages_container", "layout": "vertical"}
     )
+    queue_container = ui.Frame(props={"id": "queue_container", "layout": "vertical"})
 
     def on_dir_change(cur_dir:str) -> None:
         ui.clear_layout(directory_tree_container.layout())
-        ui.clear_layout(file_list_container.layout())
-
         directory_tree_container.add_child(TreeViewPanel())
-        file_list_container.add_child(FilePanel())
 
-    def on_input_file_change(input_files:list[str]) -> None:
-        ui.clear_layout(input_files_container.layout())
-        input_files_container.add_child(InputFilesPanel())
-        ui.clear_layout(button_container.layout())
-        button_container.add_child(ButtonPanel())
-
-    def on_cover_file_change(cover_file:str) -> None:
-        ui.clear_layout(input_files_container.layout())
-        input_files_container.add_child(InputFilesPanel())
-        ui.clear_layout(button_container.layout())
-        button_container.add_child(ButtonPanel())
+    def on_directory_snapshot_change(snapshot) -> None:
+        # A background scan finished, redraw if it's the directory being shown
+        if snapshot and directory_key(snapshot.path) == directory_key(
+            current_directory.get()
+        ):
+            on_dir_change(current_directory.get())
+
+    shown_buttons = None
+
+    def on_button_state_change(value) -> None:
+        # Which buttons are enabled only depends on whether there are files, a
+        # cover and a build running, so most changes leave the panel alone
+        nonlocal shown_buttons
+        buttons = (
+            bool(input_files.get()),
+            cover_file.get() != "Select a jpeg for the cover...",
+            bool(build_running.get()),
+        )
+        if buttons != shown_buttons:
+            shown_buttons = buttons
+            ui.clear_layout(button_container.layout())
+            button_container.add_child(ButtonPanel())
 
     def on_messages_change(messages:str) -> None:
         ui.clear_layout(messages_container.layout())
         messages_container.add_child(MessagesPanel())
 
+    def on_book_queue_change(book_queue) -> None:
+        ui.clear_layout(queue_container.layout())
+        queue_container.add_child(QueuePanel())
+
     state.subscribe("current_directory", on_dir_change)
-    state.subscribe("input_files", on_input_file_change)
-    state.subscribe("cover_file", on_cover_file_change)
+    state.subscribe("input_files", on_button_state_change)
+    state.subscribe("cover_file", on_button_state_change)
     state.subscribe("messages", on_messages_change)
+    state.subscribe("build_running", on_button_state_change)
+    state.subscribe("directory_snapshot", on_directory_snapshot_change)
+    state.subscribe("book_queue", on_book_queue_change)
+    state.subscribe("selected_queued_book", on_book_queue_change)
 
     on_dir_change(state.get("current_directory"))  # Initial page load
     on_messages_change(messages.get())
+    on_book_queue_change(book_queue.get())
+    # These two keep themselves up to date
+    file_list_container.add_child(FilePanel())
+    input_files_container.add_child(InputFilesPanel())
 
     return ui.Column(
         children=[
@@ -86,6 +106,7 @@ def App() -> ui.Column:
                     input_files_container,
                 ]
             ),
+            queue_container,
             messages_container,
         ]
     )